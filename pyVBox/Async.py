@@ -0,0 +1,69 @@
+"""Support for the coroutine (*Async()) methods of pyVBox
+
+The coroutines run on trollius, the Python 2 port of asyncio, which is
+imported the first time one of them runs so pyVBox doesn't require it
+otherwise. With trollius, a coroutine is waited for with From():
+
+    import trollius
+    from trollius import From
+
+    @trollius.coroutine
+    def start(vm):
+        yield From(vm.powerOnAsync())
+        yield From(vm.waitUntilRunningAsync())
+
+Cancelling the task waiting for a coroutine that tracks a VirtualBox
+Progress cancels the Progress too (see Progress.waitAsync())."""
+
+import VirtualBoxException
+
+# Seconds between polls of a Progress, starting at POLL_MIN and
+# doubling up to POLL_MAX.
+POLL_MIN = 0.05
+POLL_MAX = 1.0
+
+def getAsyncio():
+    """Return the trollius module.
+
+    Raises VirtualBoxException if trollius isn't installed."""
+    try:
+        import trollius
+    except ImportError:
+        raise VirtualBoxException.VirtualBoxException(
+            "pyVBox coroutines require trollius (pip install trollius)")
+    return trollius
+
+def waitUntil(vbox, condition, timeout=None, id=None):
+    """Coroutine waiting until condition() returns True.
+
+    The asynchronous form of VirtualBox.waitUntil(): condition is
+    checked when the EventPump of vbox delivers an event for the object
+    with the given UUID, or after EVENT_WAIT_INTERVAL seconds without
+    one. Returns True once condition() is True, False if timeout
+    seconds pass first."""
+    from VirtualBox import EVENT_WAIT_INTERVAL
+    asyncio = getAsyncio()
+    loop = asyncio.get_event_loop()
+    # Set from the pump thread when an event arrives
+    woken = [asyncio.Future(loop=loop)]
+    def wake(future):
+        if not future.done():
+            future.set_result(None)
+    subscription = vbox.getEventPump().subscribe(
+        lambda event: loop.call_soon_threadsafe(wake, woken[0]), id=id)
+    try:
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            woken[0] = asyncio.Future(loop=loop)
+            if condition():
+                raise asyncio.Return(True)
+            wait = EVENT_WAIT_INTERVAL
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.Return(False)
+                wait = min(wait, remaining)
+            yield asyncio.From(asyncio.wait([woken[0]], loop=loop,
+                                            timeout=wait))
+    finally:
+        subscription.cancel()
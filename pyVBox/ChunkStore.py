@@ -0,0 +1,254 @@
+"""Deduplicating store of disk image backups
+
+A ChunkStore is a directory holding disk images split into chunks.
+Each unique chunk is stored once, named by its hash, and each backup
+is a manifest listing the hashes of its chunks in order. Backing up
+an image again only writes the chunks that changed."""
+
+from Medium import Medium
+from Record import Record
+import VirtualBoxException
+
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+# Version of the manifests written by ChunkStore
+FORMAT_VERSION = 1
+
+class ChunkStore(object):
+    """Directory of chunks and the manifests of backups made from them.
+
+    Chunks are kept in chunks/ under the hex digest of their contents,
+    manifests in manifests/ as JSON. Chunks of all zeros aren't stored
+    at all, so sparse images stay small and are restored sparse."""
+
+    # Bytes per chunk of new backups
+    CHUNK_SIZE = 1024 * 1024
+
+    # hashlib algorithm naming chunks
+    HASH = "sha256"
+
+    # Fields of the Records returned by backup()
+    _statsFields = ("name", "size", "chunks", "newChunks", "zeroChunks",
+                    "bytesWritten", "seconds")
+
+    def __init__(self, path, chunkSize=None):
+        self.path = path
+        self.chunkSize = chunkSize if chunkSize else self.CHUNK_SIZE
+
+    #
+    # Backing up and restoring
+    #
+
+    def backup(self, source, name=None, callback=None):
+        """Store the image at path source under the given name.
+
+        name defaults to the basename of source with the time appended.
+        If callback is not None, callback(bytesRead, size) is called
+        after each chunk. Returns a Record with the name, size, chunks,
+        newChunks (chunks written), zeroChunks, bytesWritten and
+        seconds of the backup."""
+        if name is None:
+            name = "%s-%s" % (os.path.basename(source),
+                              time.strftime("%Y%m%d-%H%M%S"))
+        if self.hasManifest(name):
+            raise VirtualBoxException.VirtualBoxException(
+                "Backup %s already exists in %s" % (name, self.path))
+        started = time.time()
+        size = os.path.getsize(source)
+        zero = "\0" * self.chunkSize
+        chunks = []
+        newChunks = zeroChunks = bytesWritten = 0
+        with open(source, "rb") as f:
+            while True:
+                data = f.read(self.chunkSize)
+                if not data:
+                    break
+                if data == zero[:len(data)]:
+                    # Left as a hole on restore
+                    chunks.append(None)
+                    zeroChunks += 1
+                else:
+                    digest = hashlib.new(self.HASH, data).hexdigest()
+                    if self._writeChunk(digest, data):
+                        newChunks += 1
+                        bytesWritten += len(data)
+                    chunks.append(digest)
+                if callback is not None:
+                    callback(f.tell(), size)
+        self._writeFile(self._getManifestPath(name), json.dumps({
+                    "format" : FORMAT_VERSION,
+                    "name" : name,
+                    "source" : os.path.abspath(source),
+                    "created" : started,
+                    "size" : size,
+                    "chunkSize" : self.chunkSize,
+                    "hash" : self.HASH,
+                    "chunks" : chunks,
+                    }, sort_keys=True))
+        return Record(self._statsFields,
+                      (name, size, len(chunks), newChunks, zeroChunks,
+                       bytesWritten, time.time() - started))
+
+    def backupMedium(self, medium, name=None, callback=None):
+        """Store the contents of the given Medium under name.
+
+        A differencing medium only holds changes to its parent, so it
+        is first cloned, which flattens it, to a temporary image in
+        the store. The image is deleted afterwards. name defaults to
+        the name of medium without extension and the time appended.
+        See backup() for callback and the Record returned."""
+        if name is None:
+            name = "%s-%s" % (os.path.splitext(medium.basename())[0],
+                              time.strftime("%Y%m%d-%H%M%S"))
+        if not medium.isDifferencing():
+            return self.backup(medium.location, name, callback)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        directory = tempfile.mkdtemp(dir=self.path, suffix=".tmp")
+        try:
+            flat = Medium.create(os.path.join(directory, medium.basename()))
+            try:
+                medium.cloneTo(flat)
+                return self.backup(flat.location, name, callback)
+            finally:
+                flat.deleteStorage()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def restore(self, name, target, callback=None):
+        """Reassemble the image of backup name at path target.
+
+        Runs of zeros are left as holes, so target is sparse where the
+        filesystem allows. If callback is not None, callback(bytesDone,
+        size) is called after each chunk. Raises VirtualBoxException,
+        and removes target, if a chunk is missing or corrupt."""
+        manifest = self.getManifest(name)
+        if os.path.exists(target):
+            raise VirtualBoxException.VirtualBoxException(
+                "Cannot restore to %s - file already exists." % target)
+        chunkSize = manifest["chunkSize"]
+        f = open(target, "wb")
+        try:
+            with f:
+                for index, digest in enumerate(manifest["chunks"]):
+                    if digest is not None:
+                        f.seek(index * chunkSize)
+                        f.write(self._readChunk(digest, manifest["hash"]))
+                    if callback is not None:
+                        callback(min((index + 1) * chunkSize,
+                                     manifest["size"]), manifest["size"])
+                # Extends the file over trailing holes
+                f.truncate(manifest["size"])
+        except:
+            # Don't leave a partial image behind, without hiding the
+            # reason it is partial.
+            excInfo = sys.exc_info()
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+            raise excInfo[0], excInfo[1], excInfo[2]
+
+    def verify(self, name):
+        """Check all chunks of backup name are present and intact.
+
+        Returns list of hashes of chunks missing or corrupt."""
+        manifest = self.getManifest(name)
+        bad = []
+        for digest in set(manifest["chunks"]) - set([None]):
+            try:
+                self._readChunk(digest, manifest["hash"])
+            except VirtualBoxException.VirtualBoxException:
+                bad.append(digest)
+        return sorted(bad)
+
+    #
+    # Manifests
+    #
+
+    def getManifest(self, name):
+        """Return the manifest of backup name as a dictionary.
+
+        Raises VirtualBoxObjectNotFoundException if there is none."""
+        try:
+            with open(self._getManifestPath(name)) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            raise VirtualBoxException.VirtualBoxObjectNotFoundException(
+                "No backup named %s in %s" % (name, self.path))
+        if manifest.get("format") != FORMAT_VERSION:
+            raise VirtualBoxException.VirtualBoxException(
+                "Backup %s has unknown format %s" % (name,
+                                                     manifest.get("format")))
+        return manifest
+
+    def hasManifest(self, name):
+        """Is there a backup with the given name?"""
+        return os.path.exists(self._getManifestPath(name))
+
+    def getNames(self):
+        """Return sorted list of the names of all backups."""
+        directory = os.path.join(self.path, "manifests")
+        if not os.path.isdir(directory):
+            return []
+        return sorted([os.path.splitext(filename)[0]
+                       for filename in os.listdir(directory)
+                       if filename.endswith(".json")])
+
+    #
+    # Chunks
+    #
+
+    def hasChunk(self, digest):
+        """Is the chunk with the given hash stored?"""
+        return os.path.exists(self._getChunkPath(digest))
+
+    def _getChunkPath(self, digest):
+        # Spread chunks over subdirectories to keep directories small
+        return os.path.join(self.path, "chunks", digest[:2], digest)
+
+    def _getManifestPath(self, name):
+        return os.path.join(self.path, "manifests", name + ".json")
+
+    def _writeChunk(self, digest, data):
+        """Store data under digest unless already stored.
+
+        Returns True if it was written."""
+        if self.hasChunk(digest):
+            return False
+        self._writeFile(self._getChunkPath(digest), data)
+        return True
+
+    def _readChunk(self, digest, hash):
+        """Return data of the chunk with digest, checking it."""
+        try:
+            with open(self._getChunkPath(digest), "rb") as f:
+                data = f.read()
+        except IOError:
+            raise VirtualBoxException.VirtualBoxException(
+                "Chunk %s missing from %s" % (digest, self.path))
+        if hashlib.new(hash, data).hexdigest() != digest:
+            raise VirtualBoxException.VirtualBoxException(
+                "Chunk %s in %s is corrupt" % (digest, self.path))
+        return data
+
+    def _writeFile(self, path, data):
+        """Write data to path, so readers never see a partial file."""
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        fd, tmpPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.rename(tmpPath, path)
+        except:
+            os.remove(tmpPath)
+            raise
@@ -0,0 +1,184 @@
+"""Table of VirtualBox constants
+
+The table is loaded once, either from VirtualBox or from a file
+previously written by Constants.save(). Set PYVBOX_CONSTANTS to the
+path of such a file to use it instead of initializing XPCOM."""
+
+import json
+import os
+
+# Version of the file format written by Constants.save()
+FORMAT_VERSION = 1
+
+class Enum(object):
+    """Values of one VirtualBox enumeration.
+
+    For example Constants.MachineState.Running is the same as
+    Constants.MachineState_Running."""
+    def __init__(self, name, values):
+        self._name = name
+        self._values = dict(values)
+        self._names = {}
+        for valueName, value in self._values.items():
+            if self._names.has_key(value) and self._isRangeMarker(valueName):
+                continue
+            self._names[value] = valueName
+
+    @staticmethod
+    def _isRangeMarker(name):
+        """Is this name an alias marking a range, e.g. FirstOnline?"""
+        return name.startswith("First") or name.startswith("Last")
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError("%s.%s not found" % (self._name, name))
+
+    def __contains__(self, value):
+        return self._names.has_key(value)
+
+    def __iter__(self):
+        return iter(self._values.items())
+
+    def name_of(self, value):
+        """Return the name of the given value."""
+        try:
+            return self._names[value]
+        except KeyError:
+            raise ValueError("Unknown %s value %r" % (self._name, value))
+
+    def value_of(self, name):
+        """Return the value with the given name."""
+        try:
+            return self._values[name]
+        except KeyError:
+            raise ValueError("Unknown %s name \"%s\"" % (self._name, name))
+
+    def coerce(self, value):
+        """Return value as a value of the enumeration.
+
+        The webservice returns enumeration values as their names, these
+        are converted to the value with that name. Other values are
+        returned as they are."""
+        if isinstance(value, basestring):
+            return self.value_of(value)
+        return value
+
+    def names(self):
+        """Return list of names in the enumeration."""
+        return self._values.keys()
+
+    def items(self):
+        """Return list of (name, value) tuples."""
+        return self._values.items()
+
+class Constants:
+    """VirtualBox constants, e.g. Constants.MachineState_Running.
+
+    Enumerations are also available by name, e.g. Constants.MachineState,
+    see Enum."""
+    # Enumeration name -> { value name -> value }
+    _table = None
+    # "Enum_Name" -> value
+    _flat = None
+    # Enumeration name -> Enum
+    _enums = None
+    # VirtualBox version and revision the table came from, if known
+    _version = None
+    _revision = None
+
+    class __metaclass__(type):
+        def __getattr__(cls, name):
+            if cls._table is None:
+                cls._loadDefault()
+            if cls._flat.has_key(name):
+                return cls._flat[name]
+            if cls._enums.has_key(name):
+                return cls._enums[name]
+            if cls._table:
+                raise AttributeError("%s.%s not found" % (cls.__name__,
+                                                          name))
+            # vboxapi didn't give us a table, fall back to asking it
+            # for each name (and remember the answer).
+            try:
+                value = getattr(cls._getManager().constants, name)
+            except AttributeError as e:
+                raise AttributeError("%s.%s not found" % (cls.__name__,
+                                                          name))
+            cls._flat[name] = value
+            return value
+
+    @classmethod
+    def _loadDefault(cls):
+        """Load table from PYVBOX_CONSTANTS or from VirtualBox."""
+        path = os.environ.get("PYVBOX_CONSTANTS")
+        if path:
+            cls.load(path)
+        else:
+            cls.loadFromVirtualBox()
+
+    @classmethod
+    def _getManager(cls):
+        """Return the shared VirtualBoxManager."""
+        from VirtualBoxManager import VirtualBoxManager
+        return VirtualBoxManager.getDefault()
+
+    @classmethod
+    def _setTable(cls, table, version=None, revision=None):
+        """Set the table of constants."""
+        flat = {}
+        enums = {}
+        for enumName, values in table.items():
+            for valueName, value in values.items():
+                flat["%s_%s" % (enumName, valueName)] = value
+            enums[enumName] = Enum(enumName, values)
+        cls._flat = flat
+        cls._enums = enums
+        cls._version = version
+        cls._revision = revision
+        cls._table = table
+
+    @classmethod
+    def loadFromVirtualBox(cls):
+        """Load table from VirtualBox."""
+        manager = cls._getManager()
+        vbox = manager.getIVirtualBox()
+        # vboxapi keeps all the constants as a dictionary of
+        # dictionaries in the VirtualBoxReflectionInfo class.
+        table = getattr(manager.constants, "_Values", {})
+        cls._setTable(dict([(name, dict(values))
+                            for name, values in table.items()]),
+                      vbox.version, vbox.revision)
+
+    @classmethod
+    def load(cls, path):
+        """Load table from a file written by save()."""
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("format", None) != FORMAT_VERSION:
+            raise ValueError("%s: unsupported constants format %s" %
+                             (path, data.get("format")))
+        cls._setTable(data["constants"],
+                      data.get("version"), data.get("revision"))
+
+    @classmethod
+    def save(cls, path):
+        """Save table to a file to be read with load()."""
+        if cls._table is None:
+            cls._loadDefault()
+        data = {
+            "format" : FORMAT_VERSION,
+            "version" : cls._version,
+            "revision" : cls._revision,
+            "constants" : cls._table,
+            }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+    @classmethod
+    def getVersion(cls):
+        """Return (version, revision) of VirtualBox the table came from."""
+        if cls._table is None:
+            cls._loadDefault()
+        return (cls._version, cls._revision)
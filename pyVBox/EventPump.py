@@ -0,0 +1,214 @@
+"""Background thread routing VirtualBox events to subscribers"""
+
+import VirtualBoxException
+from VirtualBoxManager import VirtualBoxManager
+
+import Queue
+import sys
+import threading
+import traceback
+
+class EventPump(object):
+    """Thread reading VirtualBox events and routing them to subscribers.
+
+    There is one EventPump for each VirtualBox (see
+    VirtualBox.getEventPump()). It reads the events of the single
+    listener of the VirtualBoxMonitor, a batch at a time, and passes
+    each one to the subscribers for its object UUID and event type.
+    Any number of machines can be watched with one thread and one
+    listener.
+
+    Events are passed to subscribers as Records with the event type,
+    the UUID of the machine or medium as id, and the event attributes
+    (see VirtualBoxMonitor._eventHandlers). Subscribers are called in
+    the pump thread and shouldn't block.
+    """
+
+    # Milliseconds the pump thread waits for events before checking
+    # whether it has been stopped.
+    WAIT_TIMEOUT = 1000
+
+    def __init__(self, vbox):
+        self._vbox = vbox
+        self._lock = threading.Lock()
+        # (id, type) -> list of Subscriptions, None matches anything
+        self._subscriptions = {}
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start the pump thread if it isn't running."""
+        with self._lock:
+            if self.isRunning():
+                return
+            self._vbox.getMonitor()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name="pyVBox EventPump")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop the pump thread and wait for it to finish."""
+        self._stopped.set()
+        thread = self._thread
+        if (thread is not None) and \
+                (thread is not threading.current_thread()):
+            thread.join()
+
+    def isRunning(self):
+        """Is the pump thread running?"""
+        return (self._thread is not None) and self._thread.is_alive() \
+            and not self._stopped.is_set()
+
+    #
+    # Subscribing
+    #
+
+    def subscribe(self, callback, id=None, type=None):
+        """Call callback(event) for each event matching id and type.
+
+        id is a machine or medium UUID and type a VBoxEventType value.
+        None matches any. Returns a Subscription."""
+        subscription = Subscription(self, callback, id, type)
+        with self._lock:
+            self._subscriptions.setdefault((id, type),
+                                           []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop passing events to the given Subscription."""
+        key = (subscription.id, subscription.type)
+        with self._lock:
+            subscriptions = self._subscriptions.get(key, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(key, None)
+
+    def queue(self, id=None, type=None, maxsize=0):
+        """Return an EventQueue receiving events matching id and type.
+
+        If maxsize is greater than zero, events arriving while the
+        queue is full are dropped."""
+        queue = EventQueue(maxsize)
+        queue._subscription = self.subscribe(queue._receive, id, type)
+        return queue
+
+    def future(self, id=None, type=None, predicate=None):
+        """Return an EventFuture for the next event matching id and type.
+
+        If predicate is not None, only events for which predicate(event)
+        is True match."""
+        future = EventFuture(predicate)
+        future._subscription = self.subscribe(future._set, id, type)
+        return future
+
+    def dispatch(self, event):
+        """Pass event to its subscribers."""
+        keys = [(event.id, event.type), (event.id, None),
+                (None, event.type), (None, None)]
+        with self._lock:
+            subscriptions = []
+            for key in keys:
+                subscriptions.extend(self._subscriptions.get(key, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.callback(event)
+            except Exception:
+                # Don't let one subscriber stop the others getting
+                # their events.
+                traceback.print_exc(file=sys.stderr)
+
+    def getSubscriptionCount(self):
+        """Return number of active subscriptions."""
+        with self._lock:
+            return sum([len(s) for s in self._subscriptions.values()])
+
+    def _run(self):
+        """Pump thread: read and dispatch events until stopped."""
+        monitor = self._vbox.getMonitor()
+        with VirtualBoxManager.using(self._vbox._manager):
+            while not self._stopped.is_set():
+                try:
+                    monitor.waitForEvents(self.WAIT_TIMEOUT)
+                except VirtualBoxException.VirtualBoxException:
+                    traceback.print_exc(file=sys.stderr)
+                    self._stopped.wait(self.WAIT_TIMEOUT / 1000.0)
+
+class Subscription(object):
+    """Subscription to events from an EventPump, see EventPump.subscribe()."""
+    def __init__(self, pump, callback, id, type):
+        self.pump = pump
+        self.callback = callback
+        self.id = id
+        self.type = type
+
+    def cancel(self):
+        """Stop receiving events."""
+        self.pump.unsubscribe(self)
+
+class EventQueue(Queue.Queue):
+    """Queue of events from an EventPump, see EventPump.queue()."""
+    _subscription = None
+
+    def _receive(self, event):
+        try:
+            self.put_nowait(event)
+        except Queue.Full:
+            pass
+
+    def cancel(self):
+        """Stop receiving events."""
+        self._subscription.cancel()
+
+class EventFuture(object):
+    """The next matching event from an EventPump, see EventPump.future()."""
+    _subscription = None
+
+    def __init__(self, predicate=None):
+        self._predicate = predicate
+        self._done = threading.Event()
+        self._event = None
+        self._cancelled = False
+
+    def _set(self, event):
+        if self._done.is_set():
+            return
+        if (self._predicate is not None) and not self._predicate(event):
+            return
+        self._event = event
+        self._done.set()
+        self._subscription.cancel()
+
+    def done(self):
+        """Has an event arrived, or has the future been cancelled?"""
+        return self._done.is_set()
+
+    def cancelled(self):
+        """Was the future cancelled?"""
+        return self._cancelled
+
+    def cancel(self):
+        """Stop waiting for the event.
+
+        Returns False if the event had already arrived."""
+        if self._done.is_set():
+            return self._cancelled
+        self._cancelled = True
+        self._subscription.cancel()
+        self._done.set()
+        return True
+
+    def result(self, timeout=None):
+        """Return the event, waiting up to timeout seconds for it.
+
+        Raises VirtualBoxTimeoutException if timeout passes first and
+        VirtualBoxOperationAborted if the future was cancelled."""
+        if not self._done.wait(timeout):
+            raise VirtualBoxException.VirtualBoxTimeoutException(
+                "No event after %s seconds" % timeout)
+        if self._cancelled:
+            raise VirtualBoxException.VirtualBoxOperationAborted(
+                "Waiting for event was cancelled")
+        return self._event
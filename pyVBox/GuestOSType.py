@@ -3,6 +3,8 @@
 from Wrapper import Wrapper
 
 class GuestOSType(Wrapper):
+    __slots__ = ()
+
    # Properties directly inherited from IMachine
     _passthruProperties = [
         "adapterType",
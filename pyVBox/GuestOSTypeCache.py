@@ -0,0 +1,115 @@
+"""Cache of guest OS types, in memory and on disk
+
+The guest OS types only change when VirtualBox is upgraded, so they
+are read from VirtualBox once per version and revision and saved in
+a file in PYVBOX_CACHE_DIR (~/.pyVBox by default) for later runs."""
+
+from GuestOSType import GuestOSType
+from Record import Record
+
+import json
+import os
+import os.path
+import tempfile
+import threading
+
+# Version of the file format written by GuestOSTypeCache
+FORMAT_VERSION = 1
+
+class GuestOSTypeCache(object):
+    """Guest OS types for each VirtualBox version and revision.
+
+    The GuestOSTypes returned wrap Records rather than live
+    IGuestOSType instances, so they may be shared between threads and
+    VirtualBoxManagers."""
+    # (version, revision) -> (list of GuestOSTypes, { id -> GuestOSType })
+    _types = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def getAll(cls, vbox):
+        """Return list of GuestOSTypes of the given VirtualBox."""
+        return cls._get(vbox)[0]
+
+    @classmethod
+    def find(cls, vbox, osTypeId):
+        """Return the GuestOSType with the given id, None if not found."""
+        return cls._get(vbox)[1].get(osTypeId)
+
+    @classmethod
+    def clear(cls):
+        """Discard the types held in memory."""
+        with cls._lock:
+            cls._types.clear()
+
+    @classmethod
+    def getPath(cls, version, revision):
+        """Return path of the cache file for version and revision."""
+        directory = os.environ.get("PYVBOX_CACHE_DIR",
+                                   os.path.expanduser("~/.pyVBox"))
+        return os.path.join(directory,
+                            "guestOSTypes-%s-r%s.json" % (version, revision))
+
+    @classmethod
+    def _get(cls, vbox):
+        """Return (list, dictionary) of GuestOSTypes of vbox."""
+        key = (vbox.version, vbox.revision)
+        with cls._lock:
+            if not cls._types.has_key(key):
+                path = cls.getPath(*key)
+                records = cls._load(path)
+                if records is None:
+                    records = cls._read(vbox)
+                    cls._save(path, key, records)
+                types = [GuestOSType(record) for record in records]
+                cls._types[key] = (types,
+                                   dict([(t.id, t) for t in types]))
+            return cls._types[key]
+
+    @staticmethod
+    def _read(vbox):
+        """Return list of Records of the guest OS types of vbox."""
+        fields = GuestOSType._passthruProperties
+        records = []
+        for iosType in vbox._getArray("guestOSTypes"):
+            # Not every VirtualBox version has every property
+            records.append(Record(fields,
+                                  [getattr(iosType, field, None)
+                                   for field in fields]))
+        return records
+
+    @staticmethod
+    def _load(path):
+        """Return list of Records saved in path, None if not usable."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if data.get("format", None) != FORMAT_VERSION:
+            return None
+        fields = GuestOSType._passthruProperties
+        return [Record(fields, [osType.get(field) for field in fields])
+                for osType in data["guestOSTypes"]]
+
+    @staticmethod
+    def _save(path, key, records):
+        """Save records to path. Failure leaves the cache in memory only."""
+        data = {
+            "format" : FORMAT_VERSION,
+            "version" : key[0],
+            "revision" : key[1],
+            "guestOSTypes" : [record.asDict() for record in records],
+            }
+        directory = os.path.dirname(path)
+        try:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            # Write to a temporary file first so concurrent readers
+            # never see a partial file.
+            fd, tmpPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.rename(tmpPath, path)
+        except (IOError, OSError):
+            pass
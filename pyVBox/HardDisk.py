@@ -1,8 +1,8 @@
 """Presentation of Medium representing HardDisk"""
 
+from Constants import Constants
 from Medium import Device
 import VirtualBoxException
-from VirtualBoxManager import Constants
 
 class HardDisk(Device):
     type = Constants.DeviceType_HardDisk
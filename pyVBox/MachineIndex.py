@@ -0,0 +1,116 @@
+"""Index of registered virtual machines by name and UUID"""
+
+import VirtualBoxException
+
+import threading
+
+class MachineIndex(object):
+    """Registered machines of a VirtualBox, indexed by name and UUID.
+
+    The index is built from one enumeration of VirtualBox.machines the
+    first time it is searched, and kept current from machine registered
+    and data changed events (see VirtualBoxMonitor), which the EventPump
+    started by VirtualBox.getMachineIndex() delivers, as well as by
+    VirtualMachine.register() and unregister().
+
+    Building costs a round trip per machine, so it only pays off for
+    repeated lookups. Until VirtualBox.getMachineIndex() has been
+    called, VirtualMachine.find() asks VirtualBox directly.
+
+    A machine found in the index is returned without a round trip to
+    VirtualBox. A miss is not authoritative, callers should ask
+    VirtualBox and add() what they find. Changes made by other
+    processes are only seen once the events announcing them have been
+    delivered."""
+
+    def __init__(self, vbox):
+        self._vbox = vbox
+        self._lock = threading.RLock()
+        # UUID -> VirtualMachine, None until built
+        self._byId = None
+        # Name -> UUID, and UUID -> name
+        self._byName = {}
+        self._nameById = {}
+
+    def find(self, nameOrId):
+        """Return the VirtualMachine with the given name or UUID.
+
+        Returns None if the machine isn't in the index."""
+        with self._lock:
+            self._build()
+            vm = self._byId.get(nameOrId)
+            if vm is None:
+                id = self._byName.get(nameOrId)
+                if id is not None:
+                    vm = self._byId.get(id)
+            return vm
+
+    def contains(self, id):
+        """Is the machine with the given UUID in the index?"""
+        with self._lock:
+            self._build()
+            return self._byId.has_key(id)
+
+    def add(self, vm):
+        """Add the given VirtualMachine to the index.
+
+        Does nothing if the index hasn't been built, the machine will
+        be found when it is."""
+        with self._lock:
+            if self._byId is None:
+                return
+            self._add(vm)
+
+    def remove(self, id):
+        """Remove the machine with the given UUID from the index."""
+        with self._lock:
+            if self._byId is None:
+                return
+            self._byId.pop(id, None)
+            self._forgetName(id)
+
+    def forgetName(self, id):
+        """Forget the name of the machine with the given UUID.
+
+        Used when the name may have changed. The machine is found by
+        name again once a lookup has missed and add()ed it."""
+        with self._lock:
+            if self._byId is None:
+                return
+            self._forgetName(id)
+
+    def clear(self):
+        """Discard the index, it is built again on next use."""
+        with self._lock:
+            self._byId = None
+            self._byName = {}
+            self._nameById = {}
+
+    def _build(self):
+        """Build the index if it hasn't been."""
+        if self._byId is not None:
+            return
+        self._byId = {}
+        self._byName = {}
+        self._nameById = {}
+        for vm in self._vbox.iterMachines():
+            self._add(vm)
+
+    def _add(self, vm):
+        """Add vm to the index, which must be built and locked."""
+        id = vm.id
+        self._forgetName(id)
+        self._byId[id] = vm
+        try:
+            name = vm.name
+        except VirtualBoxException.VirtualBoxException:
+            # Inaccessible machines have no name
+            return
+        self._byName[name] = id
+        self._nameById[id] = name
+
+    def _forgetName(self, id):
+        """Remove name entry for id, the index must be locked."""
+        name = self._nameById.pop(id, None)
+        if (name is not None) and (self._byName.get(name) == id):
+            del self._byName[name]
@@ -1,9 +1,11 @@
 """Wrapper around IMedium object"""
 
+import Async
+from Constants import Constants
 from Progress import Progress
 import UUID
 import VirtualBoxException
-from VirtualBoxManager import Constants, VirtualBoxManager
+from VirtualBoxManager import VirtualBoxManager
 from Wrapper import Wrapper
 
 import os.path
@@ -21,6 +23,7 @@ class Device(object):
     @classmethod
     def class_from_type(cls, type):
         """Given a type, return appropriate class"""
+        type = Constants.DeviceType.coerce(type)
         for cls in cls.__subclasses__():
             if type == cls.type:
                 return cls
@@ -73,6 +76,8 @@ class SharedFolder(Device):
     
 
 class Medium(Wrapper):
+    __slots__ = ()
+
     # Properties directly inherited from IMedium
     _passthruProperties = [
         "autoResize",
@@ -90,13 +95,29 @@ class Medium(Wrapper):
         "type"
         ]
 
+    # Cached properties and their time to live in seconds. Those with
+    # a time to live are only cached while events are received (see
+    # Wrapper).
+    _cachedProperties = {
+        "id" : None,
+        "format" : None,
+        "location" : 10,
+        "logicalSize" : 10,
+        "name" : 10,
+        "size" : 10,
+        "state" : 1,
+        }
+
+    _enumProperties = {
+        "state" : "MediumState",
+        "type" : "MediumType",
+        }
+
     # These properties are converted by given function before being returned.
     _wrappedProperties = [
         ("deviceType", Device.class_from_type),
         ]
 
-    _manager = VirtualBoxManager()
-
     def __init__(self, imedium):
         """Return a Medium wrapper around given IMedium instance"""
         assert(imedium is not None)
@@ -119,7 +140,7 @@ class Medium(Wrapper):
                                                deviceType,
                                                accessMode,
                                                forceNewUuid)
-        return Medium(medium)
+        return Medium.intern(medium)
 
     @classmethod
     def find(cls, path, deviceType):
@@ -128,7 +149,7 @@ class Medium(Wrapper):
             if not UUID.isUUID(path):
                 path = cls._canonicalizeMediumPath(path)
             medium = cls._getVBox().findMedium(path, deviceType)
-        return Medium(medium)
+        return Medium.intern(medium)
 
     def clone(self, path, newUUID=True, wait=True):
         """Create a clone of this medium at the given location.
@@ -190,6 +211,28 @@ class Medium(Wrapper):
         """Return the dirname of the location of the storage unit holding medium data."""
         return os.path.dirname(self.location)
 
+    def getParent(self):
+        """Return the Medium this differencing medium is based on, None if it is not one."""
+        with VirtualBoxException.ExceptionHandler():
+            iparent = self.getIMedium().parent
+        if iparent is None:
+            return None
+        return Medium.intern(iparent, self._manager)
+
+    def isDifferencing(self):
+        """Is this a differencing medium, holding only changes to its parent?"""
+        return self.getParent() is not None
+
+    def getFilesystemDevice(self):
+        """Return the ID of the filesystem device holding medium data.
+
+        Returns None if the location can't be examined, e.g. if it is
+        on a remote VirtualBox host."""
+        try:
+            return os.stat(self.location).st_dev
+        except OSError:
+            return None
+
     #
     # Internal string representations 
     #
@@ -207,6 +250,7 @@ class Medium(Wrapper):
     def cloneTo(self, target, variant=None, parent=None, wait=True):
         """Clone to the target hard drive.
         
+        The clone is tracked in the OperationHistory (see Progress.track()).
         Returns Progress instance. If wait is True, does not return until process completes."""
         if variant is None:
             variant = Constants.MediumVariant_Standard
@@ -214,20 +258,81 @@ class Medium(Wrapper):
             progress = self.getIMedium().cloneTo(target.getIMedium(),
                                                  variant,
                                                  parent)
-        progress = Progress(progress)
+            size = self.size
+            location = target.location
+        progress = Progress(progress).track("cloneTo", size, location)
         if wait:
             progress.waitForCompletion()
+            target.invalidate()
         return progress
 
+    def cloneAsync(self, path, newUUID=True):
+        """Coroutine form of clone().
+
+        Cancelling it cancels the clone. Returns the Progress."""
+        asyncio = Async.getAsyncio()
+        progress = self.clone(path, newUUID=newUUID, wait=False)
+        yield asyncio.From(progress.waitAsync())
+        raise asyncio.Return(progress)
+
+    def cloneToAsync(self, target, variant=None, parent=None):
+        """Coroutine form of cloneTo().
+
+        Cancelling it cancels the clone. Returns the Progress."""
+        asyncio = Async.getAsyncio()
+        progress = self.cloneTo(target, variant, parent, wait=False)
+        try:
+            yield asyncio.From(progress.waitAsync())
+        finally:
+            target.invalidate()
+        raise asyncio.Return(progress)
+
     def createBaseStorage(self, size, variant=None, wait=True):
         """Create storage for the drive of the given size (in MB).
 
+        The creation is tracked in the OperationHistory (see Progress.track()).
         Returns Progress instance. If wait is True, does not return until process completes."""
         if variant is None:
             variant = Constants.MediumVariant_Standard
         with VirtualBoxException.ExceptionHandler():
             progress = self.getIMedium().createBaseStorage(size, variant)
-        progress = Progress(progress)
+            location = self.location
+        progress = Progress(progress).track("createBaseStorage",
+                                            size * 1024 * 1024, location)
+        if wait:
+            progress.waitForCompletion()
+            self.invalidate()
+        return progress
+
+    def createDiffStorage(self, target, variant=None, wait=True):
+        """Create target as a differencing hard drive based on this medium.
+
+        target should be a medium created with create(). The new
+        medium holds only the changes made to it, so creating it costs
+        the same whatever the size of this medium. While it exists,
+        this medium must not be changed.
+
+        The creation is tracked in the OperationHistory (see Progress.track()).
+        Returns Progress instance. If wait is True, does not return until process completes."""
+        if variant is None:
+            variant = Constants.MediumVariant_Standard
+        with VirtualBoxException.ExceptionHandler():
+            progress = self.getIMedium().createDiffStorage(target.getIMedium(),
+                                                           variant)
+            location = target.location
+        progress = Progress(progress).track("createDiffStorage",
+                                            location=location)
+        if wait:
+            progress.waitForCompletion()
+            target.invalidate()
+        return progress
+
+    def deleteStorage(self, wait=True):
+        """Delete the storage of this medium and close it.
+
+        Returns Progress instance. If wait is True, does not return until process completes."""
+        with VirtualBoxException.ExceptionHandler():
+            progress = Progress(self.getIMedium().deleteStorage())
         if wait:
             progress.waitForCompletion()
         return progress
@@ -244,7 +349,7 @@ class Medium(Wrapper):
     @classmethod
     def _getVBox(cls):
         """Return the VirtualBox object associated with this VirtualMachine."""
-        return cls._manager.getIVirtualBox()
+        return VirtualBoxManager.getDefault().getIVirtualBox()
 
 
 
@@ -4,6 +4,8 @@ from Medium import Medium, Device
 from Wrapper import Wrapper
 
 class MediumAttachment(Wrapper):
+    __slots__ = ()
+
     # Properties directly inherited from IMediumAttachment
     _passthruProperties = [
         "controller",
@@ -14,7 +16,7 @@ class MediumAttachment(Wrapper):
         ]
 
     _wrappedProperties = [
-        ( "medium", Medium ),
+        ( "medium", Medium.intern ),
         ( "type", Device.from_type ),
         ]
 
@@ -0,0 +1,304 @@
+"""History of long-running operations, e.g. cloning media
+
+Each tracked operation (see Progress.track()) is recorded with its
+wall time, throughput and the time spent in each of its
+sub-operations. Records are appended to operations.json in
+PYVBOX_CACHE_DIR (~/.pyVBox by default), so later runs can estimate
+how long an operation will take and slower storage can be spotted."""
+
+from Record import Record
+import VirtualBoxException
+
+import json
+import os
+import os.path
+import tempfile
+import threading
+import time
+
+# Version of the records written by OperationHistory
+FORMAT_VERSION = 1
+
+class OperationHistory(object):
+    """Records of completed operations, kept in a file.
+
+    The file holds one JSON object per line and is trimmed to the
+    last MAX_RECORDS records."""
+
+    # Number of records kept
+    MAX_RECORDS = 1000
+
+    # Number of recent records estimates are based on
+    ESTIMATE_RECORDS = 5
+
+    # Fields of the Records of operations
+    _fields = ("operation", "location", "directory", "size", "started",
+               "seconds", "bytesPerSecond", "resultCode", "steps")
+
+    # path -> OperationHistory, see getDefault()
+    _histories = {}
+    _historiesLock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Records read from path, None until first needed
+        self._records = None
+
+    @classmethod
+    def getDefault(cls):
+        """Return the OperationHistory kept in PYVBOX_CACHE_DIR."""
+        path = cls.getPath()
+        with cls._historiesLock:
+            if not cls._histories.has_key(path):
+                cls._histories[path] = cls(path)
+            return cls._histories[path]
+
+    @classmethod
+    def getPath(cls):
+        """Return path of the default history file."""
+        directory = os.environ.get("PYVBOX_CACHE_DIR",
+                                   os.path.expanduser("~/.pyVBox"))
+        return os.path.join(directory, "operations.json")
+
+    def add(self, operation, location=None, size=None, started=None,
+            seconds=None, resultCode=0, steps=()):
+        """Record a completed operation and return its Record.
+
+        operation names the kind of operation, e.g. "cloneTo". location
+        is the medium written. size is the number of bytes processed,
+        if known. steps is a list of (description, seconds) of the
+        sub-operations. Failure to save leaves the record in memory
+        only."""
+        if started is None:
+            started = time.time()
+        if size and seconds:
+            bytesPerSecond = size / float(seconds)
+        else:
+            bytesPerSecond = None
+        directory = os.path.dirname(location) if location else None
+        record = Record(self._fields,
+                        (operation, location, directory, size, started,
+                         seconds, bytesPerSecond, resultCode,
+                         tuple([tuple(step) for step in steps])))
+        with self._lock:
+            records = self._load()
+            records.append(record)
+            if len(records) > 2 * self.MAX_RECORDS:
+                del records[:-self.MAX_RECORDS]
+                self._rewrite(records)
+            else:
+                self._append(record)
+        return record
+
+    def getRecords(self, operation=None, directory=None, successful=True):
+        """Return list of Records of operations, oldest first.
+
+        Only operations of the given kind and written to the given
+        directory are returned, if these are not None. If successful
+        is True, failed operations are left out."""
+        with self._lock:
+            records = list(self._load())
+        return [record for record in records
+                if (((operation is None) or
+                     (record.operation == operation)) and
+                    ((directory is None) or
+                     (record.directory == directory)) and
+                    ((not successful) or (record.resultCode == 0)))]
+
+    def getThroughput(self, operation, directory=None):
+        """Return bytes per second recently achieved by operation.
+
+        This is the median of the last ESTIMATE_RECORDS successful
+        operations of that kind (in directory if not None). Returns
+        None if there are none."""
+        rates = [record.bytesPerSecond
+                 for record in self.getRecords(operation, directory)
+                 if record.bytesPerSecond]
+        return self._median(rates[-self.ESTIMATE_RECORDS:])
+
+    def estimate(self, operation, size=None, directory=None):
+        """Return estimated seconds operation will take, None if unknown.
+
+        With a size, the estimate is based on recent throughput (see
+        getThroughput()), otherwise on recent wall times. Records from
+        directory are preferred, falling back to those of any
+        directory."""
+        for where in ((directory, None) if directory else (None,)):
+            if size:
+                throughput = self.getThroughput(operation, where)
+                if throughput:
+                    return size / throughput
+            else:
+                seconds = self._median(
+                    [record.seconds
+                     for record in self.getRecords(operation, where)
+                     ][-self.ESTIMATE_RECORDS:])
+                if seconds is not None:
+                    return seconds
+        return None
+
+    def clear(self):
+        """Discard all records, including those saved."""
+        with self._lock:
+            self._records = []
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _median(values):
+        """Return median of values, None if there are none."""
+        if not values:
+            return None
+        values = sorted(values)
+        middle = len(values) / 2
+        if len(values) % 2:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2.0
+
+    def _load(self):
+        """Return list of records, reading them from path if needed.
+
+        Lines that cannot be parsed are skipped."""
+        if self._records is None:
+            self._records = []
+            try:
+                with open(self.path) as f:
+                    for line in f:
+                        try:
+                            data = json.loads(line)
+                        except ValueError:
+                            continue
+                        if data.get("format", None) != FORMAT_VERSION:
+                            continue
+                        self._records.append(self._fromDict(data))
+            except IOError:
+                pass
+        return self._records
+
+    def _fromDict(self, data):
+        """Return Record for dictionary read from the file."""
+        data["steps"] = tuple([tuple(step)
+                               for step in data.get("steps", ())])
+        return Record(self._fields,
+                      [data.get(field) for field in self._fields])
+
+    @staticmethod
+    def _toLine(record):
+        """Return line for the file holding record."""
+        data = record.asDict()
+        data["format"] = FORMAT_VERSION
+        return json.dumps(data, sort_keys=True) + "\n"
+
+    def _append(self, record):
+        """Append record to path."""
+        try:
+            self._makeDirectory()
+            with open(self.path, "a") as f:
+                f.write(self._toLine(record))
+        except (IOError, OSError):
+            pass
+
+    def _rewrite(self, records):
+        """Replace contents of path with records."""
+        try:
+            directory = self._makeDirectory()
+            # Write to a temporary file first so concurrent readers
+            # never see a partial file.
+            fd, tmpPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                for record in records:
+                    f.write(self._toLine(record))
+            os.rename(tmpPath, self.path)
+        except (IOError, OSError):
+            pass
+
+    def _makeDirectory(self):
+        """Create directory of path if needed and return it."""
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        return directory
+
+class OperationRecorder(object):
+    """Telemetry of one operation in progress, see Progress.track().
+
+    Each sample() notes the percent complete and the current
+    sub-operation. When the operation is seen to be completed, it is
+    added to the OperationHistory."""
+    def __init__(self, operation, size=None, location=None, history=None):
+        if history is None:
+            history = OperationHistory.getDefault()
+        self.operation = operation
+        self.size = size
+        self.location = location
+        self.history = history
+        self.started = time.time()
+        self.percent = 0
+        # Record of the operation once completed
+        self.record = None
+        self._steps = []
+        # (index, description, start time) of current sub-operation
+        self._step = None
+        self._lock = threading.Lock()
+
+    def sample(self, progress, completed, percent):
+        """Note state of progress, which is completed and percent done."""
+        now = time.time()
+        with self._lock:
+            if self.record is not None:
+                return
+            with VirtualBoxException.ExceptionHandler():
+                index = progress.operation
+                if (self._step is None) or (index != self._step[0]):
+                    description = progress.operationDescription
+            if (self._step is None) or (index != self._step[0]):
+                self._endStep(now)
+                self._step = (index, description, now)
+            self.percent = percent
+            if completed:
+                self._endStep(now)
+                with VirtualBoxException.ExceptionHandler():
+                    resultCode = progress.resultCode
+                self.record = self.history.add(self.operation,
+                                               self.location,
+                                               self.size,
+                                               self.started,
+                                               now - self.started,
+                                               resultCode,
+                                               self._steps)
+
+    def getElapsed(self):
+        """Return seconds since the operation was started."""
+        return time.time() - self.started
+
+    def getThroughput(self):
+        """Return bytes per second so far, None if unknown."""
+        elapsed = self.getElapsed()
+        if not (self.size and self.percent and elapsed):
+            return None
+        return self.size * self.percent / 100.0 / elapsed
+
+    def getETA(self):
+        """Return estimated seconds until completion from the history.
+
+        Returns None if the history has nothing to go by."""
+        if self.record is not None:
+            return 0
+        expected = self.history.estimate(self.operation, self.size,
+                                         self._getDirectory())
+        if expected is None:
+            return None
+        return max(0, expected - self.getElapsed())
+
+    def _getDirectory(self):
+        return os.path.dirname(self.location) if self.location else None
+
+    def _endStep(self, now):
+        """Note the end of the current sub-operation, if any."""
+        if self._step is not None:
+            index, description, start = self._step
+            self._steps.append((description, now - start))
+            self._step = None
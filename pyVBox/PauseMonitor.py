@@ -0,0 +1,103 @@
+"""Measure how long a machine's guest is not running"""
+
+from Constants import Constants
+
+import threading
+import time
+
+class PauseMonitor(object):
+    """Time a machine's guest spends paused, from its state changes.
+
+    Listens to the EventPump for state changes of the machine between
+    start() and stop(), which is meant for a running machine. The
+    guest counts as paused while the machine is in any state but those
+    in which it keeps running, e.g. Paused or Saving, but not
+    LiveSnapshotting. Can be used as a contextmanager, which starts
+    and stops the monitor.
+
+    Times are those at which the events are delivered, so they are
+    accurate to the latency of the EventPump."""
+
+    def __init__(self, machine):
+        self.machine = machine
+        self._lock = threading.Lock()
+        self._subscription = None
+        # Time the current pause started, None if not paused
+        self._pausedSince = None
+        # List of (state, seconds) of completed pauses
+        self._pauses = []
+
+    @staticmethod
+    def _getRunningStates():
+        """Return the machine states in which the guest runs."""
+        return (Constants.MachineState_Running,
+                Constants.MachineState_Teleporting,
+                Constants.MachineState_LiveSnapshotting,
+                Constants.MachineState_DeletingSnapshotOnline)
+
+    def start(self):
+        """Start measuring. Returns self."""
+        pump = self.machine._getVirtualBox().getEventPump()
+        self._subscription = pump.subscribe(
+            self._onStateChange, id=self.machine.id,
+            type=Constants.VBoxEventType_OnMachineStateChanged)
+        # The machine may already be paused
+        self._noteState(self.machine.state)
+        return self
+
+    def stop(self):
+        """Stop measuring. A pause still going on ends now."""
+        if self._subscription is not None:
+            self._subscription.cancel()
+            self._subscription = None
+        with self._lock:
+            if self._pausedSince is not None:
+                self._endPause(time.time())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def isPaused(self):
+        """Is the guest paused, as of the last state change?"""
+        return self._pausedSince is not None
+
+    def getPauses(self):
+        """Return list of (state, seconds) of each pause so far.
+
+        state is the state the machine went into when the pause
+        started."""
+        with self._lock:
+            pauses = list(self._pauses)
+            if self._pausedSince is not None:
+                state, since = self._pausedSince
+                pauses.append((state, time.time() - since))
+        return pauses
+
+    def getPauseTime(self):
+        """Return total seconds the guest was paused."""
+        return sum([seconds for state, seconds in self.getPauses()])
+
+    def getLongestPause(self):
+        """Return seconds of the longest pause, 0 if none."""
+        return max([0] + [seconds for state, seconds in self.getPauses()])
+
+    def _onStateChange(self, event):
+        self._noteState(event.state)
+
+    def _noteState(self, state):
+        """Note the machine went into the given state."""
+        now = time.time()
+        with self._lock:
+            if state in self._getRunningStates():
+                if self._pausedSince is not None:
+                    self._endPause(now)
+            elif self._pausedSince is None:
+                self._pausedSince = (state, now)
+
+    def _endPause(self, now):
+        state, since = self._pausedSince
+        self._pauses.append((state, now - since))
+        self._pausedSince = None
@@ -1,8 +1,13 @@
 """Wrapper around IProgress object"""
 
+import Async
+from OperationHistory import OperationRecorder
+from Record import Record
 import VirtualBoxException
 from Wrapper import Wrapper
 
+import time
+
 class Progress(Wrapper):
     # Properties directly inherited from IProgress
     _passthruProperties = [
@@ -25,19 +30,109 @@ class Progress(Wrapper):
 
     WaitIndefinite = -1
 
+    # Milliseconds between samples of a tracked task, see track()
+    SAMPLE_INTERVAL = 500
+
+    # OperationRecorder of a tracked task
+    _recorder = None
+
     def __init__(self, progress):
         """Return a Progress wrapper around given IProgress instance"""
         self._wrappedInstance = progress
 
+    def track(self, operation, size=None, location=None, history=None):
+        """Record telemetry of the task in an OperationHistory.
+
+        operation names the kind of task, e.g. "cloneTo". size is the
+        number of bytes the task processes and location the medium it
+        writes, if known. history defaults to
+        OperationHistory.getDefault(). The task is sampled whenever it
+        is polled or waited on, and recorded once seen completed.
+
+        Returns this Progress."""
+        self._recorder = OperationRecorder(operation, size, location,
+                                           history)
+        self.poll()
+        return self
+
+    def getRecorder(self):
+        """Return the OperationRecorder of a tracked task, else None."""
+        return self._recorder
+
+    def poll(self):
+        """Return Record with completed and percent of the task.
+
+        Also samples the task if it is tracked."""
+        with VirtualBoxException.ExceptionHandler():
+            completed = self.completed
+            percent = self.percent
+        if self._recorder is not None:
+            self._recorder.sample(self, completed, percent)
+        return Record(("completed", "percent"), (completed, percent))
+
     def waitForCompletion(self, timeout = None):
         """Waits until the task is done (including all sub-operations).
 
         Timeout is in milliseconds, specify None for an indefinite wait."""
         if timeout is None:
             timeout = self.WaitIndefinite
+        if self._recorder is None:
+            with VirtualBoxException.ExceptionHandler():
+                self._wrappedInstance.waitForCompletion(timeout)
+        else:
+            self._waitSampling(timeout)
+        self._checkResult(timeout == self.WaitIndefinite)
+
+    def waitAsync(self):
+        """Coroutine waiting until the task is done.
+
+        The asynchronous form of waitForCompletion(), see Async. Polls
+        the task, backing off from Async.POLL_MIN to Async.POLL_MAX
+        seconds, so the event loop is never blocked waiting. If the
+        coroutine is cancelled, the task is cancelled as well.
+
+        Returns this Progress."""
+        asyncio = Async.getAsyncio()
+        delay = Async.POLL_MIN
+        try:
+            while not self.poll().completed:
+                yield asyncio.From(asyncio.sleep(delay))
+                delay = min(2 * delay, Async.POLL_MAX)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        self._checkResult(True)
+        raise asyncio.Return(self)
+
+    def cancel(self):
+        """Cancel the task if it can be cancelled and isn't completed.
+
+        Returns True if the task was cancelled."""
         with VirtualBoxException.ExceptionHandler():
-            self._wrappedInstance.waitForCompletion(timeout)
-        if (((not self.completed) and (timeout == self.WaitIndefinite)) or
+            if self.completed or not self.cancelable:
+                return False
+            self._wrappedInstance.cancel()
+        return True
+
+    def _waitSampling(self, timeout):
+        """Wait up to timeout milliseconds, sampling the task."""
+        if timeout != self.WaitIndefinite:
+            deadline = time.time() + timeout / 1000.0
+        while not self.poll().completed:
+            wait = self.SAMPLE_INTERVAL
+            if timeout != self.WaitIndefinite:
+                wait = min(wait, int(1000 * (deadline - time.time())))
+                if wait <= 0:
+                    return
+            with VirtualBoxException.ExceptionHandler():
+                self._wrappedInstance.waitForCompletion(wait)
+
+    def _checkResult(self, mustBeCompleted):
+        """Raise VirtualBoxException if the task failed.
+
+        If mustBeCompleted is True, also raise it if the task isn't
+        completed."""
+        if (((not self.completed) and mustBeCompleted) or
             (self.completed and (self.resultCode != 0))):
             # TODO: This is not the right exception to return.
             raise VirtualBoxException.VirtualBoxException(
@@ -0,0 +1,374 @@
+"""Several Progress objects waited on together"""
+
+from Record import Record
+import VirtualBoxException
+
+import sys
+import time
+
+class ProgressGroup(object):
+    """Several VirtualBox tasks waited on together.
+
+    Tasks are added with add(), optionally with a label and the number
+    of bytes they process, which weights them in the aggregate percent
+    and gives throughput in bytes per second. Without sizes, all tasks
+    weigh the same and throughput is in percent per second.
+
+    wait() polls all tasks, adapting the interval between polls to how
+    fast they progress: from MIN_INTERVAL when percent changes quickly,
+    or a task is about to finish, up to MAX_INTERVAL when it doesn't.
+
+    Tasks may also be scheduled with schedule(), to be started by a
+    later poll. At most maxConcurrent scheduled tasks run at once (no
+    limit if None), and only one at a time per resource, e.g. the
+    filesystem devices a task reads from and writes to.
+    """
+
+    # Bounds of the interval between polls, in seconds
+    MIN_INTERVAL = 0.05
+    MAX_INTERVAL = 2.0
+
+    # Fields of the Records returned by getStatus()
+    _statusFields = ("label", "percent", "started", "completed",
+                     "resultCode", "throughput", "eta")
+
+    def __init__(self, progresses=(), maxConcurrent=None):
+        self.maxConcurrent = maxConcurrent
+        self._tasks = []
+        for progress in progresses:
+            self.add(progress)
+
+    def add(self, progress, label=None, size=None):
+        """Add a Progress to the group.
+
+        label defaults to the description of progress. size is the
+        number of bytes the task processes, if known."""
+        if label is None:
+            label = progress.description
+        self._tasks.append(_Task(progress, label, size))
+
+    def schedule(self, start, label, size=None, resource=None):
+        """Add a task to be started by a later poll.
+
+        start is called with no arguments to start the task and must
+        return its Progress. Tasks are started in the order they were
+        scheduled, once fewer than maxConcurrent scheduled tasks are
+        running and no running task has the same resource (unless
+        resource is None). resource may also be a list of resources,
+        none of which may be in use. Once a task has failed, no more are
+        started. If start raises, the task fails with its exception,
+        which wait() raises."""
+        if isinstance(resource, (list, tuple, set, frozenset)):
+            resources = set(resource)
+        else:
+            resources = set([resource])
+        resources.discard(None)
+        self._tasks.append(_Task(None, label, size, start, resources))
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def poll(self):
+        """Read the state of all tasks not yet completed.
+
+        Returns True if all tasks are completed."""
+        now = time.time()
+        for task in self._tasks:
+            task.poll(now)
+        if self._startTasks():
+            now = time.time()
+            for task in self._tasks:
+                task.poll(now)
+        return self.isCompleted()
+
+    def _startTasks(self):
+        """Start the scheduled tasks that may run now.
+
+        None are started once a task has failed. Returns True if any
+        were started."""
+        if self._getFailedTasks():
+            return False
+        running = [task for task in self._tasks
+                   if task.scheduled() and task.isRunning()]
+        busy = set()
+        for task in running:
+            busy.update(task.resources)
+        started = False
+        for task in self._tasks:
+            if (self.maxConcurrent is not None) and \
+                    (len(running) >= self.maxConcurrent):
+                break
+            if not task.isPending():
+                continue
+            if busy.intersection(task.resources):
+                continue
+            if not task.begin():
+                # Failed to start
+                return started
+            running.append(task)
+            busy.update(task.resources)
+            started = True
+        return started
+
+    def isCompleted(self):
+        """Were all tasks completed when last polled?"""
+        return all([task.completed for task in self._tasks])
+
+    def getFailures(self):
+        """Return list of Progress objects of tasks that failed.
+
+        Scheduled tasks that failed to start have no Progress and
+        aren't included."""
+        return [task.progress for task in self._getFailedTasks()
+                if task.progress is not None]
+
+    def wait(self, timeout=None, callback=None, cancelOnFailure=False):
+        """Wait until all tasks are completed.
+
+        If callback is not None, callback(group) is called after each
+        poll, e.g. to display progress.
+
+        Raises the exception of the first task to fail, or to fail to
+        start, with the status of all tasks (see getStatus()) attached
+        as its status attribute. If cancelOnFailure is True, the other tasks are
+        cancelled first. Raises VirtualBoxTimeoutException if timeout
+        seconds pass before all tasks are completed."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self.poll()
+            if callback is not None:
+                callback(self)
+            failures = self._getFailedTasks()
+            if failures:
+                self._raiseFailure(failures[0], cancelOnFailure)
+            if self.isCompleted():
+                return
+            interval = self.getPollInterval()
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise VirtualBoxException.VirtualBoxTimeoutException(
+                        "%d of %d tasks not completed after %s seconds" %
+                        (len([t for t in self._tasks if not t.completed]),
+                         len(self._tasks), timeout))
+                interval = min(interval, remaining)
+            time.sleep(interval)
+
+    def getPollInterval(self):
+        """Return seconds to wait before the next poll.
+
+        About the time it takes the fastest task to progress by one
+        percent, but no longer than until the first task is expected to
+        finish."""
+        interval = self.MAX_INTERVAL
+        for task in self._tasks:
+            if not task.isRunning():
+                continue
+            rate = task.getRate()
+            if not rate:
+                # No progress seen yet, poll again soon.
+                interval = min(interval, task.getIdleInterval(
+                        self.MIN_INTERVAL, self.MAX_INTERVAL))
+                continue
+            interval = min(interval, 1.0 / rate, task.getETA())
+        return max(self.MIN_INTERVAL, interval)
+
+    #
+    # Statistics, as of the last poll
+    #
+
+    def getPercent(self):
+        """Return aggregate percent complete of all tasks."""
+        total = sum([task.getWeight() for task in self._tasks])
+        if not total:
+            return 100
+        return sum([task.getWeight() * task.percent
+                    for task in self._tasks]) / float(total)
+
+    def isSized(self):
+        """Do all tasks have a size?"""
+        return all([task.size for task in self._tasks])
+
+    def getThroughput(self):
+        """Return aggregate throughput of all tasks.
+
+        In bytes per second if all tasks have a size (see isSized()),
+        otherwise in percent per second of the group."""
+        if self.isSized():
+            return sum([task.getThroughput() or 0 for task in self._tasks])
+        elapsed = self._getElapsed()
+        if not elapsed:
+            return None
+        return self.getPercent() / elapsed
+
+    def getETA(self):
+        """Return estimated seconds until all started tasks are completed.
+
+        Scheduled tasks waiting their turn aren't included, as there is
+        no estimate for a task before it starts, so the group may take
+        longer. Returns None if there isn't enough information yet."""
+        etas = [task.getETA() for task in self._tasks
+                if task.isRunning()]
+        if None in etas:
+            return None
+        return max(etas) if etas else 0
+
+    def getStatus(self):
+        """Return list of Records describing each task.
+
+        Records have label, percent, started (False while a scheduled
+        task waits its turn), completed, resultCode, throughput (see
+        getThroughput()) and eta (see getETA()) fields."""
+        return [Record(self._statusFields,
+                       (task.label, task.percent, task.progress is not None,
+                        task.completed, task.resultCode,
+                        task.getThroughput(), task.getETA()))
+                for task in self._tasks]
+
+    def _getElapsed(self):
+        """Return seconds since the first poll of any task."""
+        starts = [task.firstPoll for task in self._tasks
+                  if task.firstPoll is not None]
+        if not starts:
+            return None
+        return time.time() - min(starts)
+
+    def _getFailedTasks(self):
+        return [task for task in self._tasks if task.failed()]
+
+    def _raiseFailure(self, task, cancelOnFailure):
+        """Raise the exception for the failed task."""
+        if cancelOnFailure:
+            for other in self._tasks:
+                other.cancel()
+            self.poll()
+        if task.error is not None:
+            excType, e, traceback = task.error
+            e.status = self.getStatus()
+            e.progress = None
+            raise excType, e, traceback
+        try:
+            task.progress.waitForCompletion(0)
+        except VirtualBoxException.VirtualBoxException, e:
+            e.status = self.getStatus()
+            e.progress = task.progress
+            raise
+
+class _Task(object):
+    """State of one Progress in a ProgressGroup.
+
+    A scheduled task has no Progress until begin() calls start. If
+    start raises, the task is completed and failed with error, the
+    exception info. resources is the set of resources it uses."""
+    def __init__(self, progress, label, size, start=None, resources=()):
+        self.progress = progress
+        self.label = label
+        self.size = size
+        self.start = start
+        self.resources = resources
+        self.canceled = False
+        self.error = None
+        self.completed = False
+        self.percent = 0
+        self.resultCode = None
+        self.firstPoll = None
+        self.firstPercent = None
+        self.lastPoll = None
+        self.lastChange = None
+
+    def scheduled(self):
+        return self.start is not None
+
+    def isPending(self):
+        """Is the task waiting to be started?"""
+        return (self.progress is None) and not self.canceled and \
+            not self.completed
+
+    def isRunning(self):
+        return (self.progress is not None) and not self.completed
+
+    def begin(self):
+        """Start a scheduled task. Returns False if start failed."""
+        try:
+            self.progress = self.start()
+        except Exception:
+            self.error = sys.exc_info()
+            self.completed = True
+            return False
+        return True
+
+    def cancel(self):
+        """Cancel the task if running, or keep it from starting."""
+        if self.progress is None:
+            self.canceled = True
+        elif not self.completed:
+            self.progress.cancel()
+
+    def poll(self, now):
+        """Read the state of the task if running."""
+        if not self.isRunning():
+            return
+        status = self.progress.poll()
+        completed = status.completed
+        percent = status.percent
+        if completed:
+            with VirtualBoxException.ExceptionHandler():
+                self.resultCode = self.progress.resultCode
+        if self.firstPoll is None:
+            self.firstPoll = now
+            self.firstPercent = percent
+            self.lastChange = now
+        if percent != self.percent:
+            self.lastChange = now
+        self.lastPoll = now
+        self.percent = percent
+        self.completed = completed
+
+    def failed(self):
+        return self.completed and ((self.error is not None) or
+                                   (self.resultCode != 0))
+
+    def getWeight(self):
+        return self.size if self.size else 1
+
+    def getRate(self):
+        """Return percent per second since first poll, None if unknown."""
+        if (self.firstPoll is None) or (self.lastPoll == self.firstPoll):
+            return None
+        return float(self.percent - self.firstPercent) / \
+            (self.lastPoll - self.firstPoll)
+
+    def getIdleInterval(self, minimum, maximum):
+        """Return poll interval for a task that isn't progressing.
+
+        Grows with the time since its percent last changed."""
+        if self.lastChange is None:
+            return minimum
+        return min(maximum, max(minimum, self.lastPoll - self.lastChange))
+
+    def getThroughput(self):
+        """Return bytes per second, or percent per second without a size."""
+        rate = self.getRate()
+        if rate is None:
+            return None
+        if self.size:
+            return rate * self.size / 100
+        return rate
+
+    def getETA(self):
+        """Return estimated seconds until completion, None if unknown.
+
+        Until the task is seen progressing, the estimate comes from the
+        history of tracked tasks (see Progress.track())."""
+        if self.completed:
+            return 0
+        if self.progress is None:
+            return None
+        rate = self.getRate()
+        if not rate:
+            recorder = self.progress.getRecorder()
+            if recorder is None:
+                return None
+            return recorder.getETA()
+        return max(0, (100 - self.percent) / rate - (time.time() -
+                                                     self.lastPoll))
@@ -0,0 +1,58 @@
+"""Immutable record of property values"""
+
+class Record(object):
+    """Immutable snapshot of properties of a VirtualBox object.
+
+    Properties are available as attributes. Records can be shared
+    between threads, pickled, and converted to a dictionary with
+    asDict() for other forms of serialization."""
+    __slots__ = ("_fields", "_values")
+
+    def __init__(self, fields, values):
+        fields = tuple(fields)
+        values = tuple(values)
+        if len(fields) != len(values):
+            raise ValueError("Got %d values for %d fields" % (len(values),
+                                                              len(fields)))
+        object.__setattr__(self, "_fields", fields)
+        object.__setattr__(self, "_values", dict(zip(fields, values)))
+
+    def __getattr__(self, attr):
+        try:
+            return self._values[attr]
+        except KeyError:
+            raise AttributeError("Record has no field '%s'" % attr)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Cannot set attribute '%s' of Record" % attr)
+
+    def __delattr__(self, attr):
+        raise AttributeError("Cannot delete attribute '%s' of Record" % attr)
+
+    def __reduce__(self):
+        return (Record, (self._fields, self.values()))
+
+    def __eq__(self, other):
+        return (isinstance(other, Record) and
+                (self._fields == other._fields) and
+                (self._values == other._values))
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "Record(%s)" % ", ".join(["%s=%r" % (field,
+                                                    self._values[field])
+                                         for field in self._fields])
+
+    def fields(self):
+        """Return tuple of field names in order."""
+        return self._fields
+
+    def values(self):
+        """Return tuple of values in field order."""
+        return tuple([self._values[field] for field in self._fields])
+
+    def asDict(self):
+        """Return a new dictionary mapping field names to values."""
+        return dict(self._values)
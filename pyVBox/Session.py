@@ -1,20 +1,39 @@
 """Wrapper around ISession object"""
 
+from Constants import Constants
 from Progress import Progress
 from VirtualBox import VirtualBox
 import VirtualBoxException
-from VirtualBoxManager import Constants, VirtualBoxManager
+from VirtualBoxManager import VirtualBoxManager
 from Wrapper import Wrapper
 
 import weakref
 
-STATE_NAME = {
-    Constants.SessionState_Null : "Null",
-    Constants.SessionState_Locked : "Locked",
-    Constants.SessionState_Unlocked : "Unlocked",
-    Constants.SessionState_Spawning : "Spawning",
-    Constants.SessionState_Unlocking : "Unlocking",
-    }
+class _StateNames(object):
+    """Mapping from SessionState values to names.
+
+    Looked up in Constants when used, so importing this module doesn't
+    load them. See also Constants.SessionState.name_of()"""
+    def __getitem__(self, value):
+        try:
+            return Constants.SessionState.name_of(value)
+        except ValueError:
+            raise KeyError(value)
+
+    def __contains__(self, value):
+        return value in Constants.SessionState
+
+    def has_key(self, value):
+        return value in self
+
+    def get(self, value, default=None):
+        return self[value] if value in self else default
+
+    def items(self):
+        return [(value, name)
+                for name, value in Constants.SessionState.items()]
+
+STATE_NAME = _StateNames()
 
 class Session(Wrapper):
     # Properties directly inherited from IMachine
@@ -24,8 +43,10 @@ class Session(Wrapper):
         "type",
         ]
 
-    _manager = VirtualBoxManager()
-    _vbox = VirtualBox()
+    _enumProperties = {
+        "state" : "SessionState",
+        "type" : "SessionType",
+        }
 
     def __init__(self, isession):
         self._wrappedInstance = isession
@@ -39,7 +60,8 @@ class Session(Wrapper):
     @classmethod
     def _createSession(cls):
         """Create and return an ISesison object."""
-        return cls._manager.mgr.getSessionObject(cls._vbox)
+        manager = VirtualBoxManager.getDefault()
+        return manager.mgr.getSessionObject(manager.getIVirtualBox())
 
     def __del__(self):
         self.unlockMachine(wait=False)
@@ -49,6 +71,11 @@ class Session(Wrapper):
         with VirtualBoxException.ExceptionHandler():
             self.getIMachine().saveSettings()
 
+    def discardSettings(self):
+        """Discard unsaved changes to VM associated with session."""
+        with VirtualBoxException.ExceptionHandler():
+            self.getIMachine().discardSettings()
+
     def _setMachine(self, machine):
         """Set the machine associated with this session."""
         self._machine = machine
@@ -57,14 +84,20 @@ class Session(Wrapper):
         """Return the mutable machine associated with the session."""
         return self._machine
 
-    def unlockMachine(self, wait=True):
-        """Close any open session, unlocking the machine."""
+    def unlockMachine(self, wait=True, timeout=None):
+        """Close any open session, unlocking the machine.
+
+        If wait is True, wait until the session is unlocked, raising
+        VirtualBoxTimeoutException if timeout seconds pass first."""
         if self.isLocked():
             with VirtualBoxException.ExceptionHandler():
                 self._wrappedInstance.unlockMachine()
-                if wait:
-                    while self.isLocked():
-                        self._vbox.waitForEvent()
+            if wait:
+                unlocked = VirtualBox.getDefault().waitUntil(
+                    lambda: not self.isLocked(), timeout)
+                if not unlocked:
+                    raise VirtualBoxException.VirtualBoxTimeoutException(
+                        "Session not unlocked after %s seconds" % timeout)
 
     def getISession(self):
         """Return ISession instance wrapped by Session"""
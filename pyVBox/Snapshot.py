@@ -1,8 +1,14 @@
 """Wrapper around ISnapshot object"""
 
+from Constants import Constants
+from Medium import Medium
+import VirtualBoxException
+from VirtualBoxManager import VirtualBoxManager
 from Wrapper import Wrapper
 
 class Snapshot(Wrapper):
+    __slots__ = ()
+
     # Properties directly inherited from ISnapshot
     _passthruProperties = [
         "children",
@@ -15,6 +21,10 @@ class Snapshot(Wrapper):
         "timeStamp",
         ]
 
+    _cachedProperties = {
+        "id" : None,
+        }
+
     def __init__(self, isnapshot):
         assert(isnapshot is not None)
         self._wrappedInstance = isnapshot
@@ -22,17 +32,40 @@ class Snapshot(Wrapper):
     @property
     def machine(self):
         """Return VirtualMachine object associated wit this snapshot"""
-        import VirtualMachine
-        return VirtualMachine(self.machine)
+        from VirtualMachine import VirtualMachine
+        return VirtualMachine.intern(self._wrappedInstance.machine,
+                                     self._manager)
+
+    def getIMachine(self):
+        """Return the IMachine holding the state of the machine when the snapshot was taken."""
+        return self._wrappedInstance.machine
+
+    def getHardDrives(self):
+        """Return array of Medium instances of the hard drives attached when the snapshot was taken.
+
+        While the snapshot exists these are not written to, the
+        machine writes to differencing media based on them instead."""
+        with VirtualBoxException.ExceptionHandler():
+            manager = self._manager
+            if manager is None:
+                manager = VirtualBoxManager.getDefault()
+            attachments = manager.getArray(self.getIMachine(),
+                                           "mediumAttachments")
+            return [Medium.intern(a.medium, self._manager)
+                    for a in attachments
+                    if Constants.DeviceType.coerce(a.type) ==
+                    Constants.DeviceType_HardDisk]
 
     @property
     def parent(self):
         """Return parent snapshot (a snapshot this one is based on), or null if the snapshot has no parent (i.e. is the first snapshot). """
-        if self.parent is None:
+        parent = self._wrappedInstance.parent
+        if parent is None:
             return None
-        return Snapshot(self.parent)
+        return Snapshot.intern(parent, self._manager)
 
     @property
     def children(self):
         """Return child snapshots (all snapshots having this one as a parent)."""
-        return [Snapshot(child) for child in self.children]
+        return [Snapshot.intern(child, self._manager)
+                for child in self._wrappedInstance.children]
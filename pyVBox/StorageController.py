@@ -3,6 +3,8 @@
 from Wrapper import Wrapper
 
 class StorageController(Wrapper):
+    __slots__ = ()
+
     # Properties directly inherited from IStorageController
     _passthruProperties = [
         "bus",
@@ -15,6 +17,11 @@ class StorageController(Wrapper):
         "portCount",
         ]
 
+    _enumProperties = {
+        "bus" : "StorageBus",
+        "controllerType" : "StorageControllerType",
+        }
+
     def __init__(self, storageController):
         """Return a StorageController around the given IStorageController instance"""
         assert(storageController is not None)
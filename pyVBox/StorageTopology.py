@@ -0,0 +1,270 @@
+"""In-memory model of the storage controllers and attachments of a machine"""
+
+from Constants import Constants
+from Record import Record
+import VirtualBoxException
+
+import heapq
+
+class StorageTopology(object):
+    """Storage controllers and medium attachments of a machine.
+
+    Built from one fetch of both (see fetch()), after which finding an
+    attachment by medium UUID or by slot, checking a controller name
+    and handing out free slots don't go back to VirtualBox. Changes
+    made to the machine should be noted with attach(), detach(),
+    addController() and removeController() to keep the model in step.
+
+    Controllers are Records with name, bus, portCount and
+    maxDevicesPerPortCount fields. Attachments are Records with
+    controller, port, device, type (a DeviceType value) and mediumId
+    (None for an empty drive) fields. A slot is a (controller name,
+    port, device) tuple."""
+
+    _controllerFields = ("name", "bus", "portCount",
+                         "maxDevicesPerPortCount")
+    _attachmentFields = ("controller", "port", "device", "type",
+                         "mediumId")
+
+    # Base names of new controllers by bus name, see newControllerName()
+    _controllerNames = {
+        "IDE"    : "IDE Controller",
+        "SATA"   : "SATA Controller",
+        "SCSI"   : "SCSI Controller",
+        "Floppy" : "Floppy Controller"
+        }
+
+    # Names of the device types each bus takes, by bus name. Buses not
+    # listed take any device.
+    _busDeviceTypeNames = {
+        "IDE" : ("HardDisk", "DVD"),
+        "SATA" : ("HardDisk", "DVD"),
+        "SCSI" : ("HardDisk", "DVD"),
+        "SAS" : ("HardDisk", "DVD"),
+        "USB" : ("HardDisk", "DVD"),
+        "VirtioSCSI" : ("HardDisk", "DVD"),
+        "PCIe" : ("HardDisk",),
+        "Floppy" : ("Floppy",),
+        }
+
+    # Bus -> DeviceType values, built from the above on first use
+    _busDeviceTypes = None
+
+    def __init__(self, controllers=(), attachments=()):
+        # Controller Records in order, and by name
+        self._controllers = []
+        self._byName = {}
+        # Attachment Records by slot and by medium UUID
+        self._bySlot = {}
+        self._byMedium = {}
+        # Controller name -> heap of (port, device) possibly free.
+        # Slots are checked against _bySlot when taken.
+        self._free = {}
+        for controller in controllers:
+            self.addController(*controller.values())
+        for attachment in attachments:
+            self.attach(*attachment.values())
+
+    @classmethod
+    def fetch(cls, machine):
+        """Return the StorageTopology of the given VirtualMachine."""
+        with VirtualBoxException.ExceptionHandler():
+            # The webservice gives enumeration names rather than values
+            controllers = [Record(cls._controllerFields,
+                                  (c.name, Constants.StorageBus.coerce(c.bus),
+                                   c.portCount, c.maxDevicesPerPortCount))
+                           for c in machine._getStorageControllers()]
+            attachments = []
+            for a in machine._getMediumAttachments():
+                medium = a.medium
+                attachments.append(Record(
+                        cls._attachmentFields,
+                        (a.controller, a.port, a.device,
+                         Constants.DeviceType.coerce(a.type),
+                         medium.id if medium is not None else None)))
+        return cls(controllers, attachments)
+
+    #
+    # Controllers
+    #
+
+    def getControllers(self):
+        """Return list of controller Records."""
+        return list(self._controllers)
+
+    def getController(self, name):
+        """Return Record of the controller with name, None if none."""
+        return self._byName.get(name)
+
+    def hasController(self, name):
+        """Is there a controller with the given name?"""
+        return self._byName.has_key(name)
+
+    def newControllerName(self, bus):
+        """Return an unused name for a new controller on bus.
+
+        The base name for the bus, with a number added if needed to
+        make it unique."""
+        busName = Constants.StorageBus.name_of(bus) \
+            if bus in Constants.StorageBus else None
+        if not self._controllerNames.has_key(busName):
+            # Todo: Use correct argument type here
+            raise Exception("Invalid type '%d'" % bus)
+        baseName = self._controllerNames[busName]
+        name = baseName
+        count = 1
+        while self.hasController(name):
+            count += 1
+            name = "%s %d" % (baseName, count)
+        return name
+
+    def addController(self, name, bus, portCount, maxDevicesPerPortCount):
+        """Note a new controller."""
+        controller = Record(self._controllerFields,
+                            (name, bus, portCount, maxDevicesPerPortCount))
+        self._controllers.append(controller)
+        self._byName[name] = controller
+        # Already in heap order
+        self._free[name] = [(port, device)
+                            for port in range(portCount)
+                            for device in range(maxDevicesPerPortCount)]
+
+    def removeController(self, name):
+        """Note the removal of the controller with name and its attachments."""
+        controller = self._byName.pop(name)
+        self._controllers.remove(controller)
+        del self._free[name]
+        for slot, attachment in self._bySlot.items():
+            if slot[0] == name:
+                self._forget(attachment)
+
+    #
+    # Attachments
+    #
+
+    def getAttachments(self):
+        """Return list of attachment Records, ordered by slot."""
+        return [self._bySlot[slot] for slot in sorted(self._bySlot.keys())]
+
+    def findByMedium(self, mediumId):
+        """Return Record of the attachment of medium, None if none."""
+        return self._byMedium.get(mediumId)
+
+    def getAttachment(self, controller, port, device):
+        """Return Record of the attachment in the slot, None if free."""
+        return self._bySlot.get((controller, port, device))
+
+    def isFree(self, controller, port, device):
+        """Is the slot free?"""
+        return not self._bySlot.has_key((controller, port, device))
+
+    def attach(self, controller, port, device, type, mediumId=None):
+        """Note a device attached to a slot. Returns its Record."""
+        attachment = Record(self._attachmentFields,
+                            (controller, port, device, type, mediumId))
+        self._bySlot[(controller, port, device)] = attachment
+        if mediumId is not None:
+            self._byMedium[mediumId] = attachment
+        return attachment
+
+    def detach(self, controller, port, device):
+        """Note the device in the slot detached. Returns its Record."""
+        attachment = self._bySlot[(controller, port, device)]
+        self._forget(attachment)
+        free = self._free.get(controller)
+        if free is not None:
+            heapq.heappush(free, (port, device))
+        return attachment
+
+    def allocate(self, count=1, controller=None, bus=None, type=None):
+        """Return list of count free slots.
+
+        Slots come from the named controller, else from the first
+        controllers on the given bus, else from any controllers, in
+        order, lowest port and device first. If type is not None, only
+        controllers whose bus takes that DeviceType are used. Slots
+        returned are reserved, they won't be returned again until noted
+        with attach() and detach(), or given back with release().
+        Raises VirtualBoxException if there aren't enough free slots."""
+        if controller is not None:
+            if not self.hasController(controller):
+                raise VirtualBoxException.VirtualBoxObjectNotFoundException(
+                    "No storage controller named '%s'" % controller)
+            if (type is not None) and \
+                    not self.takesDeviceType(self._byName[controller].bus,
+                                             type):
+                raise VirtualBoxException.VirtualBoxInvalidArgument(
+                    "Storage controller '%s' can't take a %s" %
+                    (controller, Constants.DeviceType.name_of(type)))
+            names = [controller]
+        else:
+            names = [c.name for c in self._controllers
+                     if ((bus is None) or (c.bus == bus)) and
+                     ((type is None) or self.takesDeviceType(c.bus, type))]
+        slots = []
+        for name in names:
+            free = self._free[name]
+            while free and (len(slots) < count):
+                port, device = heapq.heappop(free)
+                if self.isFree(name, port, device):
+                    slots.append((name, port, device))
+            if len(slots) == count:
+                break
+        if len(slots) == count:
+            return slots
+        self.release(slots)
+        raise VirtualBoxException.VirtualBoxException(
+            "Only %d of %d free storage slots found" % (len(slots), count))
+
+    def checkSlot(self, controller, port, device, type=None):
+        """Check a device of the given type can be attached to the slot.
+
+        Raises VirtualBoxObjectNotFoundException if there is no such
+        controller, VirtualBoxInvalidArgument if the slot doesn't exist
+        or the controller can't take the device type, and
+        VirtualBoxObjectInUseException if the slot isn't free."""
+        record = self.getController(controller)
+        if record is None:
+            raise VirtualBoxException.VirtualBoxObjectNotFoundException(
+                "No storage controller named '%s'" % controller)
+        if not ((0 <= port < record.portCount) and
+                (0 <= device < record.maxDevicesPerPortCount)):
+            raise VirtualBoxException.VirtualBoxInvalidArgument(
+                "Storage controller '%s' has no port %d device %d" %
+                (controller, port, device))
+        if (type is not None) and not self.takesDeviceType(record.bus, type):
+            raise VirtualBoxException.VirtualBoxInvalidArgument(
+                "Storage controller '%s' can't take a %s" %
+                (controller, Constants.DeviceType.name_of(type)))
+        if not self.isFree(controller, port, device):
+            raise VirtualBoxException.VirtualBoxObjectInUseException(
+                "Port %d device %d of storage controller '%s' is in use" %
+                (port, device, controller))
+
+    def release(self, slots):
+        """Give back slots returned by allocate() and not attached."""
+        for name, port, device in slots:
+            free = self._free.get(name)
+            if free is not None:
+                heapq.heappush(free, (port, device))
+
+    @classmethod
+    def takesDeviceType(cls, bus, type):
+        """Can a controller on the given bus take a device of type?"""
+        if cls._busDeviceTypes is None:
+            busDeviceTypes = {}
+            for busName, typeNames in cls._busDeviceTypeNames.items():
+                if busName in Constants.StorageBus.names():
+                    busDeviceTypes[Constants.StorageBus.value_of(busName)] = \
+                        [Constants.DeviceType.value_of(typeName)
+                         for typeName in typeNames]
+            cls._busDeviceTypes = busDeviceTypes
+        types = cls._busDeviceTypes.get(bus)
+        return (types is None) or (type in types)
+
+    def _forget(self, attachment):
+        """Remove attachment from the indices."""
+        del self._bySlot[(attachment.controller, attachment.port,
+                          attachment.device)]
+        if attachment.mediumId is not None:
+            self._byMedium.pop(attachment.mediumId, None)
@@ -2,12 +2,25 @@
 
 This is not used at this time."""
 
+from Constants import Constants
+from EventPump import EventPump
 from GuestOSType import GuestOSType
-from VirtualBoxException import VirtualBoxException
+from GuestOSTypeCache import GuestOSTypeCache
+from MachineIndex import MachineIndex
+from Record import Record
+import VirtualBoxException
 from VirtualBoxManager import VirtualBoxManager
 from Wrapper import Wrapper
 
+import fnmatch
 import os.path
+import threading
+import time
+import weakref
+
+# Longest time in seconds waitUntil() waits for an event before
+# checking its condition again, in case a change came without one.
+EVENT_WAIT_INTERVAL = 0.5
 
 class VirtualBox(Wrapper):
     # Properties directly inherited from IVirtualMachine
@@ -30,45 +43,333 @@ class VirtualBox(Wrapper):
         "registerMachine",
         ]
 
-    def __init__(self):
-        self._manager = VirtualBoxManager()
+    # The version only changes when VBoxSVC is restarted, which ends
+    # our connection too.
+    _cachedProperties = {
+        "revision" : None,
+        "version" : None,
+        }
+
+    # Instances shared by pyVBox keyed by manager, see getDefault()
+    _instances = weakref.WeakKeyDictionary()
+
+    def __init__(self, manager=None):
+        """Return a VirtualBox wrapper around the IVirtualBox of manager.
+
+        If manager is None, the shared VirtualBoxManager is used."""
+        if manager is None:
+            manager = VirtualBoxManager.getDefault()
+        self._manager = manager
         self._wrappedInstance = self._manager.getIVirtualBox()
+        self._monitor = None
+        self._index = None
+        self._eventPump = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def getDefault(cls):
+        """Return the VirtualBox instance shared by pyVBox.
+
+        This is the instance for VirtualBoxManager.getDefault()."""
+        manager = VirtualBoxManager.getDefault()
+        vbox = cls._instances.get(manager)
+        if vbox is None:
+            vbox = cls._instances.setdefault(manager, cls(manager))
+        return vbox
 
     def getGuestOSType(self, osTypeId):
-        """Returns an object describing the specified guest OS type."""
-        iosType = self._wrappedInstance.getGuestOSType(osTypeId)
-        return GuestOSType(iosType)
+        """Returns an object describing the specified guest OS type.
+
+        Answered from GuestOSTypeCache if possible."""
+        osType = GuestOSTypeCache.find(self, osTypeId)
+        if osType is None:
+            with VirtualBoxException.ExceptionHandler():
+                iosType = self._wrappedInstance.getGuestOSType(osTypeId)
+            osType = GuestOSType(iosType)
+        return osType
 
     @property
     def guestOSTypes(self):
-        """Return an array of all available guest OS Types."""
-        return [GuestOSType(t) for t in self._getArray('guestOSTypes')]
+        """Return an array of all available guest OS Types.
+
+        The array comes from GuestOSTypeCache."""
+        return list(GuestOSTypeCache.getAll(self))
 
     @property
     def machines(self):
         """Return array of machine objects registered within this VirtualBox instance."""
+        return list(self.iterMachines())
+
+    def iterMachines(self, state=None, osTypeId=None, name=None):
+        """Return an iterator over registered machines matching the filters.
+
+        state is a MachineState value or name, or a list of them, osTypeId is a
+        guest OS type id or a list of them and name is a shell-style
+        pattern (see fnmatch). Machines are wrapped and filtered one at
+        a time as the iterator is consumed. When filtering, machines
+        whose properties can't be read are skipped."""
         from VirtualMachine import VirtualMachine
-        return [VirtualMachine(vm) for vm in self._getArray('machines')]
+        states = self._asList(state)
+        if states is not None:
+            states = [Constants.MachineState.coerce(s) for s in states]
+        osTypeIds = self._asList(osTypeId)
+        for machine in self._getArray('machines'):
+            vm = VirtualMachine.intern(machine, self._manager)
+            try:
+                if (states is not None) and (vm.state not in states):
+                    continue
+                if (osTypeIds is not None) and \
+                        (vm.OSTypeId not in osTypeIds):
+                    continue
+                if (name is not None) and \
+                        not fnmatch.fnmatchcase(vm.name, name):
+                    continue
+            except VirtualBoxException.VirtualBoxException:
+                continue
+            yield vm
+
+    @property
+    def hardDisks(self):
+        """Return array of hard disks known to this VirtualBox instance."""
+        return self._getMedia("hardDisks")
+
+    @property
+    def DVDImages(self):
+        """Return array of DVD images known to this VirtualBox instance."""
+        return self._getMedia("DVDImages")
+
+    @property
+    def floppyImages(self):
+        """Return array of floppy images known to this VirtualBox instance."""
+        return self._getMedia("floppyImages")
 
     def waitForEvent(self):
         self._manager.waitForEvents()
+        self.getMonitor().waitForEvents(0)
+
+    def waitUntil(self, condition, timeout=None, id=None):
+        """Wait until condition() returns True.
+
+        condition is checked when the EventPump delivers an event for
+        the object with the given UUID (any object if id is None), or
+        after EVENT_WAIT_INTERVAL seconds without one.
+
+        Returns True once condition() is True, False if timeout seconds
+        pass first. If timeout is None, waits forever."""
+        woken = threading.Event()
+        # Subscribe before the first check so we can't miss an event
+        # between it and the wait.
+        subscription = self.getEventPump().subscribe(
+            lambda event: woken.set(), id=id)
+        try:
+            deadline = None if timeout is None else time.time() + timeout
+            while True:
+                woken.clear()
+                if condition():
+                    return True
+                wait = EVENT_WAIT_INTERVAL
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                woken.wait(wait)
+        finally:
+            subscription.cancel()
+
+    def getEventPump(self):
+        """Return the running EventPump of this VirtualBox."""
+        with self._lock:
+            if self._eventPump is None:
+                self._eventPump = EventPump(self)
+        self._eventPump.start()
+        return self._eventPump
+
+    def getMonitor(self):
+        """Return the VirtualBoxMonitor listening to this VirtualBox."""
+        with self._lock:
+            if self._monitor is None:
+                monitor = VirtualBoxMonitor(self)
+                monitor.register()
+                self._monitor = monitor
+        return self._monitor
+
+    def getMachineIndex(self, create=True):
+        """Return the MachineIndex of machines registered with this VirtualBox.
+
+        Also starts the EventPump, which delivers the events keeping
+        it current. If create is False, returns None if there is no
+        MachineIndex yet."""
+        if (self._index is None) and create:
+            self.getEventPump()
+            with self._lock:
+                if self._index is None:
+                    self._index = MachineIndex(self)
+        return self._index
 
     def _getArray(self, arrayName):
         """Return the array identified by the given name"""
         return self._manager.getArray(self._wrappedInstance, arrayName)
 
+    @staticmethod
+    def _asList(value):
+        """Return value as a list, None if it is None."""
+        if value is None:
+            return None
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return value
+        return [value]
+
+    def _getMedia(self, arrayName):
+        """Return the array of media identified by the given name"""
+        from Medium import Medium
+        return [Medium.intern(medium, self._manager)
+                for medium in self._getArray(arrayName)]
+
 
 class VirtualBoxMonitor:
+    """Passive listener for VirtualBox events.
+
+    Events are delivered by processEvents() to the on*() methods, which
+    by default invalidate cached properties of the affected object (see
+    Wrapper.invalidateId()), and then to the EventPump if there is one.
+    Subclasses overriding those methods should call the base class
+    method."""
+
+    # Event types we listen for, by VBoxEventType name, and how to
+    # dispatch them: the IEvent interface to query, the method to call
+    # and the event attributes to pass to the method.
+    _eventHandlers = {
+        "OnMachineStateChanged" :
+            ("IMachineStateChangedEvent", "onMachineStateChange",
+             ("machineId", "state")),
+        "OnMachineDataChanged" :
+            ("IMachineDataChangedEvent", "onMachineDataChange",
+             ("machineId",)),
+        "OnSessionStateChanged" :
+            ("ISessionStateChangedEvent", "onSessionStateChange",
+             ("machineId", "state")),
+        "OnMachineRegistered" :
+            ("IMachineRegisteredEvent", "onMachineRegistered",
+             ("machineId", "registered")),
+        "OnMediumRegistered" :
+            ("IMediumRegisteredEvent", "onMediaRegistered",
+             ("mediumId", "mediumType", "registered")),
+        }
+
+    # Enumerations of the last attribute of events, by event type name
+    _eventEnums = {
+        "OnMachineStateChanged" : "MachineState",
+        "OnSessionStateChanged" : "SessionState",
+        }
+
     def __init__(self, vbox):
         self._vbox = vbox
-        self._manager = VirtualBoxManager()
+        self._manager = vbox._manager
         self._isMscom = self._manager.isMSCOM()
+        self._listener = None
+        # Held by the thread reading events in waitForEvents()
+        self._readLock = threading.Lock()
+        # Notified when that thread is done
+        self._eventsRead = threading.Condition()
+
+    def register(self):
+        """Start listening for events."""
+        if self._listener is not None:
+            return
+        eventSource = self._vbox._wrappedInstance.eventSource
+        with VirtualBoxException.ExceptionHandler():
+            listener = eventSource.createListener()
+            eventSource.registerListener(
+                listener,
+                [Constants.VBoxEventType.value_of(name)
+                 for name in self._eventHandlers.keys()],
+                False)
+        self._listener = listener
+        Wrapper.setMonitored(self._manager, True)
+
+    def unregister(self):
+        """Stop listening for events.
+
+        Also stops the EventPump, which reads our events."""
+        if self._listener is None:
+            return
+        if self._vbox._eventPump is not None:
+            self._vbox._eventPump.stop()
+        eventSource = self._vbox._wrappedInstance.eventSource
+        # Cached values are no longer invalidated by events
+        Wrapper.setMonitored(self._manager, False)
+        with VirtualBoxException.ExceptionHandler():
+            eventSource.unregisterListener(self._listener)
+        self._listener = None
+
+    def processEvents(self, timeout=0):
+        """Dispatch any pending events.
+
+        Waits up to timeout milliseconds for the first event."""
+        if self._listener is None:
+            return
+        eventSource = self._vbox._wrappedInstance.eventSource
+        while True:
+            with VirtualBoxException.ExceptionHandler():
+                event = eventSource.getEvent(self._listener, timeout)
+            if event is None:
+                break
+            try:
+                self.handleEvent(event)
+            finally:
+                with VirtualBoxException.ExceptionHandler():
+                    eventSource.eventProcessed(self._listener, event)
+            # Only wait for the first event
+            timeout = 0
+
+    def waitForEvents(self, timeout):
+        """Wait up to timeout milliseconds for events and dispatch them.
+
+        May be called from several threads at once. One of them reads
+        and dispatches events while the others wait for it to finish."""
+        if self._readLock.acquire(False):
+            try:
+                self.processEvents(timeout)
+            finally:
+                self._readLock.release()
+                with self._eventsRead:
+                    self._eventsRead.notifyAll()
+        else:
+            with self._eventsRead:
+                self._eventsRead.wait(timeout / 1000.0)
+
+    def handleEvent(self, event):
+        """Dispatch an IEvent to the matching on*() method."""
+        type = Constants.VBoxEventType.coerce(event.type)
+        if type not in Constants.VBoxEventType:
+            return
+        name = Constants.VBoxEventType.name_of(type)
+        if not self._eventHandlers.has_key(name):
+            return
+        interface, method, attrs = self._eventHandlers[name]
+        with VirtualBoxException.ExceptionHandler():
+            event = self._manager.queryInterface(event, interface)
+            args = [getattr(event, attr) for attr in attrs]
+        if self._eventEnums.has_key(name):
+            # The webservice gives names rather than values
+            enum = getattr(Constants, self._eventEnums[name])
+            args[-1] = enum.coerce(args[-1])
+        getattr(self, method)(*args)
+        pump = self._vbox._eventPump
+        if pump is not None:
+            # The first attribute is always the object's UUID
+            pump.dispatch(Record(("type", "id") + attrs,
+                                 [type, args[0]] + args))
 
     def onMachineStateChange(self, id, state):
-        pass
+        Wrapper.invalidateId(id)
 
     def onMachineDataChange(self, id):
-        pass
+        Wrapper.invalidateId(id)
+        if self._vbox._index is not None:
+            # The machine may have been renamed
+            self._vbox._index.forgetName(id)
 
     def onExtraDataCanChange(self, id, key, value):
         # Witty COM bridge thinks if someone wishes to return tuple, hresult
@@ -82,13 +383,17 @@ class VirtualBoxMonitor:
         pass
 
     def onMediaRegistered(self, id, type, registered):
-        pass
+        Wrapper.invalidateId(id)
 
     def onMachineRegistered(self, id, registred):
-        pass
+        Wrapper.invalidateId(id)
+        if (self._vbox._index is not None) and not registred:
+            # Newly registered machines are added on the first lookup
+            # that misses.
+            self._vbox._index.remove(id)
 
     def onSessionStateChange(self, id, state):
-        pass
+        Wrapper.invalidateId(id)
 
     def onSnapshotTaken(self, mach, id):
         pass
@@ -0,0 +1,214 @@
+"""Several VirtualBox hosts queried as one"""
+
+from Record import Record
+import VirtualBoxException
+from VirtualBoxManager import VirtualBoxManager
+from VirtualBoxManagerPool import VirtualBoxManagerPool
+
+import threading
+import time
+
+# Port vboxwebsrv listens on by default
+DEFAULT_WEBSERVICE_PORT = 18083
+
+class ClusterResults(list):
+    """Results of a VirtualBoxCluster query from the hosts that answered.
+
+    errors maps each host that failed, or did not answer in time, to
+    its exception."""
+    def __init__(self, results=(), errors=None):
+        list.__init__(self, results)
+        self.errors = errors if errors is not None else {}
+
+class VirtualBoxCluster(object):
+    """Several VirtualBox hosts queried in parallel.
+
+    Each host is "localhost", for the local VirtualBox, or the
+    host[:port] or URL of a VirtualBox webservice. Webservice hosts
+    are logged into with user and password and keep a pool of
+    connections (see VirtualBoxManagerPool).
+
+    Queries run on all hosts at once and return ClusterResults. Hosts
+    that don't answer within timeout seconds are left out of the
+    results and reported in their errors instead, so a slow host
+    doesn't hold up the others.
+
+        cluster = VirtualBoxCluster(["vbox1", "vbox2"], user, password)
+        for machine in cluster.getMachines("name", "state"):
+            print machine.host, machine.name
+    """
+
+    def __init__(self, hosts=(), user="", password="", timeout=30,
+                 connections=1):
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.connections = connections
+        # Host names in the order they were added
+        self._hosts = []
+        # VirtualBoxManager or VirtualBoxManagerPool for each host
+        self._managers = {}
+        for host in hosts:
+            self.addHost(host)
+
+    def addHost(self, host, manager=None):
+        """Add the given host to the cluster.
+
+        If manager is not None, it is the VirtualBoxManager or
+        VirtualBoxManagerPool to use for the host."""
+        if self._managers.has_key(host):
+            raise ValueError("Host %s already in cluster" % host)
+        if manager is None:
+            if host == "localhost":
+                manager = VirtualBoxManager.getDefault()
+            else:
+                manager = VirtualBoxManagerPool(self._getURL(host),
+                                                self.user,
+                                                self.password,
+                                                size=self.connections)
+        self._hosts.append(host)
+        self._managers[host] = manager
+
+    def getHosts(self):
+        """Return list of hosts in the cluster."""
+        return list(self._hosts)
+
+    def close(self):
+        """Log off all webservice hosts."""
+        for manager in self._managers.values():
+            if isinstance(manager, VirtualBoxManagerPool):
+                manager.close()
+
+    #
+    # Queries
+    #
+
+    def run(self, func, *args, **kwargs):
+        """Call func with the given arguments on every host in parallel.
+
+        func is called in a thread of its own for each host, with the
+        host's manager as the default (see VirtualBoxManager.using()),
+        so pyVBox calls made by func go to that host.
+
+        Returns ClusterResults of Records with host and value fields,
+        value being what func returned for host."""
+        lock = threading.Lock()
+        values = {}
+        errors = {}
+        def call(host):
+            try:
+                with self._using(host):
+                    value = func(*args, **kwargs)
+            except Exception, e:
+                with lock:
+                    errors[host] = e
+            else:
+                with lock:
+                    values[host] = value
+        threads = []
+        for host in self._hosts:
+            thread = threading.Thread(target=call, args=(host,),
+                                      name="VirtualBoxCluster %s" % host)
+            # Don't keep the process alive waiting for hung hosts
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        deadline = time.time() + self.timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+        with lock:
+            results = ClusterResults(errors=dict(errors))
+            for host in self._hosts:
+                if values.has_key(host):
+                    results.append(Record(("host", "value"),
+                                          (host, values[host])))
+                elif not errors.has_key(host):
+                    results.errors[host] = \
+                        VirtualBoxException.VirtualBoxTimeoutException(
+                        "%s did not answer within %s seconds" %
+                        (host, self.timeout))
+        return results
+
+    def getMachines(self, *names, **filters):
+        """Return Records of the machines on all hosts.
+
+        Each Record has the host of the machine and the named
+        VirtualMachine properties, by default those returned by
+        VirtualMachine.snapshot_record(). Inaccessible machines are
+        left out. filters are as for VirtualMachine.iterAll()."""
+        from VirtualMachine import VirtualMachine
+        names = names or VirtualMachine._recordProperties
+        def query():
+            return self._fetchAll(VirtualMachine.iterAll(**filters), names)
+        return self._merge(self.run(query), names)
+
+    def findMachines(self, nameOrId, *names):
+        """Return Records of the machines with the given name or UUID.
+
+        Records are as returned by getMachines(). Hosts without such a
+        machine contribute no Record."""
+        from VirtualMachine import VirtualMachine
+        names = names or VirtualMachine._recordProperties
+        def query():
+            try:
+                vm = VirtualMachine.find(nameOrId)
+            except VirtualBoxException.VirtualBoxObjectNotFoundException:
+                return []
+            return self._fetchAll([vm], names)
+        return self._merge(self.run(query), names)
+
+    def getMedia(self, *names):
+        """Return Records of the hard disk, DVD and floppy images on all hosts.
+
+        Each Record has the host of the medium and the named Medium
+        properties."""
+        from VirtualBox import VirtualBox
+        names = names or ("id", "name", "location", "format", "size",
+                          "state")
+        def query():
+            vbox = VirtualBox.getDefault()
+            return self._fetchAll(vbox.hardDisks + vbox.DVDImages +
+                                  vbox.floppyImages, names)
+        return self._merge(self.run(query), names)
+
+    #
+    # Internal methods
+    #
+
+    @staticmethod
+    def _getURL(host):
+        """Return URL of the webservice on the given host."""
+        if "://" in host:
+            return host
+        if ":" not in host:
+            host = "%s:%d" % (host, DEFAULT_WEBSERVICE_PORT)
+        return "http://%s/" % host
+
+    def _using(self, host):
+        """Return context manager making host's manager the default."""
+        manager = self._managers[host]
+        if isinstance(manager, VirtualBoxManagerPool):
+            return manager.manager()
+        return VirtualBoxManager.using(manager)
+
+    @staticmethod
+    def _fetchAll(wrappers, names):
+        """Return Records of the named properties of accessible wrappers."""
+        records = []
+        for wrapper in wrappers:
+            try:
+                records.append(wrapper.fetch(*names))
+            except VirtualBoxException.VirtualBoxException:
+                continue
+        return records
+
+    @staticmethod
+    def _merge(results, names):
+        """Merge lists of Records from run() into one, tagged with host."""
+        fields = ("host",) + tuple(names)
+        merged = ClusterResults(errors=results.errors)
+        for result in results:
+            for record in result.value:
+                merged.append(Record(fields,
+                                     (result.host,) + record.values()))
+        return merged
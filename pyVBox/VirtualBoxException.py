@@ -1,8 +1,7 @@
 """Basic exceptions for pyVBox."""
 
-import xpcom
-
 from contextlib import contextmanager
+import re
 import sys
 
 ######################################################################
@@ -140,6 +139,10 @@ class VirtualBoxCallFailed(VirtualBoxException):
     """Call to remot object failed."""
     errno = NS_ERROR_CALL_FAILED
 
+class VirtualBoxTimeoutException(VirtualBoxException):
+    """Operation did not complete in time."""
+    pass
+
 # Mappings from VirtualBox error numbers to pyVBox classes
 EXCEPTION_MAPPINGS = {
     VBOX_E_OBJECT_NOT_FOUND      : VirtualBoxObjectNotFoundException,
@@ -183,27 +186,99 @@ The function should be used as follows:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_type is not None:
-            if issubclass(exc_type, xpcom.Exception):  # Also True if equal
-                errno, message = exc_val
-                exception_class = None
-                if EXCEPTION_MAPPINGS.has_key(errno):
-                    exception_class = EXCEPTION_MAPPINGS[errno]
-                else:
-                    # Convert errno from exception to constant value from
-                    # IDL file.  I don't understand why this is needed,
-                    # determined experimentally.  ex.errno is a negative
-                    # value (e.g. -0x7f44ffff), this effectively takes its
-                    # aboslute value and subtracts it from 0x100000000.
-                    errno = 0x100000000 + errno
-                    if EXCEPTION_MAPPINGS.has_key(errno):
-                        exception_class = EXCEPTION_MAPPINGS[errno]
-                if exception_class:
-                    # Reraise with original stacktrace and instance
-                    # information, but with new class.  Note that one
-                    # cannot hide the current line from the traceback. See
-                    # http://stackoverflow.com/questions/6410764/raising-exceptions-without-raise-in-the-traceback
-                    raise exception_class, message
+            translateException(exc_type, exc_val)
             # Else we don't have or don't recognize the errno, return
             # and allow context manager to re-raise exception.
         return False
 
+def translateException(exc_type, exc_val):
+    """Raise the pyVBox equivalent of the given exception, if there is one.
+
+    Returns without raising if the exception is not a recognized
+    VirtualBox exception. This is the non-context manager form of
+    ExceptionHandler for use in code paths that cannot afford to
+    instantiate a context manager, e.g.:
+
+        try:
+            # Some VirtualBox code here
+        except Exception, e:
+            translateException(type(e), e)
+            raise
+    """
+    if issubclass(exc_type, VirtualBoxException):
+        return
+    errno, message = _getResultCode(exc_type, exc_val)
+    if errno is None:
+        return
+    if errno < 0:
+        # Convert errno from exception to constant value from
+        # IDL file.  I don't understand why this is needed,
+        # determined experimentally.  ex.errno is a negative
+        # value (e.g. -0x7f44ffff), this effectively takes its
+        # aboslute value and subtracts it from 0x100000000.
+        errno = 0x100000000 + errno
+    if EXCEPTION_MAPPINGS.has_key(errno):
+        # Reraise with original stacktrace and instance
+        # information, but with new class.  Note that one
+        # cannot hide the current line from the traceback. See
+        # http://stackoverflow.com/questions/6410764/raising-exceptions-without-raise-in-the-traceback
+        raise EXCEPTION_MAPPINGS[errno], message
+
+def _getResultCode(exc_type, exc_val):
+    """Return (result code, message) of the given VirtualBox exception.
+
+    Understands XPCOM exceptions, faults returned by the webservice
+    and whatever the VirtualBoxManager in use recognizes. The result
+    code is None if the exception doesn't come from VirtualBox."""
+    # Import here rather than at the top of the module so that importing
+    # pyVBox doesn't load XPCOM. It is missing altogether on clients of
+    # the webservice.
+    try:
+        import xpcom
+    except ImportError:
+        xpcom = None
+    if xpcom is not None and issubclass(exc_type, xpcom.Exception):
+        errno, message = exc_val
+        return errno, message
+    # ZSI, used by vboxapi for the webservice, raises FaultException
+    # holding the SOAP fault.
+    fault = getattr(exc_val, "fault", None)
+    if hasattr(fault, "string"):
+        return _getFaultResultCode(fault), fault.string
+    manager = _getManager()
+    # Older vboxapi doesn't have these, not all its platforms implement
+    # them.
+    if hasattr(manager, "errIsOurXcptKind"):
+        try:
+            if manager.errIsOurXcptKind(exc_val):
+                return (manager.errGetStatus(exc_val),
+                        manager.errGetMessage(exc_val))
+        except NotImplementedError:
+            pass
+    return None, None
+
+def _getFaultResultCode(fault):
+    """Return the result code of the given SOAP fault, None if none.
+
+    vboxwebsrv puts it in the RuntimeFault detail and at the end of
+    the fault string, e.g. "VirtualBox error: ... (0x80bb0001)"."""
+    details = getattr(fault, "detail", None)
+    if not isinstance(details, (list, tuple)):
+        details = [details]
+    for detail in details:
+        for attr in ("resultCode", "_resultCode"):
+            resultCode = getattr(detail, attr, None)
+            if resultCode is not None:
+                return int(resultCode)
+    match = re.search(r"\(0x([0-9a-fA-F]+)\)\s*$", fault.string or "")
+    if match:
+        return int(match.group(1), 16)
+    return None
+
+def _getManager():
+    """Return the VirtualBoxManager in use, None if there is none."""
+    try:
+        from VirtualBoxManager import VirtualBoxManager
+    except ImportError:
+        return None
+    return VirtualBoxManager.getCurrent()
@@ -1,9 +1,19 @@
 """Wrapper around vboxapi.VirtualBoxManager"""
 
+# Constants used to live here
+from Constants import Constants
 import vboxapi
 import VirtualBoxException
 
+from contextlib import contextmanager
+import threading
+
 class VirtualBoxManager(vboxapi.VirtualBoxManager):
+    # Instance shared by pyVBox, see getDefault()
+    _default = None
+    _defaultLock = threading.Lock()
+    # Per-thread replacements for _default, see using()
+    _local = threading.local()
 
     def __init__(self, style=None, params=None):
         self.__call_deinit = False
@@ -12,10 +22,68 @@ class VirtualBoxManager(vboxapi.VirtualBoxManager):
             self.__call_deinit = True
 
     def __del__(self):
+        self.deinit()
+
+    def deinit(self):
+        """Release the connection to VirtualBox.
+
+        Called automatically when the manager is deleted."""
         if self.__call_deinit:
+            self.__call_deinit = False
             # Not sure what this does. Copying use from vboxshell.py.
             vboxapi.VirtualBoxManager.deinit(self)
 
+    @classmethod
+    def createWebService(cls, url, user="", password=""):
+        """Return a new manager using the VirtualBox webservice at url."""
+        return cls("WEBSERVICE", { "url" : url,
+                                   "user" : user,
+                                   "password" : password })
+
+    @classmethod
+    def getDefault(cls):
+        """Return the VirtualBoxManager used by pyVBox.
+
+        This is the manager passed to using() in the current thread, if
+        any, or the manager shared by all threads. The latter is created
+        on first use, so importing pyVBox doesn't initialize XPCOM."""
+        manager = getattr(cls._local, "manager", None)
+        if manager is not None:
+            return manager
+        if cls._default is None:
+            with cls._defaultLock:
+                if cls._default is None:
+                    cls._default = cls()
+        return cls._default
+
+    @classmethod
+    def getCurrent(cls):
+        """Return the manager getDefault() would, None if there is none yet.
+
+        Unlike getDefault(), never creates a manager."""
+        manager = getattr(cls._local, "manager", None)
+        if manager is not None:
+            return manager
+        return cls._default
+
+    @classmethod
+    @contextmanager
+    def using(cls, manager):
+        """Context manager making manager the default in this thread.
+
+        Within the context pyVBox talks to VirtualBox through manager,
+        e.g.:
+
+            with VirtualBoxManager.using(manager):
+                vms = VirtualMachine.getAll()
+        """
+        previous = getattr(cls._local, "manager", None)
+        cls._local.manager = manager
+        try:
+            yield manager
+        finally:
+            cls._local.manager = previous
+
     def waitForEvents(self, timeout=None):
         """Wait for an event.
 
@@ -33,17 +101,3 @@ class VirtualBoxManager(vboxapi.VirtualBoxManager):
     def isMSCOM(self):
         """This this a MSCOM manager?"""
         return (self.type == 'MSCOM')
-
-class Constants:
-    _manager = VirtualBoxManager()
-    
-    # Pass any request for unrecognized method or attribute on to
-    # XPCOM object. We do this since I don't know how to inherit the
-    # XPCOM class directly.
-    class __metaclass__(type):
-        def __getattr__(cls, name):
-            try:
-                return getattr(cls._manager.constants, name)
-            except AttributeError as e:
-                raise AttributeError("%s.%s not found" % (cls.__name__,
-                                                          name))
@@ -0,0 +1,210 @@
+"""Pool of VirtualBoxManagers connected to a VirtualBox webservice"""
+
+from VirtualBoxManager import VirtualBoxManager
+import VirtualBoxException
+
+from contextlib import contextmanager
+import threading
+import time
+import urlparse
+
+class VirtualBoxManagerPool(object):
+    """Pool of authenticated connections to a VirtualBox webservice.
+
+    Each connection is a VirtualBoxManager with its own websession, so
+    threads using different connections don't serialize on one socket.
+    Use as:
+
+        pool = VirtualBoxManagerPool("http://host:18083/", user, password)
+        with pool.manager():
+            vm = VirtualMachine.find("MyVM")
+
+    size is the maximum number of connections in the pool.
+
+    maxConcurrentCalls limits the number of connections checked out
+    with manager() at once across all pools for the same host that
+    were given it, however many calls each makes. All such pools for
+    a host must give the same value, a pool giving another raises
+    ValueError. If None, the pool is only limited by its size.
+
+    Idle connections are used every keepAlive seconds so the webservice
+    does not expire their sessions. If keepAlive is None, they are not.
+
+    Note that vboxapi returns enumeration values from the webservice as
+    strings, e.g. "Running", see Constants.MachineState.value_of().
+    """
+
+    # (maxConcurrentCalls, semaphore) limiting checkouts, keyed by host
+    _hostLimits = {}
+    _hostLimitsLock = threading.Lock()
+
+    def __init__(self, url, user="", password="", size=4,
+                 maxConcurrentCalls=None, keepAlive=60):
+        self.url = url
+        self.user = user
+        self.password = password
+        self.size = size
+        self.keepAlive = keepAlive
+        if maxConcurrentCalls is None:
+            self._hostLimit = threading.BoundedSemaphore(size)
+        else:
+            self._hostLimit = self._getHostLimit(self.getHost(),
+                                                 maxConcurrentCalls)
+        # Idle connections as (manager, time last used) tuples, most
+        # recently used last.
+        self._idle = []
+        # Number of open connections, idle or not
+        self._count = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._keepAliveThread = None
+
+    @classmethod
+    def _getHostLimit(cls, host, maxConcurrentCalls):
+        """Return the semaphore limiting checkouts from pools for host.
+
+        Raises ValueError if it was created with another limit."""
+        with cls._hostLimitsLock:
+            if not cls._hostLimits.has_key(host):
+                cls._hostLimits[host] = (
+                    maxConcurrentCalls,
+                    threading.BoundedSemaphore(maxConcurrentCalls))
+            limit, semaphore = cls._hostLimits[host]
+        if limit != maxConcurrentCalls:
+            raise ValueError("maxConcurrentCalls of %d for %s conflicts "
+                             "with %d of other pools" %
+                             (maxConcurrentCalls, host, limit))
+        return semaphore
+
+    def getHost(self):
+        """Return the host (and port) of the webservice."""
+        return urlparse.urlparse(self.url).netloc
+
+    @contextmanager
+    def manager(self):
+        """Context manager yielding a VirtualBoxManager from the pool.
+
+        The manager is the default for pyVBox in the calling thread
+        within the context (see VirtualBoxManager.using())."""
+        with self._hostLimit:
+            manager = self._checkout()
+            try:
+                with VirtualBoxManager.using(manager):
+                    yield manager
+            finally:
+                self._checkin(manager)
+
+    def close(self):
+        """Log off all idle connections and stop handing out new ones.
+
+        Connections in use are logged off when they are returned."""
+        with self._condition:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._count -= len(idle)
+            self._condition.notifyAll()
+        for manager, lastUsed in idle:
+            self._disconnect(manager)
+
+    def getConnectionCount(self):
+        """Return the number of open connections."""
+        return self._count
+
+    def _checkout(self):
+        """Return an idle connection, opening one if needed."""
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise VirtualBoxException.VirtualBoxException(
+                        "Pool for %s is closed" % self.url)
+                if self._idle:
+                    manager, lastUsed = self._idle.pop()
+                    return manager
+                if self._count < self.size:
+                    self._count += 1
+                    break
+                self._condition.wait()
+        try:
+            manager = self._connect()
+        except:
+            with self._condition:
+                self._count -= 1
+                self._condition.notify()
+            raise
+        self._startKeepAlive()
+        return manager
+
+    def _checkin(self, manager):
+        """Return a connection to the pool."""
+        with self._condition:
+            if not self._closed:
+                self._idle.append((manager, time.time()))
+                self._condition.notify()
+                return
+            self._count -= 1
+        self._disconnect(manager)
+
+    def _connect(self):
+        """Open and return a new connection."""
+        return VirtualBoxManager.createWebService(self.url,
+                                                  self.user,
+                                                  self.password)
+
+    def _disconnect(self, manager):
+        """Log off the given connection.
+
+        Events are no longer read from it first, as the EventPump
+        would otherwise go on polling a session that has ended."""
+        from VirtualBox import VirtualBox
+        vbox = VirtualBox._instances.pop(manager, None)
+        if vbox is not None:
+            if vbox._eventPump is not None:
+                vbox._eventPump.stop()
+            if vbox._monitor is not None:
+                try:
+                    vbox._monitor.unregister()
+                except VirtualBoxException.VirtualBoxException:
+                    # The session may already have expired
+                    pass
+        manager.deinit()
+
+    def _startKeepAlive(self):
+        """Start the thread keeping idle connections alive, if needed."""
+        if (self.keepAlive is None) or (self._keepAliveThread is not None):
+            return
+        with self._condition:
+            if self._keepAliveThread is not None:
+                return
+            self._keepAliveThread = threading.Thread(
+                target=self._keepAliveLoop,
+                name="VirtualBoxManagerPool keep-alive %s" % self.getHost())
+            self._keepAliveThread.daemon = True
+            self._keepAliveThread.start()
+
+    def _keepAliveLoop(self):
+        """Use connections idle for more than keepAlive seconds."""
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                self._condition.wait(self.keepAlive)
+                if self._closed:
+                    return
+                now = time.time()
+                stale = [entry for entry in self._idle
+                         if now - entry[1] >= self.keepAlive]
+                for entry in stale:
+                    self._idle.remove(entry)
+            for manager, lastUsed in stale:
+                try:
+                    with self._hostLimit:
+                        manager.getIVirtualBox().version
+                except Exception:
+                    # Session is gone, drop the connection.
+                    with self._condition:
+                        self._count -= 1
+                        self._condition.notify()
+                    self._disconnect(manager)
+                else:
+                    self._checkin(manager)
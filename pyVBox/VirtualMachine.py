@@ -1,5 +1,7 @@
 """Wrapper around IMachine object"""
 
+import Async
+from Constants import Constants
 from HardDisk import HardDisk
 from Medium import Medium
 from MediumAttachment import MediumAttachment
@@ -7,16 +9,34 @@ from Progress import Progress
 from Session import Session
 from Snapshot import Snapshot
 from StorageController import StorageController
+from StorageTopology import StorageTopology
 from VirtualBox import VirtualBox
 import VirtualBoxException
-from VirtualBoxManager import Constants, VirtualBoxManager
+from VirtualBoxManager import VirtualBoxManager
 from Wrapper import Wrapper
 
 from contextlib import contextmanager
 import os
 import os.path
+import sys
+import threading
+
+# Batches this thread is editing, see VirtualMachine.edit(). Maps
+# (VirtualBoxManager, machine UUID) to _Batch.
+_edits = threading.local()
+
+class _Batch(object):
+    """Session of a batch and the StorageTopology it has changed."""
+    __slots__ = ("session", "topology")
+
+    def __init__(self, session):
+        self.session = session
+        # Fetched when first needed, see VirtualMachine.getStorageTopology()
+        self.topology = None
 
 class VirtualMachine(Wrapper):
+    __slots__ = ()
+
     # Properties directly inherited from IMachine
     _passthruProperties = [
         "accelerate2DVideoEnabled",
@@ -54,8 +74,44 @@ class VirtualMachine(Wrapper):
         "VRAMSize",
         ]
 
-    _manager = VirtualBoxManager()
-    _vbox = VirtualBox()
+    # Cached properties and their time to live in seconds. Volatile
+    # properties are also invalidated by machine state and data change
+    # events, and only cached while we get them (see VirtualBoxMonitor).
+    _cachedProperties = {
+        "id" : None,
+        "OSTypeId" : None,
+        "settingsFilePath" : None,
+        "sessionState" : 1,
+        "state" : 1,
+        "CPUCount" : 10,
+        "description" : 10,
+        "memorySize" : 10,
+        "monitorCount" : 10,
+        "name" : 10,
+        "VRAMSize" : 10,
+        }
+
+    # Properties holding enumeration values
+    _enumProperties = {
+        "sessionState" : "SessionState",
+        "state" : "MachineState",
+        }
+
+    # Properties returned by snapshot_record()
+    _recordProperties = (
+        "name",
+        "id",
+        "OSTypeId",
+        "description",
+        "CPUCount",
+        "memorySize",
+        "VRAMSize",
+        "monitorCount",
+        "state",
+        "sessionState",
+        "accessible",
+        "settingsFilePath",
+        )
 
     def __init__(self, machine, session=None):
         """Return a VirtualMachine wrapper around given IMachine instance"""
@@ -91,9 +147,7 @@ class VirtualMachine(Wrapper):
         """Power off a running VM.
 
         If wait is True, then wait for power down and session closureto complete."""
-        with self.lock() as session:
-            with VirtualBoxException.ExceptionHandler():
-                session.console.powerDown()
+        self._powerDown()
         # XXX Not sure we need a lock for the following
         if wait:
             self.waitUntilDown()
@@ -104,6 +158,16 @@ class VirtualMachine(Wrapper):
 
         This is spawning a "remote session" in VirtualBox terms."""
         # TODO: Add a wait argument
+        session, progress = self._launch(type, env)
+        with VirtualBoxException.ExceptionHandler():
+            progress.waitForCompletion()
+            session.unlockMachine()
+        self.invalidate()
+
+    def _launch(self, type, env):
+        """Start launching the VM process.
+
+        Returns the session and the Progress of the launch."""
         if not self.isRegistered():
             raise VirtualBoxException.VirtualBoxInvalidVMStateException(
                 "VM is not registered")
@@ -112,9 +176,96 @@ class VirtualMachine(Wrapper):
             session = Session.create()
             iprogress = iMachine.launchVMProcess(session.getISession(),
                                                  type, env)
-            progress = Progress(iprogress)
-            progress.waitForCompletion()
-            session.unlockMachine()
+        return session, Progress(iprogress)
+
+    def _powerDown(self):
+        """Start powering down the VM, returning the Progress if any."""
+        with self.lock() as session:
+            with VirtualBoxException.ExceptionHandler():
+                iprogress = session.console.powerDown()
+        return Progress(iprogress) if iprogress else None
+
+    #
+    # Coroutines, see Async
+    #
+
+    def powerOnAsync(self, type="gui", env=""):
+        """Coroutine form of powerOn().
+
+        Cancelling it cancels the launch. Returns the Progress."""
+        asyncio = Async.getAsyncio()
+        session, progress = self._launch(type, env)
+        try:
+            yield asyncio.From(progress.waitAsync())
+        finally:
+            session.unlockMachine(wait=False)
+            self.invalidate()
+        raise asyncio.Return(progress)
+
+    def powerOffAsync(self, wait=False):
+        """Coroutine form of powerOff().
+
+        Cancelling it cancels the power down if VirtualBox allows."""
+        asyncio = Async.getAsyncio()
+        progress = self._powerDown()
+        if progress is not None:
+            yield asyncio.From(progress.waitAsync())
+        if wait:
+            yield asyncio.From(self.waitUntilDownAsync())
+            yield asyncio.From(self.waitUntilUnlockedAsync())
+
+    def pauseAsync(self, wait=False):
+        """Coroutine form of pause()."""
+        asyncio = Async.getAsyncio()
+        self.pause()
+        if wait:
+            yield asyncio.From(self.waitUntilPausedAsync())
+
+    def takeSnapshotAsync(self, name, description=None):
+        """Coroutine form of takeSnapshot().
+
+        Cancelling it cancels the snapshot. Returns the Progress."""
+        asyncio = Async.getAsyncio()
+        progress = self.takeSnapshot(name, description, wait=False)
+        yield asyncio.From(progress.waitAsync())
+        raise asyncio.Return(progress)
+
+    def deleteSnapshotAsync(self, snapshot):
+        """Coroutine form of deleteSnapshot().
+
+        Returns the Progress."""
+        asyncio = Async.getAsyncio()
+        progress = self.deleteSnapshot(snapshot, wait=False)
+        yield asyncio.From(progress.waitAsync())
+        raise asyncio.Return(progress)
+
+    def waitUntilRunningAsync(self, timeout=None):
+        """Coroutine form of waitUntilRunning()."""
+        return self._waitUntilAsync(self.isRunning, "running", timeout)
+
+    def waitUntilDownAsync(self, timeout=None):
+        """Coroutine form of waitUntilDown()."""
+        return self._waitUntilAsync(self.isDown, "down", timeout)
+
+    def waitUntilPausedAsync(self, timeout=None):
+        """Coroutine form of waitUntilPaused()."""
+        return self._waitUntilAsync(self.isPaused, "paused", timeout)
+
+    def waitUntilUnlockedAsync(self, timeout=None):
+        """Coroutine form of waitUntilUnlocked()."""
+        return self._waitUntilAsync(self.isUnlocked, "unlocked", timeout,
+                                    "sessionState")
+
+    def _waitUntilAsync(self, condition, description, timeout,
+                        property="state"):
+        """Coroutine form of _waitUntil()."""
+        asyncio = Async.getAsyncio()
+        done = yield asyncio.From(Async.waitUntil(
+                self._getVirtualBox(), self._uncached(condition, property),
+                timeout, self.id))
+        if not done:
+            raise VirtualBoxException.VirtualBoxTimeoutException(
+                "%s not %s after %s seconds" % (self, description, timeout))
 
     def eject(self):
         """Do what ever it takes to unregister the VM"""
@@ -149,15 +300,28 @@ class VirtualMachine(Wrapper):
         Throws VirtualBoxFileNotFoundException if file not found."""
         with VirtualBoxException.ExceptionHandler():
             path = cls._canonicalizeVMPath(path)
-            machine = cls._vbox.openMachine(path)
-        return VirtualMachine(machine)
+            machine = cls._getVirtualBox().openMachine(path)
+        return VirtualMachine.intern(machine)
 
     @classmethod
     def find(cls, nameOrId):
-        """Attempts to find a virtual machine given its name or UUID."""
+        """Attempts to find a virtual machine given its name or UUID.
+
+        If VirtualBox.getMachineIndex() has been called, registered
+        machines are looked up in the MachineIndex first, only a miss
+        goes to VirtualBox."""
+        vbox = cls._getVirtualBox()
+        index = vbox.getMachineIndex(create=False)
+        if index is not None:
+            vm = index.find(nameOrId)
+            if vm is not None:
+                return vm
         with VirtualBoxException.ExceptionHandler():
-            machine = cls._vbox.findMachine(nameOrId)
-        return VirtualMachine(machine)
+            machine = vbox.findMachine(nameOrId)
+        vm = VirtualMachine.intern(machine, vbox._manager)
+        if index is not None:
+            index.add(vm)
+        return vm
 
     @classmethod
     def get(cls, id):
@@ -176,24 +340,50 @@ class VirtualMachine(Wrapper):
         machine. Otherwise one will be automatically generated.
 
         If register is True, register machine after creation."""
-        with VirtualBoxException.ExceptionHandler():
-            machine = cls._vbox.createMachine(settingsFile,
-                                              name,
-                                              osTypeId,
-                                              id,
-                                              forceOverwrite)
-        vm = VirtualMachine(machine)
+        vm = cls._create(name, osTypeId, settingsFile, id, forceOverwrite)
         vm.saveSettings()
         if register:
             vm.register()
         return vm
 
+    @classmethod
+    def _create(cls, name, osTypeId, settingsFile, id, forceOverwrite):
+        """Create a new virtual machine without saving its settings."""
+        with VirtualBoxException.ExceptionHandler():
+            machine = cls._getVirtualBox().createMachine(settingsFile,
+                                                         name,
+                                                         osTypeId,
+                                                         id,
+                                                         forceOverwrite)
+        return VirtualMachine.intern(machine)
+
+    # Settings copied by clone()
+    _cloneProperties = (
+        "description",
+        "CPUCount",
+        "memorySize",
+        "VRAMSize",
+        "accelerate3DEnabled",
+        "accelerate2DVideoEnabled",
+        "monitorCount",
+        )
+
+    # Name of the snapshot linked clones are based on by default
+    LINK_SNAPSHOT = "pyVBox linked clone base"
+
     def clone(self, name, settingsFile=None, id=None, register=True,
-              description=None):
+              description=None, linked=False, snapshot=None):
         """Clone this virtual machine as new VM with given name.
 
         Clones basic properties of machine plus any storage
-        controllers. Does not clone any attached storage.
+        controllers. Does not clone any attached storage, unless
+        linked is True.
+
+        If linked is True, the clone gets a differencing disk on top of
+        each hard disk of the source as of the snapshot with the given
+        name (LINK_SNAPSHOT by default), which is taken if it doesn't
+        exist. Creating these costs the same whatever the size of the
+        source disks, which must not change while clones use them.
 
         If settingsFile is not None, it should be a path to use instead
         of the default for the settingsFile
@@ -203,39 +393,131 @@ class VirtualMachine(Wrapper):
 
         If register is True, register new machine after creation.
 
-        If description is None, copy description from source, otherwise use description."""
-        vm = VirtualMachine.create(name,
-                                   self.OSTypeId,
-                                   settingsFile=settingsFile,
-                                   id=id,
-                                   # Once we register, we cannot make
-                                   # changes without opening a
-                                   # session, so defer any
-                                   # registration.
-                                   register=False)
+        If description is None, copy description from source, otherwise use description.
+
+        Settings and controllers are staged and applied to the new
+        machine before it is registered, while it can be changed
+        without a session, and saved once. If that fails, nothing is
+        saved or registered. If anything fails, including registering
+        the new machine, the differencing disks created for it are
+        deleted."""
+        # Stage everything to copy from the source
+        settings = self.fetch("OSTypeId", *self._cloneProperties).asDict()
         if description:
-            vm.description = description
+            settings["description"] = description
+        with VirtualBoxException.ExceptionHandler():
+            controllers = [(c.name, c.bus)
+                           for c in self._getStorageControllers()]
+        if linked:
+            links = self._getLinkBases(snapshot or self.LINK_SNAPSHOT)
         else:
-            vm.description = self.description
-        vm.CPUCount = self.CPUCount
-        vm.memorySize = self.memorySize
-        vm.VRAMSize = self.VRAMSize
-        vm.accelerate3DEnabled = self.accelerate3DEnabled
-        vm.accelerate2DVideoEnabled = self.accelerate2DVideoEnabled
-        vm.monitorCount = self.monitorCount
-        controllers = self.getStorageControllers()
-        vm.register()
-        for controller in controllers:
-            vm.addStorageController(controller.bus,
-                                    name = controller.name)
-        if not register:
-            clone.unregister()
+            links = []
+        vm = VirtualMachine._create(name, settings.pop("OSTypeId"),
+                                    settingsFile, id, False)
+        diffs = []
+        attached = []
+        try:
+            for slot, base in links:
+                diffs.append((slot, vm._createLink(base)))
+            with VirtualBoxException.ExceptionHandler():
+                imachine = vm.getIMachine()
+                for attr in self._cloneProperties:
+                    setattr(imachine, attr, settings[attr])
+                for controllerName, bus in controllers:
+                    imachine.addStorageController(controllerName, bus)
+                for (controller, port, device), diff in diffs:
+                    imachine.attachDevice(controller, port, device,
+                                          Constants.DeviceType_HardDisk,
+                                          diff.getIMedium())
+                    attached.append((controller, port, device))
+                imachine.saveSettings()
+            # We went around the wrapper to set properties
+            vm.invalidate()
+            if register:
+                vm.register()
+        except:
+            excInfo = sys.exc_info()
+            vm._discardLinks(attached, [diff for slot, diff in diffs])
+            raise excInfo[0], excInfo[1], excInfo[2]
         return vm
 
+    def _getLinkBases(self, snapshotName):
+        """Return the hard disks linked clones are based on.
+
+        Returns list of ((controller, port, device), Medium) of the
+        hard disks attached when the named snapshot was taken, taking
+        the snapshot if there is none."""
+        try:
+            snapshot = self.findSnapshot(snapshotName)
+        except VirtualBoxException.VirtualBoxObjectNotFoundException:
+            self.takeSnapshot(snapshotName, "Base of linked clones")
+            snapshot = self.findSnapshot(snapshotName)
+        bases = []
+        with VirtualBoxException.ExceptionHandler():
+            iattachments = self._getManager().getArray(snapshot.getIMachine(),
+                                                       "mediumAttachments")
+            for a in iattachments:
+                if Constants.DeviceType.coerce(a.type) == \
+                        Constants.DeviceType_HardDisk:
+                    bases.append(((a.controller, a.port, a.device),
+                                  Medium.intern(a.medium, self._manager)))
+        return bases
+
+    def _createLink(self, base):
+        """Create a differencing disk on top of base for this new machine.
+
+        It is put next to the settings file of the machine. Returns
+        the new Medium."""
+        with VirtualBoxException.ExceptionHandler():
+            baseName = os.path.splitext(base.name)[0]
+            directory = os.path.dirname(self.settingsFilePath)
+        path = os.path.join(directory, "%s-%s.vdi" % (self.name, baseName))
+        diff = Medium.create(path)
+        try:
+            base.createDiffStorage(diff)
+        except:
+            excInfo = sys.exc_info()
+            self._discardLinks([], [diff])
+            raise excInfo[0], excInfo[1], excInfo[2]
+        return diff
+
+    def _discardLinks(self, slots, diffs):
+        """Detach and delete the differencing disks of a failed clone.
+
+        slots are the (controller, port, device) the disks are attached
+        to. Disks without storage are closed. Errors are ignored, so
+        the original failure is reported."""
+        imachine = self.getIMachine()
+        for controller, port, device in slots:
+            try:
+                with VirtualBoxException.ExceptionHandler():
+                    imachine.detachDevice(controller, port, device)
+            except VirtualBoxException.VirtualBoxException:
+                pass
+        for diff in diffs:
+            try:
+                diff.deleteStorage()
+            except VirtualBoxException.VirtualBoxException:
+                try:
+                    with VirtualBoxException.ExceptionHandler():
+                        diff.close()
+                except VirtualBoxException.VirtualBoxException:
+                    pass
+
     @classmethod
-    def getAll(cls):
-        """Return an array of all known virtual machines"""
-        return [VirtualMachine(vm) for vm in cls._vbox.machines]
+    def getAll(cls, **filters):
+        """Return an array of all known virtual machines
+
+        Takes the same filters as iterAll()."""
+        return list(cls.iterAll(**filters))
+
+    @classmethod
+    def iterAll(cls, **filters):
+        """Return an iterator over all known virtual machines.
+
+        filters are state, osTypeId and name, see
+        VirtualBox.iterMachines()."""
+        return cls._getVirtualBox().iterMachines(**filters)
             
     #
     # Registration methods
@@ -243,8 +525,12 @@ class VirtualMachine(Wrapper):
 
     def register(self):
         """Registers the machine within this VirtualBox installation."""
+        vbox = self._getVirtualBox()
         with VirtualBoxException.ExceptionHandler():
-            self._vbox.registerMachine(self.getIMachine())
+            vbox.registerMachine(self.getIMachine())
+        index = vbox.getMachineIndex(create=False)
+        if index is not None:
+            index.add(self)
 
     def unregister(self,
                    cleanup_mode=Constants.CleanupMode_DetachAllReturnNone):
@@ -252,10 +538,19 @@ class VirtualMachine(Wrapper):
         with VirtualBoxException.ExceptionHandler():
             machine = self.getIMachine()
             machine.unregister(cleanup_mode)
+        index = self._getVirtualBox().getMachineIndex(create=False)
+        if index is not None:
+            index.remove(self.id)
 
     def isRegistered(self):
-        """Is this virtual machine registered?"""
+        """Is this virtual machine registered?
+
+        Answered from the MachineIndex, if there is one, if the machine
+        is in it."""
         from VirtualBoxException import VirtualBoxObjectNotFoundException
+        index = self._getVirtualBox().getMachineIndex(create=False)
+        if (index is not None) and index.contains(self.id):
+            return True
         try:
             VirtualMachine.get(self.id)
             registered = True
@@ -268,12 +563,20 @@ class VirtualMachine(Wrapper):
     #
     # Snapshot methods
     #
+    def findSnapshot(self, nameOrId):
+        """Return the Snapshot of this machine with the given name or UUID.
+
+        Throws VirtualBoxObjectNotFoundException if there is none."""
+        with VirtualBoxException.ExceptionHandler():
+            isnapshot = self.getIMachine().findSnapshot(nameOrId)
+        return Snapshot.intern(isnapshot, self._manager)
+
     def getCurrentSnapshot(self):
         """Returns current snapshot of this machine or None if machine currently has no snapshots"""
         imachine = self.getIMachine()
         if imachine.currentSnapshot is None:
             return None
-        return Snapshot(imachine.currentSnapshot)
+        return Snapshot.intern(imachine.currentSnapshot, self._manager)
 
     def takeSnapshot(self, name, description=None, wait=True):
         """Saves the current execution state and all settings of the machine and creates differencing images for all normal (non-independent) media.
@@ -292,12 +595,16 @@ class VirtualMachine(Wrapper):
     def deleteSnapshot(self, snapshot, wait=True):
         """Deletes the specified snapshot.
 
+        The deletion is tracked in the OperationHistory (see
+        Progress.track()) by wall time, as the number of bytes merged
+        isn't known.
         Returns Progress instance. If wait is True, does not return until process completes."""
         assert(snapshot is not None)
         with self.lock() as session:
             with VirtualBoxException.ExceptionHandler():
                 iprogress = session.console.deleteSnapshot(snapshot.id)
                 progress = Progress(iprogress)
+        progress.track("deleteSnapshot", location=self.settingsFilePath)
         # XXX Not sure if we need a lock for this or not
         if wait:
             progress.waitForCompletion()
@@ -311,12 +618,13 @@ class VirtualMachine(Wrapper):
         """Return wrapped IMachine instance."""
         return self._wrappedInstance
 
+    def snapshot_record(self):
+        """Return a Record of the commonly used properties of the machine."""
+        return self.fetch(*self._recordProperties)
+
     def getOSType(self):
         """Returns an object describing the specified guest OS type."""
-        with VirtualBoxException.ExceptionHandler():
-            imachine = self.getIMachine()
-            osType = self._vbox.getGuestOSType(imachine.OSTypeId)
-        return osType
+        return self._getVirtualBox().getGuestOSType(self.OSTypeId)
 
     #
     # Locking and unlocking
@@ -326,7 +634,8 @@ class VirtualMachine(Wrapper):
     def lock(self, type=Constants.LockType_Shared):
         """Contextmanager yielding a session to a locked machine.
 
-        Machine must be registered."""
+        Only needed to change the machine, its properties can be read
+        without a lock. Machine must be registered."""
         session = Session.create()
         with VirtualBoxException.ExceptionHandler():
             self.getIMachine().lockMachine(session.getISession(), type)
@@ -335,6 +644,57 @@ class VirtualMachine(Wrapper):
             yield session
         finally:
             session.unlockMachine(wait=True)
+            # Anything may have been changed through the session.
+            self.invalidate()
+
+    @contextmanager
+    def edit(self, type=Constants.LockType_Shared):
+        """Contextmanager for changing the machine in one batch.
+
+        Yields the mutable machine of a locked session. Mutating
+        methods called inside the block, on this machine or the
+        mutable one, share the session instead of each locking the
+        machine and saving its settings. Settings are saved once when
+        the block is left, or discarded if it raises an exception.
+
+        Nested calls for the same machine join the outermost batch."""
+        edits = self._getEdits()
+        key = (VirtualBoxManager.getDefault(), self.id)
+        if edits.has_key(key):
+            yield edits[key].session.getMachine()
+            return
+        with self.lock(type) as session:
+            edits[key] = _Batch(session)
+            try:
+                try:
+                    yield session.getMachine()
+                except:
+                    excInfo = sys.exc_info()
+                    try:
+                        session.discardSettings()
+                    except VirtualBoxException.VirtualBoxException:
+                        # Report the original failure, not this one.
+                        pass
+                    raise excInfo[0], excInfo[1], excInfo[2]
+                session.saveSettings()
+            finally:
+                del edits[key]
+
+    def isEditing(self):
+        """Is this thread editing the machine in a batch (see edit())?"""
+        return self._getBatch() is not None
+
+    @staticmethod
+    def _getEdits():
+        """Return the batches this thread is editing."""
+        if not hasattr(_edits, "batches"):
+            _edits.batches = {}
+        return _edits.batches
+
+    def _getBatch(self):
+        """Return the _Batch editing this machine, None if none."""
+        key = (VirtualBoxManager.getDefault(), self.id)
+        return self._getEdits().get(key)
 
     def isLocked(self):
         """Does the machine have an open session?"""
@@ -349,68 +709,130 @@ class VirtualMachine(Wrapper):
         return ((state == Constants.SessionState_Null) or
                 (state == Constants.SessionState_Unlocked))
 
-    def waitUntilUnlocked(self):
-        """Wait until VM is unlocked"""
-        while not self.isUnlocked():
-            self.waitForEvent()
+    def waitUntilUnlocked(self, timeout=None):
+        """Wait until VM is unlocked
+
+        Raises VirtualBoxTimeoutException if timeout seconds pass first."""
+        self._waitUntil(self.isUnlocked, "unlocked", timeout, "sessionState")
 
     #
     # Attach methods
     #
 
-    def attachMedium(self, medium):
-        """Attachs a medium.."""
-        self.attachDevice(medium.deviceType, medium)
-
-    def attachDevice(self, device, medium=None):
-        """Attaches a Device and optionally a Medium."""
+    def attachMedium(self, medium, controller=None):
+        """Attachs a medium..
+
+        If controller is not None, attach to a free slot of the
+        controller with that name."""
+        self.attachDevice(medium.deviceType, medium, controller)
+
+    def attachMediums(self, mediums, controller=None):
+        """Attach several mediums, allocating their slots together.
+
+        If controller is not None, attach to free slots of the
+        controller with that name. Done in one batch (see edit())."""
+        types = [medium.deviceType.type for medium in mediums]
+        with self.edit():
+            topology = self.getStorageTopology()
+            # Slots of each device type, handed out in order
+            slots = {}
+            try:
+                for type in sorted(set(types)):
+                    slots[type] = topology.allocate(types.count(type),
+                                                    controller, type=type)
+            except:
+                topology.release(sum(slots.values(), []))
+                raise
+            pending = [slots[type].pop(0) for type in types]
+            try:
+                for medium in mediums:
+                    self.attachDevice(medium.deviceType, medium, *pending[0])
+                    pending.pop(0)
+            finally:
+                # Give back the slots of mediums not attached
+                topology.release(pending)
+
+    def attachDevice(self, device, medium=None, controller=None, port=None,
+                     deviceNum=None):
+        """Attaches a Device and optionally a Medium.
+
+        The device is attached to the given slot, which must be free
+        and on a controller taking the device. Without a port and
+        device number, the first free slot is used, of the named
+        controller if controller is not None. See StorageTopology.
+
+        Raises VirtualBoxInvalidArgument if only one of port and
+        deviceNum is given, or they are given without controller.
+
+        Part of the current batch if called inside edit()."""
+        if (port is None) != (deviceNum is None):
+            raise VirtualBoxException.VirtualBoxInvalidArgument(
+                "Both or neither of port and deviceNum must be given")
+        if (port is not None) and (controller is None):
+            raise VirtualBoxException.VirtualBoxInvalidArgument(
+                "A port requires a controller")
         imedium = medium.getIMedium() if medium else None
-        with self.lock() as session:
-            with VirtualBoxException.ExceptionHandler():
-                # XXX following code needs to be smarter and find appropriate
-                # attachment point
-                storageControllers = self._getStorageControllers()
-                storageController = storageControllers[0]
-                controllerPort = 0
-                deviceNum = 0
-                session.getIMachine().attachDevice(storageController.name,
-                                                   controllerPort,
-                                                   deviceNum,
-                                                   device.type,
-                                                   imedium)
-                session.saveSettings()
+        with self.edit() as machine:
+            topology = self.getStorageTopology()
+            allocated = []
+            if port is None:
+                allocated = topology.allocate(1, controller, type=device.type)
+                controller, port, deviceNum = allocated[0]
+            else:
+                topology.checkSlot(controller, port, deviceNum, device.type)
+            try:
+                with VirtualBoxException.ExceptionHandler():
+                    machine.getIMachine().attachDevice(controller,
+                                                       port,
+                                                       deviceNum,
+                                                       device.type,
+                                                       imedium)
+            except:
+                topology.release(allocated)
+                raise
+            topology.attach(controller, port, deviceNum, device.type,
+                            medium.id if medium else None)
 
     def detachMedium(self, device):
-        """Detach the medium from the machine."""
-        with self.lock() as session:
+        """Detach the medium from the machine.
+
+        Part of the current batch if called inside edit()."""
+        with self.edit() as machine:
+            topology = self.getStorageTopology()
+            attachment = self._findMediumAttachment(device, topology)
             with VirtualBoxException.ExceptionHandler():
-                attachment = self._findMediumAttachment(device)
-                session.getIMachine().detachDevice(attachment.controller,
+                machine.getIMachine().detachDevice(attachment.controller,
                                                    attachment.port,
                                                    attachment.device)
-                session.saveSettings()
+            topology.detach(attachment.controller, attachment.port,
+                            attachment.device)
 
     def detachAllMediums(self):
-        """Detach all mediums from the machine."""
-        with self.lock() as session:
-            with VirtualBoxException.ExceptionHandler():
-                attachments = self._getMediumAttachments()
-                for attachment in attachments:
-                    session.getIMachine().detachDevice(attachment.controller,
+        """Detach all mediums from the machine.
+
+        Part of the current batch if called inside edit()."""
+        with self.edit() as machine:
+            topology = self.getStorageTopology()
+            for attachment in topology.getAttachments():
+                with VirtualBoxException.ExceptionHandler():
+                    machine.getIMachine().detachDevice(attachment.controller,
                                                        attachment.port,
                                                        attachment.device)
-                    session.saveSettings()
+                topology.detach(attachment.controller, attachment.port,
+                                attachment.device)
 
     def getAttachedMediums(self):
-        """Return array of attached Medium instances."""
-        with self.lock() as session:
-            mediums = []
-            with VirtualBoxException.ExceptionHandler():
-                attachments = self._getMediumAttachments()
-                attachments = filter(lambda a: a.medium is not None,
-                                     attachments)
-                mediums = [Medium(a.medium) for a in attachments]
-            return mediums
+        """Return array of attached Medium instances.
+
+        Reads the saved settings of the machine, without opening a
+        session, so it works the same whether or not the machine is
+        running."""
+        with VirtualBoxException.ExceptionHandler():
+            imediums = [a.medium for a in self._getMediumAttachments()]
+            return [Medium.intern(imedium, self._manager)
+                    for imedium in imediums
+                    # medium can be Null for removable devices
+                    if imedium is not None]
 
     def getHardDrives(self):
         """Return array of Medium instances representing attached HardDrives."""
@@ -424,15 +846,29 @@ class VirtualMachine(Wrapper):
         """Return array of MediumAttachments"""
         return [MediumAttachment(ma) for ma in self._getMediumAttachments()]
 
-    def _findMediumAttachment(self, device):
-        """Given a device, find the IMediumAttachment object associated with its attachment on this machine."""
+    def getStorageTopology(self):
+        """Return the StorageTopology of this machine.
+
+        Inside edit(), this is the topology of the batch, updated by
+        its changes and only fetched once. Otherwise it is fetched
+        anew."""
+        batch = self._getBatch()
+        if batch is None:
+            return StorageTopology.fetch(self)
+        if batch.topology is None:
+            batch.topology = StorageTopology.fetch(batch.session.getMachine())
+        return batch.topology
+
+    def _findMediumAttachment(self, device, topology=None):
+        """Given a device, find the Record of its attachment on this machine.
+
+        See StorageTopology.findByMedium()."""
         assert(device is not None)
-        mediumAttachments = self._getMediumAttachments()
-        for attachment in mediumAttachments:
-            # medium can be Null for removable devices
-            if attachment.medium is not None:
-                if attachment.medium.id == device.id:
-                    return attachment
+        if topology is None:
+            topology = self.getStorageTopology()
+        attachment = topology.findByMedium(device.id)
+        if attachment is not None:
+            return attachment
         raise VirtualBoxException.VirtualBoxPluggableDeviceManagerError(
             "No attachment for device \"%s\" on VM \"%s\" found" % (device,
                                                                     self))
@@ -461,12 +897,14 @@ class VirtualMachine(Wrapper):
         return StorageController(controller)
 
     def removeStorageController(self, name):
-        """Removes a storage controller from the machine."""
-        with self.lock() as session:
+        """Removes a storage controller from the machine.
+
+        Part of the current batch if called inside edit()."""
+        with self.edit() as mutableMachine:
+            topology = self.getStorageTopology()
             with VirtualBoxException.ExceptionHandler():
-                mutableMachine = session.getMachine()
                 mutableMachine.getIMachine().removeStorageController(name)
-            session.saveSettings()
+            topology.removeController(name)
 
     def doesStorageControllerExist(self, name):
         """Return boolean indicating if StorageController with given name exists"""
@@ -488,36 +926,25 @@ class VirtualMachine(Wrapper):
 
         name should be the name of the storage controller. If None, a name will be assigned.
 
+        Part of the current batch if called inside edit().
+
         Returns StorageController instance for new controller.
         """
-        if name is None:
-            name = self._getNewStorageControllerName(type)
-        with self.lock() as session:
+        with self.edit() as mutableMachine:
+            topology = self.getStorageTopology()
+            if name is None:
+                name = topology.newControllerName(type)
             with VirtualBoxException.ExceptionHandler():
-                mutableMachine = session.getMachine()
                 controller = mutableMachine.getIMachine().addStorageController(name, type)
-            session.saveSettings()
+                topology.addController(name, type, controller.portCount,
+                                       controller.maxDevicesPerPortCount)
         return StorageController(controller)
         
     def _getNewStorageControllerName(self, type):
         """Choose a name for a new StorageController of the given type.
 
         Takes a string describing the controller type and adds an number to it to uniqify it if needed."""
-        baseNames = {
-            Constants.StorageBus_IDE    : "IDE Controller",
-            Constants.StorageBus_SATA   : "SATA Controller",
-            Constants.StorageBus_SCSI   : "SCSI Controller",
-            Constants.StorageBus_Floppy : "Floppy Controller"
-            }
-        if not baseNames.has_key(type):
-            # Todo: Use correct argument type here
-            raise Exception("Invalid type '%d'" % type)
-        count = 1
-        name = baseNames[type]
-        while self.doesStorageControllerExist(name):
-            count += 1
-            name = "%s %d" % (baseNames[type], count)
-        return name
+        return self.getStorageTopology().newControllerName(type)
 
     #
     # Settings functions
@@ -528,22 +955,29 @@ class VirtualMachine(Wrapper):
         with VirtualBoxException.ExceptionHandler():
             self.getIMachine().saveSettings()
 
+    def discardSettings(self):
+        """Discards any changes to machine settings made since the session has been opened or since the last call to saveSettings or discardSettings."""
+        with VirtualBoxException.ExceptionHandler():
+            self.getIMachine().discardSettings()
+
     #
     # Monitoring methods
     #
 
     def waitForEvent(self):
-        self._getManager().waitForEvents()
+        self._getVirtualBox().waitForEvent()
 
-    def waitUntilRunning(self):
-        """Wait until machine is running."""
-        while not self.isRunning():
-            self.waitForEvent()
+    def waitUntilRunning(self, timeout=None):
+        """Wait until machine is running.
 
-    def waitUntilDown(self):
-        """Wait until machine is down (cleanly or not)."""
-        while not self.isDown():
-            self.waitForEvent()
+        Raises VirtualBoxTimeoutException if timeout seconds pass first."""
+        self._waitUntil(self.isRunning, "running", timeout)
+
+    def waitUntilDown(self, timeout=None):
+        """Wait until machine is down (cleanly or not).
+
+        Raises VirtualBoxTimeoutException if timeout seconds pass first."""
+        self._waitUntil(self.isDown, "down", timeout)
 
     def isDown(self):
         """Is machine down (PoweredOff, Aborted)?"""
@@ -565,12 +999,33 @@ class VirtualMachine(Wrapper):
         state = self.state
         if (state == Constants.MachineState_Paused):
             return True
-        return Fals
+        return False
 
-    def waitUntilPaused(self):
-        """Wait until machine is paused."""
-        while not self.isPaused():
-            self.waitForEvent()
+    def waitUntilPaused(self, timeout=None):
+        """Wait until machine is paused.
+
+        Raises VirtualBoxTimeoutException if timeout seconds pass first."""
+        self._waitUntil(self.isPaused, "paused", timeout)
+
+    def _waitUntil(self, condition, description, timeout, property="state"):
+        """Wait until condition() is True, see VirtualBox.waitUntil().
+
+        condition depends on the named property, which is read afresh
+        for each check."""
+        if not self._getVirtualBox().waitUntil(
+            self._uncached(condition, property), timeout, self.id):
+            raise VirtualBoxException.VirtualBoxTimeoutException(
+                "%s not %s after %s seconds" % (self, description, timeout))
+
+    def _uncached(self, condition, property):
+        """Return condition wrapped to discard the cached property first.
+
+        Otherwise checks made without an event, which would have
+        invalidated it, could see a value up to its time to live old."""
+        def check():
+            self.invalidate(property)
+            return condition()
+        return check
 
     #
     # Internal utility functions
@@ -594,7 +1049,14 @@ class VirtualMachine(Wrapper):
 
     def _getManager(self):
         """Return the IVirtualBoxManager object associated with this VirtualMachine."""
-        return self._manager
+        if self._manager is not None:
+            return self._manager
+        return VirtualBoxManager.getDefault()
+
+    @classmethod
+    def _getVirtualBox(cls):
+        """Return the VirtualBox instance this VirtualMachine belongs to."""
+        return VirtualBox.getDefault()
 
     def _getStorageControllers(self):
         """Return the array of storage controllers associated with this virtual machine."""
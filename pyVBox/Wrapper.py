@@ -1,5 +1,168 @@
+from Record import Record
 import VirtualBoxException
 
+import threading
+import time
+import weakref
+
+class _Epoch(object):
+    """Number of times an object was invalidated, see Wrapper.invalidateId()."""
+    __slots__ = ("value", "__weakref__")
+
+    def __init__(self):
+        self.value = 0
+
+# Invalidation epochs for cached properties, keyed by object UUID.
+# Bumping the epoch for an id invalidates cached values of any wrapper
+# around the object with that id (see Wrapper.invalidateId()). Wrappers
+# hold on to their epoch, so it goes away with the last of them.
+_epochs = weakref.WeakValueDictionary()
+_epochsLock = threading.Lock()
+
+# Held while looking up and filling the identity maps, see Wrapper.intern()
+_internLock = threading.Lock()
+
+# Number of VirtualBoxMonitors listening, keyed by VirtualBoxManager
+# (see Wrapper.setMonitored()). Values with a time to live are only
+# cached for wrappers of a manager with one, as nothing else discards
+# them when the object is changed elsewhere.
+_monitors = weakref.WeakKeyDictionary()
+_monitorsLock = threading.Lock()
+# Number of times a VirtualBoxMonitor stopped listening. Values cached
+# before aren't used after, as changes in between may have been missed.
+_monitorStops = 0
+
+class PassthruProperty(object):
+    """Descriptor exposing a property of the wrapped instance directly.
+
+    The property can be retrieved or set, but not deleted. If enum
+    is not None, values are converted with Constants.<enum>.coerce()."""
+    def __init__(self, name, enum=None):
+        self.name = name
+        self.enum = enum
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        wrapped = instance._wrappedInstance
+        if not wrapped:
+            raise AttributeError("Unrecognized attribute '%s'" % self.name)
+        try:
+            value = getattr(wrapped, self.name)
+        except Exception, e:
+            VirtualBoxException.translateException(type(e), e)
+            raise
+        if self.enum is not None:
+            from Constants import Constants
+            value = getattr(Constants, self.enum).coerce(value)
+        return value
+
+    def __set__(self, instance, value):
+        wrapped = instance._wrappedInstance
+        if not wrapped:
+            raise AttributeError("Cannot set attribute '%s'" % self.name)
+        try:
+            setattr(wrapped, self.name, value)
+        except Exception, e:
+            VirtualBoxException.translateException(type(e), e)
+            raise
+
+    def __delete__(self, instance):
+        raise AttributeError("Cannot delete attribute '%s'" % self.name)
+
+class CachedProperty(PassthruProperty):
+    """Descriptor like PassthruProperty, but caching the value.
+
+    ttl is the time to live of the cached value in seconds, None
+    caches the value forever. Values with a ttl are also discarded
+    when the epoch of their object changes, and are only cached while
+    a VirtualBoxMonitor listens for the events changing it."""
+    def __init__(self, name, ttl=None, enum=None):
+        PassthruProperty.__init__(self, name, enum)
+        self.ttl = ttl
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        cache = instance._propertyCache
+        if cache is None:
+            cache = instance._propertyCache = {}
+        entry = cache.get(self.name)
+        if self.ttl is None:
+            if entry is not None:
+                return entry[0]
+            value = PassthruProperty.__get__(self, instance, owner)
+            cache[self.name] = (value, None, None)
+            return value
+        # Get epoch before value so an invalidation while we are
+        # fetching leaves the entry stale.
+        epoch = instance._getEpoch()
+        if epoch is not None:
+            epoch = epoch.value
+        stops = _monitorStops
+        now = time.time()
+        if ((entry is not None) and (now < entry[1]) and
+            (epoch == entry[2]) and (stops == entry[3])):
+            return entry[0]
+        value = PassthruProperty.__get__(self, instance, owner)
+        # Without events the value could go stale unnoticed, so it is
+        # read every time.
+        if instance._isMonitored():
+            cache[self.name] = (value, now + self.ttl, epoch, stops)
+        return value
+
+    def __set__(self, instance, value):
+        PassthruProperty.__set__(self, instance, value)
+        if instance._propertyCache:
+            instance._propertyCache.pop(self.name, None)
+
+class WrappedProperty(PassthruProperty):
+    """Descriptor returning a property of the wrapped instance converted
+    by a function or class."""
+    def __init__(self, name, func):
+        PassthruProperty.__init__(self, name)
+        self.func = func
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = PassthruProperty.__get__(self, instance, owner)
+        return self.func(value) if value else None
+
+class WrapperType(type):
+    """Metaclass for Wrapper.
+
+    Converts _passthruProperties and _wrappedProperties into descriptors
+    when the class is created, so that accessing a wrapped property is a
+    normal attribute lookup rather than a search of those lists."""
+    def __init__(cls, name, bases, dict):
+        type.__init__(cls, name, bases, dict)
+        # Each class gets its own identity map (see Wrapper.intern())
+        cls._identityMap = weakref.WeakValueDictionary()
+        for attr in cls._passthruProperties:
+            enum = cls._enumProperties.get(attr)
+            if attr in cls._cachedProperties:
+                descriptor = CachedProperty(attr,
+                                            cls._cachedProperties[attr],
+                                            enum)
+            else:
+                descriptor = PassthruProperty(attr, enum)
+            cls._addProperty(attr, descriptor)
+        for attr, func in cls._wrappedProperties:
+            cls._addProperty(attr, WrappedProperty(attr, func))
+
+    def _addProperty(cls, attr, descriptor):
+        """Add descriptor as attr unless the class defines attr itself."""
+        for klass in cls.__mro__:
+            if attr in klass.__dict__:
+                if not isinstance(klass.__dict__[attr], PassthruProperty):
+                    # Explicitly defined attributes and methods take
+                    # precedence, as they did when these lists were
+                    # only consulted by __getattr__().
+                    return
+                break
+        setattr(cls, attr, descriptor)
+
 class Wrapper(object):
     """Base class for wrappers around VirtualBox XPCOM-based objects.
 
@@ -18,35 +181,156 @@ class Wrapper(object):
     element is invoked with the property as an argument and the result is
     returned.
 
+    _cachedProperties is a dictionary mapping names of passthru
+    properties whose values should be cached to their time to live in
+    seconds. None caches the value forever. Properties with a time to
+    live are also invalidated by invalidateId(), which is called in
+    response to VirtualBox events (see VirtualBoxMonitor), and are
+    only cached while a VirtualBoxMonitor listens to the manager of
+    the wrapper, e.g. while the EventPump runs. Otherwise they are
+    read every time. Setting a property always discards its cached
+    value.
+
+    _enumProperties is a dictionary mapping names of passthru
+    properties holding enumeration values to the name of their
+    enumeration, e.g. "MachineState". Their values are always
+    returned as integers, even by the webservice which returns names.
+
+    These are turned into descriptors on the class when it is
+    created (see WrapperType), so they must be set in the class body.
+
     Utilizing this class since I don't kow how to inherit the XPCOM
     classes directly.
     """
-    _wrappedInstance = None
+    __metaclass__ = WrapperType
+
+    # _propertyCache is the dictionary of cached property values,
+    # created on first use. _manager is the VirtualBoxManager the
+    # wrapped instance came from, if known, see intern(). _epoch is
+    # the _Epoch of the object, see _getEpoch(). Subclasses should
+    # define __slots__ too.
+    __slots__ = ("_wrappedInstance", "_propertyCache", "_manager", "_epoch",
+                 "__weakref__")
+
     _passthruProperties = []
     _wrappedProperties = []
+    _cachedProperties = {}
+    _enumProperties = {}
+
+    def __new__(cls, *args, **kwargs):
+        self = object.__new__(cls)
+        self._wrappedInstance = None
+        self._propertyCache = None
+        self._manager = None
+        self._epoch = None
+        return self
 
     def __getattr__(self, attr):
-        if self._wrappedInstance:
-            if attr in self._passthruProperties:
-                with VirtualBoxException.ExceptionHandler():
-                    return getattr(self._wrappedInstance, attr)
-            for prop, func in self._wrappedProperties:
-                if prop == attr:
-                    with VirtualBoxException.ExceptionHandler():
-                        value = getattr(self._wrappedInstance, attr)
-                    return func(value) if value else None
+        # Only called if attr isn't a descriptor created by WrapperType
+        # or otherwise found on the instance or class.
         raise AttributeError("Unrecognized attribute '%s'" % attr)
 
-    def __setattr__(self, attr, value):
-        if self._wrappedInstance and (attr in self._passthruProperties):
-            with VirtualBoxException.ExceptionHandler():
-                setattr(self._wrappedInstance, attr, value)
-        self.__dict__[attr] = value
+    @classmethod
+    def intern(cls, instance, manager=None):
+        """Return the wrapper for the given instance, creating it if needed.
+
+        manager is the VirtualBoxManager instance came from, by default
+        the current one (see VirtualBoxManager.getDefault()). Wrappers
+        are keyed by it and the id of the instance, so all instances
+        for the same VirtualBox object share one wrapper (and its
+        cached properties) for as long as the wrapper is in use."""
+        if manager is None:
+            from VirtualBoxManager import VirtualBoxManager
+            manager = VirtualBoxManager.getDefault()
+        with VirtualBoxException.ExceptionHandler():
+            id = instance.id
+        key = (manager, id)
+        with _internLock:
+            wrapper = cls._identityMap.get(key)
+            if wrapper is None:
+                wrapper = cls(instance)
+                wrapper._manager = manager
+                if cls._cachedProperties.get("id", False) is None:
+                    wrapper._propertyCache = { "id" : (id, None, None) }
+                cls._identityMap[key] = wrapper
+            else:
+                # Prefer the newest instance, from the same manager, in
+                # case the old one is no longer valid, e.g. the object
+                # was unregistered and opened again.
+                wrapper._wrappedInstance = instance
+        return wrapper
+
+    def fetch(self, *names):
+        """Return a Record of the named properties.
+
+        Values are collected in one pass, using and filling the
+        property cache, so the Record reflects a single point in time as
+        closely as possible and may be passed between threads."""
+        values = []
+        with VirtualBoxException.ExceptionHandler():
+            for name in names:
+                values.append(getattr(self, name))
+        return Record(names, values)
+
+    def invalidate(self, *names):
+        """Discard cached values of the named properties.
+
+        If no names are given, discard all cached values."""
+        if not self._propertyCache:
+            return
+        if names:
+            for name in names:
+                self._propertyCache.pop(name, None)
+        else:
+            self._propertyCache.clear()
+
+    @staticmethod
+    def invalidateId(id):
+        """Discard cached values with a time to live for object with id.
+
+        Values cached forever are kept."""
+        with _epochsLock:
+            epoch = _epochs.get(id)
+            if epoch is not None:
+                epoch.value += 1
+
+    @staticmethod
+    def setMonitored(manager, monitored):
+        """Note a VirtualBoxMonitor started or stopped listening to manager."""
+        global _monitorStops
+        with _monitorsLock:
+            if not monitored:
+                _monitorStops += 1
+            count = _monitors.get(manager, 0) + (1 if monitored else -1)
+            if count > 0:
+                _monitors[manager] = count
+            else:
+                _monitors.pop(manager, None)
+
+    def _isMonitored(self):
+        """Is a VirtualBoxMonitor listening to the manager of this wrapper?"""
+        if not _monitors:
+            return False
+        manager = self._manager
+        if manager is None:
+            from VirtualBoxManager import VirtualBoxManager
+            manager = VirtualBoxManager.getCurrent()
+            if manager is None:
+                return False
+        return _monitors.has_key(manager)
 
-    def __delattr__(self, attr):
-       if self._wrappedInstance and (attr in self._passthruProperties):
-           with VirtualBoxException.ExceptionHandler():
-               raise AttributeError("Cannot delete attribute '%s'" % attr)
-       del self.__dict__[attr]
+    def _getEpoch(self):
+        """Return the _Epoch of this object, None if it has none.
 
-            
+        Only wrappers caching their id forever have one, others would
+        need a round trip to find it, so only rely on ttls."""
+        if self._epoch is None:
+            if self._cachedProperties.get("id", False) is not None:
+                return None
+            id = self.id
+            with _epochsLock:
+                epoch = _epochs.get(id)
+                if epoch is None:
+                    epoch = _epochs[id] = _Epoch()
+            self._epoch = epoch
+        return self._epoch
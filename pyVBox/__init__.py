@@ -1,19 +1,76 @@
-from HardDisk import HardDisk
-from Medium import Device
-from Medium import DVD
-from Medium import Floppy
-from Medium import Medium
-from Medium import NetworkDevice
-from Medium import SharedFolder
-from Medium import USBDevice
-from Session import Session
-from StorageController import StorageController
-from VirtualBox import VirtualBox
-from VirtualBoxManager import Constants
-from VirtualBoxException import ExceptionHandler
-from VirtualBoxException import VirtualBoxException
-from VirtualBoxException import VirtualBoxFileError
-from VirtualBoxException import VirtualBoxFileNotFoundException
-from VirtualBoxException import VirtualBoxObjectNotFoundException
-from VirtualBoxManager import VirtualBoxManager
-from VirtualMachine import VirtualMachine
+"""pyVBox, a shim layer above the VirtualBox Python API.
+
+Modules are imported the first time one of the attributes they define
+is used, so importing pyVBox is cheap and does not initialize XPCOM."""
+
+import sys
+import types
+
+# Package attributes and the modules defining them.
+_attributes = {
+    "ChunkStore" : "ChunkStore",
+    "Constants" : "Constants",
+    "Device" : "Medium",
+    "DVD" : "Medium",
+    "ExceptionHandler" : "VirtualBoxException",
+    "EventPump" : "EventPump",
+    "Floppy" : "Medium",
+    "GuestOSType" : "GuestOSType",
+    "GuestOSTypeCache" : "GuestOSTypeCache",
+    "HardDisk" : "HardDisk",
+    "MachineIndex" : "MachineIndex",
+    "Medium" : "Medium",
+    "MediumAttachment" : "MediumAttachment",
+    "NetworkDevice" : "Medium",
+    "OperationHistory" : "OperationHistory",
+    "PauseMonitor" : "PauseMonitor",
+    "Progress" : "Progress",
+    "ProgressGroup" : "ProgressGroup",
+    "Record" : "Record",
+    "Session" : "Session",
+    "SharedFolder" : "Medium",
+    "StorageController" : "StorageController",
+    "StorageTopology" : "StorageTopology",
+    "USBDevice" : "Medium",
+    "VirtualBox" : "VirtualBox",
+    "VirtualBoxCluster" : "VirtualBoxCluster",
+    "VirtualBoxException" : "VirtualBoxException",
+    "VirtualBoxFileError" : "VirtualBoxException",
+    "VirtualBoxFileNotFoundException" : "VirtualBoxException",
+    "VirtualBoxManager" : "VirtualBoxManager",
+    "VirtualBoxManagerPool" : "VirtualBoxManagerPool",
+    "VirtualBoxObjectNotFoundException" : "VirtualBoxException",
+    "VirtualBoxOperationAborted" : "VirtualBoxException",
+    "VirtualBoxTimeoutException" : "VirtualBoxException",
+    "VirtualMachine" : "VirtualMachine",
+    }
+
+__all__ = sorted(_attributes.keys())
+
+class _LazyPackage(types.ModuleType):
+    """The pyVBox package, importing modules as their attributes are used."""
+
+    def __getattr__(self, name):
+        # Only called for attributes not imported yet
+        if not _attributes.has_key(name):
+            raise AttributeError("'module' object has no attribute '%s'" %
+                                 name)
+        module = __import__("%s.%s" % (__name__, _attributes[name]),
+                            fromlist=[name])
+        return getattr(module, name)
+
+    def __getattribute__(self, name):
+        value = types.ModuleType.__getattribute__(self, name)
+        # Importing a module, e.g. pyVBox.HardDisk, sets the package
+        # attribute of the same name to the module. Return the class
+        # of that name instead.
+        if isinstance(value, types.ModuleType) and _attributes.has_key(name):
+            value = getattr(value, name)
+        return value
+
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(globals())
+# Keep the original module alive, Python 2 clears the globals of
+# modules when they are freed.
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Unittests for the coroutine (*Async()) methods
+
+These need trollius and are skipped without it."""
+
+from pyVBoxStubs import StubEvent, StubIMachine, StubIProgress
+from pyVBoxStubs import StubTestCase
+from pyVBox import Constants
+from pyVBox import Progress
+from pyVBox import VirtualBoxException
+from pyVBox import VirtualBoxTimeoutException
+from pyVBox import VirtualMachine
+
+import threading
+import time
+import unittest
+
+try:
+    import trollius
+except ImportError:
+    trollius = None
+
+@unittest.skipIf(trollius is None, "trollius not installed")
+class AsyncTests(unittest.TestCase):
+    """Test case for the coroutine methods"""
+
+    def setUp(self):
+        self.loop = trollius.new_event_loop()
+        trollius.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        trollius.set_event_loop(None)
+
+    def testWaitAsync(self):
+        """Test Progress.waitAsync()"""
+        progress = Progress(StubIProgress(0.2))
+        result = self.loop.run_until_complete(progress.waitAsync())
+        self.assertTrue(result is progress)
+        self.assertTrue(progress.completed)
+
+    def testFailure(self):
+        """Test Progress.waitAsync() raises if the task fails"""
+        progress = Progress(StubIProgress(0.1, resultCode=1))
+        self.assertRaises(VirtualBoxException,
+                          self.loop.run_until_complete, progress.waitAsync())
+
+    def testCancel(self):
+        """Test cancelling Progress.waitAsync() cancels the task"""
+        iprogress = StubIProgress(10)
+        task = trollius.Task(Progress(iprogress).waitAsync(),
+                             loop=self.loop)
+        self.loop.call_later(0.1, task.cancel)
+        self.assertRaises(trollius.CancelledError,
+                          self.loop.run_until_complete, task)
+        self.assertTrue(iprogress.canceled)
+
+    def testConcurrent(self):
+        """Test many operations run concurrently on one loop"""
+        progresses = [Progress(StubIProgress(0.5)) for i in range(200)]
+        start = time.time()
+        self.loop.run_until_complete(trollius.wait(
+                [p.waitAsync() for p in progresses], loop=self.loop))
+        self.assertTrue(time.time() - start < 2)
+        self.assertTrue(all([p.completed for p in progresses]))
+
+@unittest.skipIf(trollius is None, "trollius not installed")
+class AsyncVirtualMachineTests(StubTestCase):
+    """Test case for the coroutine methods of VirtualMachine"""
+
+    def createMachines(self):
+        self.machine = StubIMachine(state=Constants.MachineState_PoweredOff)
+        return [self.machine]
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        self.loop = trollius.new_event_loop()
+        trollius.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        trollius.set_event_loop(None)
+        StubTestCase.tearDown(self)
+
+    def testWaitUntilRunningAsync(self):
+        """Test VirtualMachine.waitUntilRunningAsync()"""
+        machine = self.machine
+        vm = VirtualMachine.intern(machine)
+        def start():
+            machine.state = Constants.MachineState_Running
+            self.ivbox.eventSource.fireEvent(StubEvent(
+                    Constants.VBoxEventType_OnMachineStateChanged,
+                    machineId=machine.id, state=machine.state))
+        self.loop.call_later(0.1, start)
+        self.loop.run_until_complete(vm.waitUntilRunningAsync(timeout=5))
+        self.assertTrue(vm.isRunning())
+        self.assertRaises(VirtualBoxTimeoutException,
+                          self.loop.run_until_complete,
+                          vm.waitUntilPausedAsync(timeout=0.1))
+
+class AsyncWithoutTrolliusTests(unittest.TestCase):
+    """Test case for Progress.waitForCompletion() alongside the coroutines"""
+
+    def testWaitForCompletion(self):
+        """Test Progress.waitForCompletion() still works"""
+        progress = Progress(StubIProgress(0.1))
+        progress.waitForCompletion()
+        self.assertTrue(progress.completed)
+        progress = Progress(StubIProgress(0.1, resultCode=1))
+        self.assertRaises(VirtualBoxException, progress.waitForCompletion)
+
+    def testCancel(self):
+        """Test Progress.cancel()"""
+        iprogress = StubIProgress(10)
+        self.assertTrue(Progress(iprogress).cancel())
+        self.assertTrue(iprogress.canceled)
+        self.assertFalse(Progress(StubIProgress(10, cancelable=False)).cancel())
+
+if __name__ == '__main__':
+    unittest.main()
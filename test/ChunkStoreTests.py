@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""Unittests for ChunkStore"""
+
+from pyVBoxBenchmark import report
+from pyVBoxStubs import StubIMedium, StubTestCase, setCacheDir
+from pyVBox import ChunkStore
+from pyVBox import Medium
+from pyVBox import VirtualBoxException
+from pyVBox import VirtualBoxObjectNotFoundException
+
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+class ChunkStoreTests(unittest.TestCase):
+    """Test case for ChunkStore"""
+
+    testHD = "test/appliances/TestHD.vdi"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = ChunkStore(os.path.join(self.directory, "store"),
+                                chunkSize=4096)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _sparseImage(self, path, size, writes):
+        """Create a sparse file of size bytes with the given writes.
+
+        writes is a list of (offset, data)."""
+        with open(path, "wb") as f:
+            for offset, data in writes:
+                f.seek(offset)
+                f.write(data)
+            f.truncate(size)
+
+    def testRestore(self):
+        """Test backing up and restoring the test hard disk"""
+        stats = self.store.backup(self.testHD, "TestHD")
+        self.assertEqual(stats.size, os.path.getsize(self.testHD))
+        self.assertEqual(stats.chunks, 9)
+        # Repeated chunks are only written once
+        self.assertTrue(stats.newChunks + stats.zeroChunks <= stats.chunks)
+        self.assertTrue(stats.bytesWritten < stats.size)
+        self.assertEqual(self.store.getNames(), ["TestHD"])
+        self.assertEqual(self.store.verify("TestHD"), [])
+        self.store.restore("TestHD", self._path("restored.vdi"))
+        self.assertEqual(self._read(self._path("restored.vdi")),
+                         self._read(self.testHD))
+
+    def testDedup(self):
+        """Test backing up again only writes changed chunks"""
+        first = self.store.backup(self.testHD, "first")
+        second = self.store.backup(self.testHD, "second")
+        self.assertEqual(second.newChunks, 0)
+        self.assertEqual(second.bytesWritten, 0)
+        # Change one chunk of a copy
+        copy = self._path("copy.vdi")
+        shutil.copy(self.testHD, copy)
+        with open(copy, "r+b") as f:
+            f.seek(5 * 4096 + 10)
+            f.write("changed")
+        third = self.store.backup(copy, "third")
+        self.assertEqual(third.newChunks, 1)
+        self.assertEqual(third.bytesWritten, 4096)
+        for name, path in (("first", self.testHD), ("third", copy)):
+            target = self._path(name + ".vdi")
+            self.store.restore(name, target)
+            self.assertEqual(self._read(target), self._read(path))
+
+    def testSparse(self):
+        """Test large sparse images stay sparse in the store and restored"""
+        store = ChunkStore(self._path("sparse"))
+        size = 256 * 1024 * 1024
+        image = self._path("sparse.img")
+        writes = [(0, "header"), (100 * 1024 * 1024 + 7, "middle"),
+                  (size - 3, "end")]
+        self._sparseImage(image, size, writes)
+        start = time.time()
+        stats = store.backup(image, "sparse")
+        elapsed = time.time() - start
+        report("Backing up a %d MB sparse image" % (size / 1024 / 1024), [
+                ("seconds:", elapsed),
+                ("chunks written:", stats.newChunks),
+                ("bytes written:", stats.bytesWritten),
+                ])
+        self.assertEqual(stats.chunks, 256)
+        self.assertEqual(stats.newChunks, 3)
+        self.assertEqual(stats.zeroChunks, 253)
+        target = self._path("restored.img")
+        store.restore("sparse", target)
+        self.assertEqual(os.path.getsize(target), size)
+        with open(target, "rb") as f:
+            for offset, data in writes:
+                f.seek(offset)
+                self.assertEqual(f.read(len(data)), data)
+        # Holes weren't written, where the filesystem supports them
+        blocks = getattr(os.stat(target), "st_blocks", None)
+        if blocks is not None and \
+                os.stat(image).st_blocks * 512 < size / 2:
+            self.assertTrue(blocks * 512 < size / 2, blocks)
+        # Growing the image only adds what changed
+        self._sparseImage(image, size * 2,
+                          writes + [(size + 5, "grown")])
+        grown = store.backup(image, "grown")
+        self.assertEqual(grown.newChunks, 1)
+        self.assertEqual(grown.chunks, 512)
+
+    def testTrailingPartialChunk(self):
+        """Test an image whose size isn't a multiple of the chunk size"""
+        image = self._path("odd.img")
+        self._sparseImage(image, 4096 * 3 + 100, [(4096 * 3 + 50, "tail")])
+        stats = self.store.backup(image, "odd")
+        self.assertEqual(stats.chunks, 4)
+        self.assertEqual(stats.newChunks, 1)
+        self.store.restore("odd", self._path("restored.img"))
+        self.assertEqual(self._read(self._path("restored.img")),
+                         self._read(image))
+
+    def testCorrupt(self):
+        """Test missing and corrupt chunks are found"""
+        self.store.backup(self.testHD, "TestHD")
+        digests = [d for d in self.store.getManifest("TestHD")["chunks"]
+                   if d is not None]
+        with open(self.store._getChunkPath(digests[0]), "wb") as f:
+            f.write("garbage")
+        os.remove(self.store._getChunkPath(digests[-1]))
+        self.assertEqual(self.store.verify("TestHD"),
+                         sorted([digests[0], digests[-1]]))
+        target = self._path("restored.vdi")
+        self.assertRaises(VirtualBoxException, self.store.restore, "TestHD",
+                          target)
+        self.assertFalse(os.path.exists(target))
+
+    def testRestoreUnwritable(self):
+        """Test the error for a target that can't be created is kept"""
+        self.store.backup(self.testHD, "TestHD")
+        target = self._path("missing/restored.vdi")
+        try:
+            self.store.restore("TestHD", target)
+        except IOError, e:
+            self.assertEqual(e.filename, target)
+        else:
+            self.fail("Expected IOError")
+
+    def testNames(self):
+        """Test errors for unknown and existing backups"""
+        self.assertEqual(self.store.getNames(), [])
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          self.store.restore, "bogus", self._path("x"))
+        self.store.backup(self.testHD, "TestHD")
+        self.assertRaises(VirtualBoxException, self.store.backup,
+                          self.testHD, "TestHD")
+        self.assertRaises(VirtualBoxException, self.store.restore,
+                          "TestHD", self.testHD)
+        name = self.store.backup(self.testHD).name
+        self.assertTrue(name.startswith("TestHD.vdi-"), name)
+
+class ChunkStoreMediumTests(StubTestCase):
+    """Test case for ChunkStore.backupMedium() using stand-ins"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        setCacheDir(self, self.directory)
+        StubTestCase.setUp(self)
+        self.store = ChunkStore(os.path.join(self.directory, "store"),
+                                chunkSize=4096)
+        # The base image and a differencing image on top of it, as
+        # left behind by a snapshot.
+        self.base = StubIMedium(os.path.abspath(ChunkStoreTests.testHD))
+        self.diffPath = os.path.join(self.directory, "diff.vdi")
+        with open(self.diffPath, "wb") as f:
+            f.write("Only the changes")
+        self.diff = StubIMedium(self.diffPath, parent=self.base,
+                                writes=[(4096 * 2, "changed")])
+
+    def testDifferencing(self):
+        """Test a differencing medium is stored flattened"""
+        medium = Medium.intern(self.diff)
+        self.assertTrue(medium.isDifferencing())
+        stats = self.store.backupMedium(medium, "diff")
+        with open(ChunkStoreTests.testHD, "rb") as f:
+            expected = f.read()
+        expected = expected[:4096 * 2] + "changed" + \
+            expected[4096 * 2 + len("changed"):]
+        self.assertEqual(stats.size, len(expected))
+        target = os.path.join(self.directory, "restored.vdi")
+        self.store.restore("diff", target)
+        with open(target, "rb") as f:
+            self.assertEqual(f.read(), expected)
+        # Only the backup is left in the store
+        self.assertEqual(sorted(os.listdir(self.store.path)),
+                         ["chunks", "manifests"])
+        # Its differencing image was left alone
+        with open(self.diffPath, "rb") as f:
+            self.assertEqual(f.read(), "Only the changes")
+
+    def testBase(self):
+        """Test a medium that isn't differencing is stored as is"""
+        medium = Medium.intern(self.base)
+        self.assertFalse(medium.isDifferencing())
+        stats = self.store.backupMedium(medium, "base")
+        self.assertEqual(stats.size, os.path.getsize(ChunkStoreTests.testHD))
+
+if __name__ == '__main__':
+    unittest.main()
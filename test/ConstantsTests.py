@@ -5,6 +5,9 @@ from pyVBoxTest import pyVBoxTest, main
 from pyVBox import Constants
 from pyVBox import VirtualBoxException
 
+import json
+import os.path
+
 class ConstantsTests(pyVBoxTest):
     """Test case for Constants"""
 
@@ -40,6 +43,45 @@ class ConstantsTests(pyVBoxTest):
         s = Constants.SessionType_Remote
         s = Constants.SessionType_Shared
 
+    def testEnum(self):
+        """Test enumerations"""
+        running = Constants.MachineState_Running
+        self.assertEqual(running, Constants.MachineState.Running)
+        self.assertEqual(running, Constants.MachineState.value_of("Running"))
+        self.assertEqual("Running", Constants.MachineState.name_of(running))
+        self.assertTrue(running in Constants.MachineState)
+        self.assertTrue("Running" in Constants.MachineState.names())
+        self.assertRaises(ValueError, Constants.MachineState.name_of, -1)
+        self.assertEqual(running, Constants.MachineState.coerce("Running"))
+        self.assertEqual(running, Constants.MachineState.coerce(running))
+        self.assertEqual(None, Constants.MachineState.coerce(None))
+        self.assertRaises(AttributeError, getattr, Constants, "BogusEnum")
+
+    def testSaveAndLoad(self):
+        """Test Constants.save() and Constants.load()"""
+        path = os.path.join(self.testPath, "constants.json")
+        Constants.save(path)
+        version = Constants.getVersion()
+        running = Constants.MachineState_Running
+        with open(path) as f:
+            data = json.load(f)
+        self.assertEqual(version[0], data["version"])
+        self.assertEqual(running, data["constants"]["MachineState"]["Running"])
+        try:
+            Constants.load(path)
+            self.assertEqual(version, Constants.getVersion())
+            self.assertEqual(running, Constants.MachineState_Running)
+            self.assertEqual("Running",
+                             Constants.MachineState.name_of(running))
+        finally:
+            Constants.loadFromVirtualBox()
+
+    def testLoadUnsupportedFormat(self):
+        """Test Constants.load() with unsupported file format"""
+        path = os.path.join(self.testPath, "constants.json")
+        with open(path, "w") as f:
+            json.dump({ "format" : 0, "constants" : {} }, f)
+        self.assertRaises(ValueError, Constants.load, path)
 
 
 if __name__ == '__main__':
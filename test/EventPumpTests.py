@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Unittests for EventPump"""
+
+from pyVBoxStubs import StubEvent, StubIMachine, StubTestCase
+from pyVBox import Constants
+from pyVBox import VirtualBox
+from pyVBox import VirtualBoxOperationAborted
+from pyVBox import VirtualBoxTimeoutException
+from pyVBox import VirtualMachine
+
+import threading
+import time
+import unittest
+
+class EventPumpTests(StubTestCase):
+    """Test case for EventPump"""
+
+    def createMachines(self):
+        self.machines = [StubIMachine("vm%d" % i) for i in range(500)]
+        return self.machines
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        self.vbox = VirtualBox.getDefault()
+        self.pump = self.vbox.getEventPump()
+
+    def _fireStateChange(self, machine, state):
+        self.ivbox.eventSource.fireEvent(StubEvent(
+                Constants.VBoxEventType_OnMachineStateChanged,
+                machineId=machine.id, state=state))
+
+    def _fireDataChange(self, machine):
+        self.ivbox.eventSource.fireEvent(StubEvent(
+                Constants.VBoxEventType_OnMachineDataChanged,
+                machineId=machine.id))
+
+    def testSubscribe(self):
+        """Test EventPump.subscribe() routing by id and type"""
+        machine = self.machines[0]
+        stateEvents = []
+        allEvents = []
+        done = threading.Event()
+        self.pump.subscribe(stateEvents.append, id=machine.id,
+                            type=Constants.VBoxEventType_OnMachineStateChanged)
+        self.pump.subscribe(allEvents.append)
+        self.pump.subscribe(lambda event: done.set(), id=self.machines[1].id)
+        self._fireStateChange(machine, Constants.MachineState_Running)
+        self._fireDataChange(machine)
+        self._fireStateChange(self.machines[1], Constants.MachineState_Running)
+        done.wait(5)
+        self.assertEqual(1, len(stateEvents))
+        self.assertEqual(machine.id, stateEvents[0].id)
+        self.assertEqual(machine.id, stateEvents[0].machineId)
+        self.assertEqual(Constants.MachineState_Running, stateEvents[0].state)
+        self.assertEqual(3, len(allEvents))
+
+    def testQueue(self):
+        """Test EventPump.queue()"""
+        machine = self.machines[0]
+        queue = self.pump.queue(id=machine.id)
+        self._fireStateChange(machine, Constants.MachineState_Running)
+        self._fireDataChange(machine)
+        self.assertEqual(Constants.VBoxEventType_OnMachineStateChanged,
+                         queue.get(timeout=5).type)
+        self.assertEqual(Constants.VBoxEventType_OnMachineDataChanged,
+                         queue.get(timeout=5).type)
+        queue.cancel()
+        self.assertEqual(0, self.pump.getSubscriptionCount())
+
+    def testFuture(self):
+        """Test EventPump.future()"""
+        machine = self.machines[0]
+        future = self.pump.future(
+            id=machine.id,
+            predicate=lambda e: e.state == Constants.MachineState_Paused)
+        self.assertFalse(future.done())
+        self.assertRaises(VirtualBoxTimeoutException, future.result, 0.1)
+        self._fireStateChange(machine, Constants.MachineState_Running)
+        self._fireStateChange(machine, Constants.MachineState_Paused)
+        self.assertEqual(Constants.MachineState_Paused,
+                         future.result(5).state)
+        self.assertFalse(future.cancel())
+        self.assertEqual(0, self.pump.getSubscriptionCount())
+        future = self.pump.future(id=machine.id)
+        self.assertTrue(future.cancel())
+        self.assertTrue(future.cancelled())
+        self.assertRaises(VirtualBoxOperationAborted, future.result)
+
+    def testManyMachines(self):
+        """Test watching 500 machines needs one thread and one listener"""
+        threads = threading.active_count()
+        futures = [self.pump.future(id=machine.id)
+                   for machine in self.machines]
+        for machine in self.machines:
+            self._fireStateChange(machine, Constants.MachineState_Running)
+        for future in futures:
+            self.assertEqual(Constants.MachineState_Running,
+                             future.result(5).state)
+        self.assertEqual(threads, threading.active_count())
+        self.assertEqual(1, self.ivbox.eventSource.getListenerCount())
+        self.assertTrue(self.pump.isRunning())
+
+    def testCallbackError(self):
+        """Test a failing subscriber doesn't stop the others"""
+        import StringIO
+        import sys
+        received = threading.Event()
+        def fail(event):
+            raise ValueError("Broken subscriber")
+        self.pump.subscribe(fail)
+        self.pump.subscribe(lambda event: received.set())
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self._fireDataChange(self.machines[0])
+            self.assertTrue(received.wait(5))
+        finally:
+            sys.stderr = stderr
+
+    def testStop(self):
+        """Test EventPump.stop()"""
+        self.pump.stop()
+        self.assertFalse(self.pump.isRunning())
+        self.vbox.getEventPump()
+        self.assertTrue(self.pump.isRunning())
+
+if __name__ == '__main__':
+    unittest.main()
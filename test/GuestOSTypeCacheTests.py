@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Unittests for GuestOSTypeCache"""
+
+from pyVBoxStubs import StubIMachine, StubIVirtualBox, StubVirtualBoxManager
+from pyVBoxStubs import setCacheDir
+from pyVBox import GuestOSType
+from pyVBox import GuestOSTypeCache
+from pyVBox import VirtualBox
+from pyVBox import VirtualBoxManager
+from pyVBox import VirtualBoxObjectNotFoundException
+from pyVBox import VirtualMachine
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+class GuestOSTypeCacheTests(unittest.TestCase):
+    """Test case for GuestOSTypeCache"""
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        setCacheDir(self, self.cacheDir)
+        GuestOSTypeCache.clear()
+        self.manager = StubVirtualBoxManager(StubIVirtualBox())
+        self.vbox = VirtualBox(self.manager)
+
+    def tearDown(self):
+        GuestOSTypeCache.clear()
+        shutil.rmtree(self.cacheDir)
+
+    def testMemory(self):
+        """Test guest OS types are read from VirtualBox once"""
+        osTypes = self.vbox.guestOSTypes
+        self.assertEqual(["Ubuntu", "Ubuntu_64"], [t.id for t in osTypes])
+        self.assertTrue(isinstance(osTypes[0], GuestOSType))
+        self.assertEqual(1, self.manager.getArrayCalls)
+        osType = self.vbox.getGuestOSType("Ubuntu_64")
+        self.assertEqual("Ubuntu (64 bit)", osType.description)
+        self.assertTrue(osType.is64Bit)
+        self.vbox.guestOSTypes
+        self.assertEqual(1, self.manager.getArrayCalls)
+
+    def testDisk(self):
+        """Test guest OS types are saved and read from disk"""
+        self.vbox.guestOSTypes
+        path = GuestOSTypeCache.getPath("4.1.12", 77245)
+        self.assertTrue(os.path.exists(path))
+        GuestOSTypeCache.clear()
+        manager = StubVirtualBoxManager(StubIVirtualBox())
+        vbox = VirtualBox(manager)
+        self.assertEqual("Ubuntu", vbox.getGuestOSType("Ubuntu").description)
+        self.assertEqual(0, getattr(manager, "getArrayCalls", 0))
+
+    def testVersion(self):
+        """Test cache is keyed by VirtualBox version and revision"""
+        self.vbox.guestOSTypes
+        ivbox = StubIVirtualBox()
+        ivbox.revision = 80000
+        manager = StubVirtualBoxManager(ivbox)
+        VirtualBox(manager).guestOSTypes
+        self.assertEqual(1, manager.getArrayCalls)
+
+    def testCorruptFile(self):
+        """Test an unreadable cache file is replaced"""
+        path = GuestOSTypeCache.getPath("4.1.12", 77245)
+        with open(path, "w") as f:
+            f.write("not json")
+        self.assertEqual(2, len(self.vbox.guestOSTypes))
+        with open(path) as f:
+            self.assertEqual(2, len(json.load(f)["guestOSTypes"]))
+
+    def testUnknownType(self):
+        """Test lookup of an unknown type goes to VirtualBox"""
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          self.vbox.getGuestOSType, "Bogus")
+
+    def testGetOSType(self):
+        """Test VirtualMachine.getOSType() uses the cache"""
+        machine = StubIMachine("vm", OSTypeId="Ubuntu_64")
+        self.manager.vbox.machines.append(machine)
+        with VirtualBoxManager.using(self.manager):
+            vm = VirtualMachine.find("vm")
+            self.assertEqual("Ubuntu (64 bit)", vm.getOSType().description)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Unittests for MachineIndex"""
+
+from pyVBoxStubs import StubEvent, StubIMachine, StubTestCase
+from pyVBox import Constants
+from pyVBox import VirtualBox
+from pyVBox import VirtualBoxObjectNotFoundException
+from pyVBox import VirtualMachine
+
+import threading
+import unittest
+
+class MachineIndexTests(StubTestCase):
+    """Test case for MachineIndex"""
+
+    def createMachines(self):
+        self.machines = [StubIMachine("vm%d" % i) for i in range(3)]
+        return self.machines
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        self.index = VirtualBox.getDefault().getMachineIndex()
+
+    def _fireEvent(self, type, **kwargs):
+        """Fire event and wait for the EventPump to deliver it."""
+        delivered = threading.Event()
+        subscription = VirtualBox.getDefault().getEventPump().subscribe(
+            lambda event: delivered.set(), id=kwargs["machineId"], type=type)
+        try:
+            self.ivbox.eventSource.fireEvent(StubEvent(type, **kwargs))
+            self.assertTrue(delivered.wait(5))
+        finally:
+            subscription.cancel()
+
+    def testEventPump(self):
+        """Test getMachineIndex() starts the EventPump keeping it current"""
+        self.assertTrue(VirtualBox.getDefault().getEventPump().isRunning())
+        self.assertTrue(VirtualBox.getDefault().getMachineIndex() is
+                        self.index)
+
+    def testFind(self):
+        """Test VirtualMachine.find() is answered from the index"""
+        machine = self.machines[1]
+        vm = VirtualMachine.find("vm1")
+        self.assertEqual(machine.id, vm.id)
+        self.assertTrue(vm is VirtualMachine.find(machine.id))
+        self.assertTrue(vm.isRegistered())
+        self.assertEqual(0, self.ivbox.findMachineCalls)
+
+    def testMiss(self):
+        """Test a miss falls back to VirtualBox"""
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          VirtualMachine.find, "missing")
+        self.assertEqual(1, self.ivbox.findMachineCalls)
+        # Registered without an event we've seen yet
+        machine = StubIMachine("new")
+        self.ivbox.machines.append(machine)
+        vm = VirtualMachine.find("new")
+        self.assertEqual(machine.id, vm.id)
+        self.assertEqual(2, self.ivbox.findMachineCalls)
+        # Now in the index
+        VirtualMachine.find("new")
+        self.assertEqual(2, self.ivbox.findMachineCalls)
+
+    def testUnregisteredEvent(self):
+        """Test machine registered events update the index"""
+        machine = self.machines[0]
+        vm = VirtualMachine.find("vm0")
+        self.ivbox.machines.remove(machine)
+        self._fireEvent(Constants.VBoxEventType_OnMachineRegistered,
+                        machineId=machine.id, registered=False)
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          VirtualMachine.find, "vm0")
+        self.assertFalse(vm.isRegistered())
+
+    def testRenameEvent(self):
+        """Test machine data changed events update names"""
+        machine = self.machines[2]
+        VirtualMachine.find("vm2")
+        machine.name = "renamed"
+        self._fireEvent(Constants.VBoxEventType_OnMachineDataChanged,
+                        machineId=machine.id)
+        self.assertEqual(machine.id, VirtualMachine.find("renamed").id)
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          VirtualMachine.find, "vm2")
+
+    def testLazyBuild(self):
+        """Test the index is only built when searched"""
+        vm = VirtualMachine.intern(StubIMachine("new"))
+        self.ivbox.machines.append(vm.getIMachine())
+        vm.register()
+        self.assertEqual(0, getattr(self.manager, "getArrayCalls", 0))
+        self.assertTrue(vm is VirtualMachine.find("new"))
+        self.assertEqual(1, self.manager.getArrayCalls)
+        self.assertEqual(0, self.ivbox.findMachineCalls)
+
+    def testNames(self):
+        """Test reusing the name of a renamed machine"""
+        first, second = self.machines[:2]
+        VirtualMachine.find("vm0")
+        first.name = "old"
+        self._fireEvent(Constants.VBoxEventType_OnMachineDataChanged,
+                        machineId=first.id)
+        second.name = "vm0"
+        self._fireEvent(Constants.VBoxEventType_OnMachineDataChanged,
+                        machineId=second.id)
+        self.assertEqual(second.id, VirtualMachine.find("vm0").id)
+        self.assertEqual(first.id, VirtualMachine.find("old").id)
+        self.assertEqual(second.id, VirtualMachine.find("vm0").id)
+
+class MachineIndexUnusedTests(StubTestCase):
+    """Test case for lookups without a MachineIndex"""
+
+    def createMachines(self):
+        self.machines = [StubIMachine("vm%d" % i) for i in range(3)]
+        return self.machines
+
+    def testOneOff(self):
+        """Test a one-off lookup is one round trip to VirtualBox"""
+        vm = VirtualMachine.find("vm1")
+        self.assertEqual(self.machines[1].id, vm.id)
+        self.assertEqual(1, self.ivbox.findMachineCalls)
+        self.assertTrue(vm.isRegistered())
+        self.assertEqual(2, self.ivbox.findMachineCalls)
+        self.assertEqual(0, getattr(self.manager, "getArrayCalls", 0))
+        self.assertTrue(VirtualBox.getDefault().getMachineIndex(
+                create=False) is None)
+
+if __name__ == '__main__':
+    unittest.main()
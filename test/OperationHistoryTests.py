@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""Unittests for OperationHistory and tracked Progress"""
+
+from pyVBoxStubs import StubIProgress, setCacheDir
+from pyVBox import OperationHistory
+from pyVBox import Progress
+from pyVBox import ProgressGroup
+from pyVBox import VirtualBoxException
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+class OperationHistoryTests(unittest.TestCase):
+    """Test case for OperationHistory"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "operations.json")
+        self.history = OperationHistory(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testAdd(self):
+        """Test adding records and reading them back"""
+        record = self.history.add("cloneTo", "/vms/a.vdi", 1000, 0, 10)
+        self.assertEqual(record.bytesPerSecond, 100)
+        self.assertEqual(record.directory, "/vms")
+        self.history.add("cloneTo", "/slow/b.vdi", 1000, 1, 20,
+                         steps=[("Copying", 20)])
+        self.history.add("createBaseStorage", "/vms/c.vdi", 1000, 2, 1)
+        self.assertEqual(len(self.history.getRecords()), 3)
+        self.assertEqual(len(self.history.getRecords("cloneTo")), 2)
+        records = self.history.getRecords("cloneTo", "/slow")
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].steps, (("Copying", 20),))
+        # Records survive in the file
+        history = OperationHistory(self.path)
+        self.assertEqual(history.getRecords(), self.history.getRecords())
+
+    def testFailed(self):
+        """Test failed operations are left out of estimates"""
+        self.history.add("cloneTo", "/vms/a.vdi", 1000, 0, 10)
+        self.history.add("cloneTo", "/vms/a.vdi", 1000, 0, 1000,
+                         resultCode=1)
+        self.assertEqual(len(self.history.getRecords("cloneTo")), 1)
+        self.assertEqual(len(self.history.getRecords("cloneTo",
+                                                     successful=False)), 2)
+        self.assertEqual(self.history.getThroughput("cloneTo"), 100)
+
+    def testEstimate(self):
+        """Test estimates from recent throughput"""
+        self.assertEqual(self.history.estimate("cloneTo", 1000), None)
+        for seconds in (10, 10, 20, 10, 10, 10):
+            self.history.add("cloneTo", "/vms/a.vdi", 1000, 0, seconds)
+        self.history.add("cloneTo", "/slow/a.vdi", 1000, 0, 100)
+        self.assertEqual(self.history.getThroughput("cloneTo", "/vms"), 100)
+        self.assertEqual(self.history.estimate("cloneTo", 5000, "/vms"), 50)
+        self.assertEqual(self.history.estimate("cloneTo", 5000, "/slow"),
+                         500)
+        # Unknown directories fall back to all directories
+        self.assertEqual(self.history.estimate("cloneTo", 5000, "/new"), 50)
+        # Without a size, wall time is used
+        self.history.add("deleteSnapshot", "/vms/a.vbox", None, 0, 3)
+        self.assertEqual(self.history.estimate("deleteSnapshot"), 3)
+
+    def testTrim(self):
+        """Test the history is trimmed to MAX_RECORDS"""
+        self.history.MAX_RECORDS = 5
+        for i in range(11):
+            self.history.add("cloneTo", "/vms/a.vdi", 1000, i, 10)
+        records = OperationHistory(self.path).getRecords()
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[-1].started, 10)
+
+    def testCorruptFile(self):
+        """Test unreadable lines are skipped"""
+        self.history.add("cloneTo", "/vms/a.vdi", 1000, 0, 10)
+        with open(self.path, "a") as f:
+            f.write("not json\n")
+        self.assertEqual(len(OperationHistory(self.path).getRecords()), 1)
+
+    def testClear(self):
+        """Test OperationHistory.clear()"""
+        self.history.add("cloneTo", "/vms/a.vdi", 1000, 0, 10)
+        self.history.clear()
+        self.assertEqual(self.history.getRecords(), [])
+        self.assertFalse(os.path.exists(self.path))
+
+    def testDefault(self):
+        """Test OperationHistory.getDefault() uses PYVBOX_CACHE_DIR"""
+        setCacheDir(self, self.directory)
+        history = OperationHistory.getDefault()
+        self.assertEqual(history.path, self.path)
+        self.assertTrue(OperationHistory.getDefault() is history)
+
+    #
+    # Tracked Progress
+    #
+
+    def testTrack(self):
+        """Test a tracked task is recorded when completed"""
+        iprogress = StubIProgress(0.4, operations=("Creating", "Copying"))
+        progress = Progress(iprogress)
+        progress.SAMPLE_INTERVAL = 20
+        progress.track("cloneTo", 4000, "/vms/a.vdi", self.history)
+        self.assertEqual(self.history.getRecords(), [])
+        progress.waitForCompletion()
+        records = self.history.getRecords()
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record.operation, "cloneTo")
+        self.assertEqual(record.location, "/vms/a.vdi")
+        self.assertTrue(0.4 <= record.seconds < 0.6, record.seconds)
+        self.assertTrue(6000 < record.bytesPerSecond <= 10000,
+                        record.bytesPerSecond)
+        self.assertEqual([step[0] for step in record.steps],
+                         ["Creating", "Copying"])
+        for description, seconds in record.steps:
+            self.assertTrue(0.1 < seconds < 0.4, seconds)
+        # Recorded only once
+        progress.waitForCompletion()
+        self.assertEqual(len(self.history.getRecords()), 1)
+
+    def testTrackFailure(self):
+        """Test a failed tracked task is recorded with its result code"""
+        progress = Progress(StubIProgress(0.1, resultCode=1))
+        progress.track("cloneTo", 1000, "/vms/a.vdi", self.history)
+        self.assertRaises(VirtualBoxException, progress.waitForCompletion)
+        record = self.history.getRecords(successful=False)[0]
+        self.assertEqual(record.resultCode, 1)
+
+    def testTimeout(self):
+        """Test waiting on a tracked task with a timeout"""
+        progress = Progress(StubIProgress(10))
+        progress.track("cloneTo", 1000, "/vms/a.vdi", self.history)
+        progress.waitForCompletion(100)
+        self.assertFalse(progress.completed)
+        self.assertEqual(self.history.getRecords(), [])
+        progress.cancel()
+
+    def testGroupETA(self):
+        """Test ProgressGroup estimates from history before progress"""
+        self.history.add("cloneTo", "/vms/a.vdi", 1000, 0, 10)
+        progress = Progress(StubIProgress(100))
+        progress.track("cloneTo", 3000, "/vms/b.vdi", self.history)
+        group = ProgressGroup([progress])
+        group.poll()
+        eta = group.getETA()
+        self.assertTrue(29 < eta <= 30, eta)
+        self.assertTrue(progress.getRecorder().getThroughput() is None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Unittests for PauseMonitor"""
+
+from pyVBoxStubs import StubEvent, StubIMachine, StubIMedium
+from pyVBoxStubs import StubIMediumAttachment, StubIStorageController
+from pyVBoxStubs import StubTestCase
+from pyVBox import Constants
+from pyVBox import PauseMonitor
+from pyVBox import VirtualBox
+from pyVBox import VirtualMachine
+
+import threading
+import time
+import unittest
+
+class PauseMonitorTests(StubTestCase):
+    """Test case for PauseMonitor"""
+
+    def createMachines(self):
+        self.machine = StubIMachine("vm", state=Constants.MachineState_Running)
+        return [self.machine]
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        self.vm = VirtualMachine.intern(self.machine)
+        # Set when the last state change fired has been delivered
+        self.delivered = threading.Event()
+        self.subscription = VirtualBox.getDefault().getEventPump().subscribe(
+            lambda event: self.delivered.set(), id=self.machine.id)
+
+    def tearDown(self):
+        self.subscription.cancel()
+        StubTestCase.tearDown(self)
+
+    def _setState(self, state):
+        """Change state of the machine and wait for the event."""
+        self.delivered.clear()
+        self.machine.state = state
+        self.ivbox.eventSource.fireEvent(StubEvent(
+                Constants.VBoxEventType_OnMachineStateChanged,
+                machineId=self.machine.id, state=state))
+        self.assertTrue(self.delivered.wait(5))
+
+    def testPause(self):
+        """Test measuring pauses of a running machine"""
+        with PauseMonitor(self.vm) as monitor:
+            self.assertFalse(monitor.isPaused())
+            self._setState(Constants.MachineState_Paused)
+            self.assertTrue(monitor.isPaused())
+            time.sleep(0.2)
+            self._setState(Constants.MachineState_Running)
+            self._setState(Constants.MachineState_Saving)
+            time.sleep(0.1)
+        pauses = monitor.getPauses()
+        self.assertEqual([state for state, seconds in pauses],
+                         [Constants.MachineState_Paused,
+                          Constants.MachineState_Saving])
+        self.assertTrue(0.2 <= pauses[0][1] < 0.4, pauses[0][1])
+        # The pause still going on ended with the monitor
+        self.assertTrue(0.1 <= pauses[1][1] < 0.3, pauses[1][1])
+        self.assertTrue(0.3 <= monitor.getPauseTime() < 0.6,
+                        monitor.getPauseTime())
+        self.assertEqual(monitor.getLongestPause(), pauses[0][1])
+        # Nothing is noted after stop()
+        self._setState(Constants.MachineState_Paused)
+        self.assertEqual(len(monitor.getPauses()), 2)
+
+    def testLiveSnapshot(self):
+        """Test the guest isn't paused while a live snapshot is taken"""
+        with PauseMonitor(self.vm) as monitor:
+            self._setState(Constants.MachineState_LiveSnapshotting)
+            time.sleep(0.1)
+            self._setState(Constants.MachineState_Running)
+        self.assertEqual(monitor.getPauses(), [])
+        self.assertEqual(monitor.getLongestPause(), 0)
+
+    def testAlreadyPaused(self):
+        """Test monitoring a machine that is already paused"""
+        self._setState(Constants.MachineState_Paused)
+        monitor = PauseMonitor(self.vm).start()
+        self.assertTrue(monitor.isPaused())
+        time.sleep(0.1)
+        self._setState(Constants.MachineState_Running)
+        monitor.stop()
+        self.assertTrue(0.1 <= monitor.getPauseTime() < 0.3,
+                        monitor.getPauseTime())
+
+    def testSnapshotHardDrives(self):
+        """Test Snapshot.getHardDrives() returns the media snapshotted"""
+        self.machine.storageControllers = [
+            StubIStorageController("SATA Controller",
+                                   Constants.StorageBus_SATA)]
+        disk = StubIMedium("/vms/vm/disk.vdi")
+        self.machine.mediumAttachments = [
+            StubIMediumAttachment("SATA Controller", 0, 0,
+                                  Constants.DeviceType_HardDisk, disk),
+            StubIMediumAttachment("SATA Controller", 1, 0,
+                                  Constants.DeviceType_DVD, None)]
+        self.vm.takeSnapshot("backup")
+        snapshot = self.vm.findSnapshot("backup")
+        self.assertEqual([m.location for m in snapshot.getHardDrives()],
+                         ["/vms/vm/disk.vdi"])
+
+if __name__ == '__main__':
+    unittest.main()
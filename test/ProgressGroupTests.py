@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""Unittests for ProgressGroup"""
+
+from pyVBoxStubs import StubIProgress
+from pyVBox import Progress
+from pyVBox import ProgressGroup
+from pyVBox import VirtualBoxException
+from pyVBox import VirtualBoxTimeoutException
+
+import functools
+import time
+import unittest
+
+class ProgressGroupTests(unittest.TestCase):
+    """Test case for ProgressGroup"""
+
+    def testWait(self):
+        """Test waiting on tasks running concurrently"""
+        durations = [0.2, 0.3, 0.4, 0.5]
+        group = ProgressGroup([Progress(StubIProgress(duration))
+                               for duration in durations])
+        self.assertEqual(len(group), 4)
+        start = time.time()
+        group.wait()
+        elapsed = time.time() - start
+        # Waiting together takes as long as the slowest task, not the
+        # sum of all of them as waiting one by one would.
+        self.assertTrue(elapsed < sum(durations) / 2, elapsed)
+        self.assertTrue(group.isCompleted())
+        self.assertEqual(group.getPercent(), 100)
+        self.assertEqual(group.getETA(), 0)
+
+    def testStatus(self):
+        """Test per task status and aggregate percent"""
+        group = ProgressGroup()
+        group.add(Progress(StubIProgress(0.1)), label="fast", size=100)
+        group.add(Progress(StubIProgress(10)), label="slow", size=300)
+        time.sleep(0.2)
+        group.poll()
+        fast, slow = group.getStatus()
+        self.assertEqual(fast.label, "fast")
+        self.assertTrue(fast.completed)
+        self.assertEqual(fast.percent, 100)
+        self.assertEqual(fast.resultCode, 0)
+        self.assertEqual(slow.label, "slow")
+        self.assertFalse(slow.completed)
+        self.assertFalse(group.isCompleted())
+        # Weighted by size: 100 bytes done of 400
+        self.assertTrue(25 <= group.getPercent() < 30, group.getPercent())
+        self.assertTrue(group.isSized())
+
+    def testDefaultLabel(self):
+        """Test label defaults to the description of the task"""
+        group = ProgressGroup([Progress(StubIProgress(0, description="Foo"))])
+        group.wait()
+        self.assertEqual(group.getStatus()[0].label, "Foo")
+        self.assertFalse(group.isSized())
+
+    def testCallback(self):
+        """Test callback is called after each poll"""
+        calls = []
+        group = ProgressGroup([Progress(StubIProgress(0.2))])
+        group.wait(callback=calls.append)
+        self.assertTrue(len(calls) > 1)
+        self.assertTrue(calls[-1] is group)
+
+    def testFailure(self):
+        """Test wait() raises for the first task to fail"""
+        bad = Progress(StubIProgress(0.1, resultCode=1))
+        slow = StubIProgress(10)
+        group = ProgressGroup([Progress(StubIProgress(0.05)), bad,
+                               Progress(slow)])
+        try:
+            group.wait()
+        except VirtualBoxException, e:
+            self.assertTrue(e.progress is bad)
+            self.assertEqual(len(e.status), 3)
+            self.assertEqual(e.status[1].resultCode, 1)
+            self.assertFalse(e.status[2].completed)
+        else:
+            self.fail("Expected VirtualBoxException")
+        self.assertFalse(slow.canceled)
+        self.assertEqual(group.getFailures(), [bad])
+
+    def testCancelOnFailure(self):
+        """Test wait() cancels other tasks if one fails"""
+        slow = StubIProgress(10)
+        group = ProgressGroup([Progress(StubIProgress(0.1, resultCode=1)),
+                               Progress(slow)])
+        self.assertRaises(VirtualBoxException, group.wait,
+                          cancelOnFailure=True)
+        self.assertTrue(slow.canceled)
+
+    def testTimeout(self):
+        """Test wait() with a timeout"""
+        group = ProgressGroup([Progress(StubIProgress(10))])
+        start = time.time()
+        self.assertRaises(VirtualBoxTimeoutException, group.wait,
+                          timeout=0.2)
+        self.assertTrue(time.time() - start < 1)
+
+    def testPollInterval(self):
+        """Test the poll interval adapts to the rate of progress"""
+        fast = ProgressGroup([Progress(StubIProgress(1))])
+        slow = ProgressGroup([Progress(StubIProgress(20))])
+        for group in (fast, slow):
+            group.poll()
+        time.sleep(0.4)
+        for group in (fast, slow):
+            group.poll()
+        # Fast task moves 1% per 10ms, slow one per 200ms
+        self.assertEqual(fast.getPollInterval(), ProgressGroup.MIN_INTERVAL)
+        self.assertTrue(0.1 < slow.getPollInterval() <= 0.3,
+                        slow.getPollInterval())
+
+    def testIdleInterval(self):
+        """Test the poll interval backs off while a task doesn't progress"""
+        group = ProgressGroup([Progress(StubIProgress(1000))])
+        group.poll()
+        self.assertEqual(group.getPollInterval(), ProgressGroup.MIN_INTERVAL)
+        time.sleep(0.3)
+        group.poll()
+        self.assertTrue(group.getPollInterval() >= 0.3,
+                        group.getPollInterval())
+        self.assertEqual(group.getETA(), None)
+
+    def testSchedule(self):
+        """Test scheduled tasks run at most maxConcurrent at once"""
+        started = []
+        def start(duration):
+            started.append(time.time())
+            return Progress(StubIProgress(duration))
+        group = ProgressGroup(maxConcurrent=2)
+        for i in range(4):
+            group.schedule(functools.partial(start, 0.2), label="task%d" % i,
+                           size=100)
+        self.assertEqual(started, [])
+        group.poll()
+        self.assertEqual(len(started), 2)
+        status = group.getStatus()
+        self.assertEqual([s.started for s in status],
+                         [True, True, False, False])
+        # Waiting tasks count as not done at all
+        self.assertTrue(group.getPercent() < 50, group.getPercent())
+        # The estimate covers the running tasks once they progress
+        time.sleep(0.05)
+        group.poll()
+        self.assertTrue(0 < group.getETA() < 0.3, group.getETA())
+        start = time.time()
+        group.wait()
+        elapsed = time.time() - start
+        self.assertEqual(len(started), 4)
+        # Two rounds of two tasks
+        self.assertTrue(0.3 < elapsed < 0.6, elapsed)
+        self.assertTrue(group.isCompleted())
+
+    def testResource(self):
+        """Test scheduled tasks on the same resource run one at a time"""
+        tasks = []
+        def start(resource):
+            iprogress = StubIProgress(0.1)
+            tasks.append((resource, iprogress))
+            return Progress(iprogress)
+        group = ProgressGroup(maxConcurrent=4)
+        for i, resource in enumerate(["sda", "sda", "sdb", "sda", "sdb"]):
+            group.schedule(functools.partial(start, resource),
+                           label="disk%d" % i, resource=resource)
+        group.poll()
+        # One task per resource at first, though more may run at once
+        self.assertEqual([resource for resource, iprogress in tasks],
+                         ["sda", "sdb"])
+        group.wait()
+        self.assertEqual(len(tasks), 5)
+        for resource in ("sda", "sdb"):
+            iprogresses = [iprogress for r, iprogress in tasks
+                           if r == resource]
+            for previous, iprogress in zip(iprogresses, iprogresses[1:]):
+                self.assertTrue(iprogress.start >=
+                                previous.start + previous.duration)
+        self.assertTrue(group.isCompleted())
+
+    def testResources(self):
+        """Test scheduled tasks sharing any resource run one at a time"""
+        tasks = []
+        def start(label):
+            iprogress = StubIProgress(0.1)
+            tasks.append((label, iprogress))
+            return Progress(iprogress)
+        group = ProgressGroup(maxConcurrent=4)
+        # Sources on different devices, targets on the same one
+        for label, resources in [("a", ["sda", "sdc"]),
+                                 ("b", ["sdb", "sdc"]),
+                                 ("c", ["sdc", None]),
+                                 ("d", "sdd")]:
+            group.schedule(functools.partial(start, label),
+                           label=label, resource=resources)
+        group.poll()
+        self.assertEqual([label for label, iprogress in tasks],
+                         ["a", "d"])
+        group.wait()
+        self.assertEqual(len(tasks), 4)
+        started = dict(tasks)
+        for previous, label in (("a", "b"), ("b", "c")):
+            self.assertTrue(started[label].start >=
+                            started[previous].start +
+                            started[previous].duration)
+        self.assertTrue(group.isCompleted())
+
+    def testCancelScheduled(self):
+        """Test waiting scheduled tasks aren't started after a failure"""
+        started = []
+        def start():
+            started.append(True)
+            return Progress(StubIProgress(0.1))
+        group = ProgressGroup(maxConcurrent=1)
+        group.schedule(lambda: Progress(StubIProgress(0.05, resultCode=1)),
+                       label="bad")
+        group.schedule(start, label="next")
+        self.assertRaises(VirtualBoxException, group.wait,
+                          cancelOnFailure=True)
+        group.poll()
+        self.assertEqual(started, [])
+
+    def testStartFailure(self):
+        """Test wait() raises the exception of a task failing to start"""
+        slow = StubIProgress(10)
+        def fail():
+            raise VirtualBoxException("Cannot start")
+        group = ProgressGroup(maxConcurrent=2)
+        group.schedule(lambda: Progress(slow), label="slow")
+        group.schedule(fail, label="bad")
+        group.schedule(lambda: Progress(StubIProgress(0.1)), label="next")
+        try:
+            group.wait(cancelOnFailure=True)
+        except VirtualBoxException, e:
+            self.assertEqual(str(e), "Cannot start")
+            self.assertEqual([(s.label, s.started, s.completed)
+                              for s in e.status],
+                             [("slow", True, True), ("bad", False, True),
+                              ("next", False, False)])
+        else:
+            self.fail("Expected VirtualBoxException")
+        self.assertTrue(slow.canceled)
+        group.poll()
+        self.assertFalse(group.getStatus()[2].started)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Unittests for Record"""
+
+from pyVBox import Record
+
+import pickle
+import threading
+import unittest
+
+class RecordTests(unittest.TestCase):
+    """Test case for Record"""
+
+    def testRecord(self):
+        """Test Record attributes"""
+        record = Record(("name", "CPUCount"), ("TestVM", 2))
+        self.assertEqual("TestVM", record.name)
+        self.assertEqual(2, record.CPUCount)
+        self.assertEqual(("name", "CPUCount"), record.fields())
+        self.assertEqual(("TestVM", 2), record.values())
+        self.assertEqual({"name" : "TestVM", "CPUCount" : 2},
+                         record.asDict())
+        self.assertRaises(AttributeError, getattr, record, "bogus")
+        self.assertRaises(ValueError, Record, ("name",), ())
+
+    def testImmutable(self):
+        """Test Record cannot be changed"""
+        record = Record(("name",), ("TestVM",))
+        self.assertRaises(AttributeError, setattr, record, "name", "Other")
+        self.assertRaises(AttributeError, setattr, record, "other", 1)
+        self.assertRaises(AttributeError, delattr, record, "name")
+        self.assertFalse(hasattr(record, "__dict__"))
+
+    def testPickle(self):
+        """Test pickling of Record"""
+        record = Record(("name", "CPUCount"), (u"TestVM", 2))
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(record, protocol))
+            self.assertEqual(record, copy)
+            self.assertEqual(record.fields(), copy.fields())
+
+    def testThreads(self):
+        """Test passing Record to another thread"""
+        record = Record(("name",), ("TestVM",))
+        names = []
+        thread = threading.Thread(target=lambda: names.append(record.name))
+        thread.start()
+        thread.join()
+        self.assertEqual(["TestVM"], names)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Unittests and benchmark for importing pyVBox"""
+
+from pyVBoxBenchmark import report
+
+import json
+import os
+import os.path
+import subprocess
+import sys
+import unittest
+
+# Run in a fresh interpreter, reports what importing pyVBox and the
+# first call into it cost.
+STARTUP_SCRIPT = """
+import gc
+import json
+import sys
+import time
+start = time.time()
+import pyVBox
+imported = time.time()
+result = {
+    "importTime" : imported - start,
+    "xpcomLoaded" : [m for m in ("xpcom", "vboxapi") if sys.modules.get(m)],
+    "modulesLoaded" : [m for m in sys.modules
+                       if m.startswith("pyVBox.") and sys.modules[m]],
+    }
+if "firstCall" in sys.argv:
+    pyVBox.VirtualMachine.getAll()
+    result["firstCallTime"] = time.time() - imported
+    result["managers"] = len([o for o in gc.get_objects()
+                              if isinstance(o, pyVBox.VirtualBoxManager)])
+if "tables" in sys.argv:
+    import pyVBox.Session, pyVBox.StorageTopology, pyVBox.VirtualBox
+    from pyVBox.Constants import Constants
+    result["constantsLoaded"] = Constants.__dict__["_table"] is not None
+print json.dumps(result)
+"""
+
+class StartupTests(unittest.TestCase):
+    """Test case for importing pyVBox"""
+
+    def _startup(self, *args):
+        """Run STARTUP_SCRIPT in a new interpreter and return its results."""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [root] + filter(None, [env.get("PYTHONPATH")]))
+        output = subprocess.Popen(
+            [sys.executable, "-c", STARTUP_SCRIPT] + list(args),
+            env=env, stdout=subprocess.PIPE).communicate()[0]
+        return json.loads(output)
+
+    def testImport(self):
+        """Test importing pyVBox does not load XPCOM"""
+        result = self._startup()
+        report("Startup",
+               [("import pyVBox:", "%.2f ms" % (result["importTime"] * 1000)),
+                ("pyVBox modules loaded:", len(result["modulesLoaded"]))])
+        self.assertEqual([], result["xpcomLoaded"])
+        self.assertEqual([], result["modulesLoaded"])
+
+    def testFirstCall(self):
+        """Test first call into pyVBox creates one VirtualBoxManager"""
+        result = self._startup("firstCall")
+        report("Startup",
+               [("import pyVBox:", "%.2f ms" % (result["importTime"] * 1000)),
+                ("first call:", "%.2f ms" % (result["firstCallTime"] * 1000)),
+                ("VirtualBoxManagers:", result["managers"])])
+        self.assertEqual(1, result["managers"])
+
+    def testTables(self):
+        """Test importing modules keyed by constants does not load them"""
+        result = self._startup("tables")
+        self.assertFalse(result["constantsLoaded"])
+
+if __name__ == '__main__':
+    unittest.main()
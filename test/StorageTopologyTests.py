@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Unittests for StorageTopology"""
+
+from pyVBox import Constants
+from pyVBox import StorageTopology
+from pyVBox import VirtualBoxException
+from pyVBox import VirtualBoxObjectNotFoundException
+
+import unittest
+
+class StorageTopologyTests(unittest.TestCase):
+    """Test case for StorageTopology"""
+
+    def setUp(self):
+        self.topology = StorageTopology()
+        self.topology.addController("IDE Controller",
+                                    Constants.StorageBus_IDE, 2, 2)
+        self.topology.addController("SATA Controller",
+                                    Constants.StorageBus_SATA, 4, 1)
+        self.topology.attach("IDE Controller", 1, 0,
+                             Constants.DeviceType_DVD, None)
+        self.topology.attach("SATA Controller", 0, 0,
+                             Constants.DeviceType_HardDisk, "disk0")
+
+    def testLookup(self):
+        """Test finding attachments by medium and by slot"""
+        attachment = self.topology.findByMedium("disk0")
+        self.assertEqual((attachment.controller, attachment.port,
+                          attachment.device),
+                         ("SATA Controller", 0, 0))
+        self.assertTrue(self.topology.getAttachment("SATA Controller", 0, 0)
+                        is attachment)
+        self.assertEqual(self.topology.findByMedium("bogus"), None)
+        self.assertEqual(self.topology.getAttachment("IDE Controller", 1, 0)
+                         .type, Constants.DeviceType_DVD)
+        self.assertTrue(self.topology.isFree("IDE Controller", 0, 0))
+        self.assertFalse(self.topology.isFree("IDE Controller", 1, 0))
+        self.assertEqual(len(self.topology.getAttachments()), 2)
+
+    def testAllocate(self):
+        """Test handing out free slots"""
+        self.assertEqual(self.topology.allocate(),
+                         [("IDE Controller", 0, 0)])
+        # Slots already handed out aren't handed out again
+        self.assertEqual(self.topology.allocate(4),
+                         [("IDE Controller", 0, 1),
+                          ("IDE Controller", 1, 1),
+                          ("SATA Controller", 1, 0),
+                          ("SATA Controller", 2, 0)])
+        self.assertEqual(self.topology.allocate(1, "SATA Controller"),
+                         [("SATA Controller", 3, 0)])
+
+    def testAllocateBus(self):
+        """Test handing out free slots on a bus"""
+        self.assertEqual(self.topology.allocate(3,
+                                                bus=Constants.StorageBus_SATA),
+                         [("SATA Controller", 1, 0),
+                          ("SATA Controller", 2, 0),
+                          ("SATA Controller", 3, 0)])
+
+    def testAllocateTooMany(self):
+        """Test allocating more slots than are free"""
+        self.assertRaises(VirtualBoxException, self.topology.allocate, 4,
+                          "SATA Controller")
+        # Nothing was taken by the failed allocation
+        self.assertEqual(len(self.topology.allocate(3, "SATA Controller")), 3)
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          self.topology.allocate, 1, "Bogus Controller")
+
+    def testAllocateNone(self):
+        """Test allocating no slots, even without controllers"""
+        self.assertEqual(self.topology.allocate(0), [])
+        self.assertEqual(StorageTopology().allocate(0), [])
+
+    def testAllocateDeviceType(self):
+        """Test slots only come from controllers taking the device type"""
+        self.topology.addController("Floppy Controller",
+                                    Constants.StorageBus_Floppy, 1, 2)
+        self.topology.allocate(6, type=Constants.DeviceType_HardDisk)
+        # Only the floppy controller has free slots left
+        self.assertRaises(VirtualBoxException, self.topology.allocate, 1,
+                          type=Constants.DeviceType_DVD)
+        self.assertRaises(VirtualBoxException, self.topology.allocate,
+                          1, "Floppy Controller",
+                          type=Constants.DeviceType_HardDisk)
+        self.assertEqual(self.topology.allocate(
+                2, type=Constants.DeviceType_Floppy),
+                         [("Floppy Controller", 0, 0),
+                          ("Floppy Controller", 0, 1)])
+
+    def testCheckSlot(self):
+        """Test checking a slot for attaching a device"""
+        self.topology.checkSlot("SATA Controller", 1, 0,
+                                Constants.DeviceType_HardDisk)
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          self.topology.checkSlot, "Bogus Controller", 0, 0)
+        for slot in [("SATA Controller", 4, 0),
+                     ("SATA Controller", 0, 1),
+                     ("SATA Controller", 0, 0),
+                     ("IDE Controller", 1, 0)]:
+            self.assertRaises(VirtualBoxException, self.topology.checkSlot,
+                              *slot)
+        self.topology.addController("Floppy Controller",
+                                    Constants.StorageBus_Floppy, 1, 2)
+        self.assertRaises(VirtualBoxException, self.topology.checkSlot,
+                          "Floppy Controller", 0, 0,
+                          Constants.DeviceType_DVD)
+
+    def testRelease(self):
+        """Test released slots are handed out again"""
+        slots = self.topology.allocate(2, "SATA Controller")
+        self.topology.release(slots)
+        self.assertEqual(self.topology.allocate(3, "SATA Controller"),
+                         slots + [("SATA Controller", 3, 0)])
+
+    def testDetach(self):
+        """Test slots become free when detached"""
+        self.topology.detach("SATA Controller", 0, 0)
+        self.assertEqual(self.topology.findByMedium("disk0"), None)
+        self.assertTrue(self.topology.isFree("SATA Controller", 0, 0))
+        self.assertEqual(self.topology.allocate(1, "SATA Controller"),
+                         [("SATA Controller", 0, 0)])
+
+    def testControllers(self):
+        """Test adding and removing controllers and naming new ones"""
+        self.assertTrue(self.topology.hasController("IDE Controller"))
+        self.assertEqual(self.topology.getController("SATA Controller").bus,
+                         Constants.StorageBus_SATA)
+        self.assertEqual(self.topology.newControllerName(
+                Constants.StorageBus_SCSI), "SCSI Controller")
+        self.assertEqual(self.topology.newControllerName(
+                Constants.StorageBus_SATA), "SATA Controller 2")
+        self.topology.addController("SATA Controller 2",
+                                    Constants.StorageBus_SATA, 1, 1)
+        self.assertEqual(self.topology.newControllerName(
+                Constants.StorageBus_SATA), "SATA Controller 3")
+        self.topology.removeController("SATA Controller")
+        self.assertFalse(self.topology.hasController("SATA Controller"))
+        self.assertEqual(self.topology.findByMedium("disk0"), None)
+        self.assertEqual([c.name for c in self.topology.getControllers()],
+                         ["IDE Controller", "SATA Controller 2"])
+
+    def testFromRecords(self):
+        """Test building a topology from Records"""
+        topology = StorageTopology(self.topology.getControllers(),
+                                   self.topology.getAttachments())
+        self.assertEqual(topology.getAttachments(),
+                         self.topology.getAttachments())
+        self.assertEqual(topology.allocate(), [("IDE Controller", 0, 0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Unittests for VirtualBoxCluster"""
+
+from pyVBoxStubs import StubFaultException, StubIMachine, StubIVirtualBox
+from pyVBoxStubs import StubVirtualBoxManager, loadConstants
+from pyVBox import VirtualBoxCluster
+from pyVBox import VirtualBoxException
+from pyVBox import VirtualBoxObjectNotFoundException
+from pyVBox import VirtualBoxTimeoutException
+
+import time
+import unittest
+
+class VirtualBoxClusterTests(unittest.TestCase):
+    """Test case for VirtualBoxCluster"""
+
+    def _cluster(self, hosts, timeout=5):
+        """Return cluster of stub hosts given as name -> StubIVirtualBox."""
+        loadConstants()
+        cluster = VirtualBoxCluster(timeout=timeout)
+        for host in sorted(hosts.keys()):
+            cluster.addHost(host, StubVirtualBoxManager(hosts[host]))
+        return cluster
+
+    def testGetMachines(self):
+        """Test VirtualBoxCluster.getMachines()"""
+        cluster = self._cluster({
+                "host1" : StubIVirtualBox([StubIMachine("vm1"),
+                                           StubIMachine("vm2")]),
+                "host2" : StubIVirtualBox([StubIMachine("vm1")]),
+                })
+        machines = cluster.getMachines("name", "state")
+        self.assertEqual([("host1", "vm1", 1),
+                          ("host1", "vm2", 1),
+                          ("host2", "vm1", 1)],
+                         [m.values() for m in machines])
+        self.assertEqual({}, machines.errors)
+        machines = cluster.getMachines()
+        self.assertEqual("host", machines[0].fields()[0])
+        self.assertEqual("vm1", machines[0].name)
+
+    def testFindMachines(self):
+        """Test VirtualBoxCluster.findMachines()"""
+        machine = StubIMachine("vm2")
+        cluster = self._cluster({
+                "host1" : StubIVirtualBox([StubIMachine("vm1")]),
+                "host2" : StubIVirtualBox([machine]),
+                })
+        for nameOrId in ("vm2", machine.id):
+            machines = cluster.findMachines(nameOrId, "name")
+            self.assertEqual([("host2", "vm2")],
+                             [m.values() for m in machines])
+            self.assertEqual({}, machines.errors)
+
+    def testFindMachinesFaults(self):
+        """Test hosts without the machine are no error over the webservice"""
+        machine = StubIMachine("vm2")
+        cluster = self._cluster({
+                "host1" : StubIVirtualBox([StubIMachine("vm1")], faults=True),
+                "host2" : StubIVirtualBox([machine], faults=True),
+                })
+        machines = cluster.findMachines("vm2", "name")
+        self.assertEqual([("host2", "vm2")], [m.values() for m in machines])
+        self.assertEqual({}, machines.errors)
+        # Other failures are still reported
+        broken = StubIVirtualBox(faults=True)
+        def findMachine(nameOrId):
+            raise StubFaultException(0x80BB0005, "Runtime error")
+        broken.findMachine = findMachine
+        cluster.addHost("host3", StubVirtualBoxManager(broken))
+        machines = cluster.findMachines("vm2", "name")
+        self.assertEqual([("host2", "vm2")], [m.values() for m in machines])
+        self.assertEqual(["host3"], machines.errors.keys())
+        error = machines.errors["host3"]
+        self.assertTrue(isinstance(error, VirtualBoxException))
+        self.assertFalse(isinstance(error, VirtualBoxObjectNotFoundException))
+
+    def testTimeout(self):
+        """Test a slow host doesn't hold up the others"""
+        cluster = self._cluster({
+                "fast" : StubIVirtualBox([StubIMachine("vm1")]),
+                "slow" : StubIVirtualBox([StubIMachine("vm2")], delay=5),
+                }, timeout=0.2)
+        start = time.time()
+        machines = cluster.getMachines("name")
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual([("fast", "vm1")], [m.values() for m in machines])
+        self.assertEqual(["slow"], machines.errors.keys())
+        self.assertTrue(isinstance(machines.errors["slow"],
+                                   VirtualBoxTimeoutException))
+
+    def testParallel(self):
+        """Test hosts are queried in parallel"""
+        cluster = self._cluster(dict([
+                    ("host%d" % i,
+                     StubIVirtualBox([StubIMachine("vm%d" % i)], delay=0.2))
+                    for i in range(10)]))
+        start = time.time()
+        machines = cluster.getMachines("name")
+        self.assertEqual(10, len(machines))
+        self.assertTrue(time.time() - start < 1)
+
+    def testErrors(self):
+        """Test a failing host is reported"""
+        broken = StubIVirtualBox()
+        del broken.machines
+        cluster = self._cluster({
+                "good" : StubIVirtualBox([StubIMachine("vm1")]),
+                "broken" : broken,
+                })
+        machines = cluster.getMachines("name")
+        self.assertEqual([("good", "vm1")], [m.values() for m in machines])
+        self.assertEqual(["broken"], machines.errors.keys())
+
+    def testGetURL(self):
+        """Test VirtualBoxCluster._getURL()"""
+        self.assertEqual("http://vbox1:18083/",
+                         VirtualBoxCluster._getURL("vbox1"))
+        self.assertEqual("http://vbox1:8000/",
+                         VirtualBoxCluster._getURL("vbox1:8000"))
+        self.assertEqual("https://vbox1/",
+                         VirtualBoxCluster._getURL("https://vbox1/"))
+
+if __name__ == '__main__':
+    unittest.main()
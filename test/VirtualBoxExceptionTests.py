@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 """Unittests for Virtualbox"""
 
+from pyVBoxStubs import StubFaultException, StubIMachine, StubTestCase
 from pyVBoxTest import pyVBoxTest, main
 from pyVBox import ExceptionHandler, VirtualBoxException
+from pyVBox import VirtualBoxObjectNotFoundException
 from pyVBox import VirtualMachine
 
+import sys
+
 class VirtualBoxExceptionTests(pyVBoxTest):
     """Test case for VirtualBoxException"""
 
@@ -27,6 +31,70 @@ class VirtualBoxExceptionTests(pyVBoxTest):
         with ExceptionHandler():
             VirtualMachine.open(cls.bogusVMpath)
 
+class TranslateExceptionTests(StubTestCase):
+    """Test case for translating exceptions of the VirtualBox platforms"""
+
+    def createMachines(self):
+        self.machine = StubIMachine("vm")
+        return [self.machine]
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        # Fail as the webservice does
+        self.ivbox.faults = True
+
+    def testFault(self):
+        """Test a webservice fault is translated"""
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          VirtualMachine.find, "bogus")
+        vm = VirtualMachine.find("vm")
+        self.assertTrue(vm.isRegistered())
+        self.ivbox.machines = []
+        self.assertFalse(vm.isRegistered())
+
+    def testFaultString(self):
+        """Test a fault with the result code only in its string"""
+        e = StubFaultException(0x80BB0001, "Not found")
+        e.fault.detail = None
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          self.translate, e)
+
+    def testUnknown(self):
+        """Test unknown faults and other exceptions are left alone"""
+        for e in (StubFaultException(0x80BBFFFF, "Unknown"),
+                  ValueError("Not from VirtualBox")):
+            self.assertRaises(type(e), self.translate, e)
+
+    def testWithoutXPCOM(self):
+        """Test faults are translated where XPCOM can't be imported"""
+        saved = sys.modules.get("xpcom")
+        # Makes importing xpcom raise ImportError
+        sys.modules["xpcom"] = None
+        try:
+            self.assertRaises(VirtualBoxObjectNotFoundException,
+                              VirtualMachine.find, "bogus")
+        finally:
+            if saved is None:
+                del sys.modules["xpcom"]
+            else:
+                sys.modules["xpcom"] = saved
+
+    def testManager(self):
+        """Test exceptions recognized by the manager are translated"""
+        e = RuntimeError("From the platform")
+        self.manager.errIsOurXcptKind = lambda xcpt: xcpt is e
+        self.manager.errGetStatus = lambda xcpt: -0x7f44ffff
+        self.manager.errGetMessage = lambda xcpt: "Not found"
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          self.translate, e)
+        self.assertRaises(ValueError, self.translate, ValueError())
+
+    @staticmethod
+    def translate(e):
+        """Raise e within an ExceptionHandler."""
+        with ExceptionHandler():
+            raise e
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+"""Unittests for VirtualBoxManagerPool
+
+These run against a local stand-in for the VirtualBox webservice, which
+answers the few SOAP calls the pool makes, so they need the vboxapi
+webservice bindings but not VirtualBox itself."""
+
+from pyVBoxStubs import StubVirtualBoxManager, loadConstants
+from pyVBox import EventPump
+from pyVBox import VirtualBox
+from pyVBox import VirtualBoxManagerPool
+from pyVBox import VirtualBoxObjectNotFoundException
+from pyVBox import VirtualMachine
+
+import BaseHTTPServer
+import re
+import SocketServer
+import threading
+import time
+import unittest
+
+SOAP_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:vbox="http://www.virtualbox.org/">
+<SOAP-ENV:Body>
+<vbox:%(operation)sResponse>%(result)s</vbox:%(operation)sResponse>
+</SOAP-ENV:Body>
+</SOAP-ENV:Envelope>
+"""
+
+SOAP_FAULT = """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">
+<SOAP-ENV:Body>
+<SOAP-ENV:Fault>
+<faultcode>SOAP-ENV:Client</faultcode>
+<faultstring>%s</faultstring>
+</SOAP-ENV:Fault>
+</SOAP-ENV:Body>
+</SOAP-ENV:Envelope>
+"""
+
+# Fault vboxwebsrv returns for a call failing in VirtualBox
+SOAP_RUNTIME_FAULT = """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:vbox="http://www.virtualbox.org/">
+<SOAP-ENV:Body>
+<SOAP-ENV:Fault>
+<faultcode>SOAP-ENV:Client</faultcode>
+<faultstring>VirtualBox error: %(text)s (0x%(resultCode)x)</faultstring>
+<detail>
+<vbox:RuntimeFault>
+<resultCode>%(signedResultCode)d</resultCode>
+<returnval></returnval>
+</vbox:RuntimeFault>
+</detail>
+</SOAP-ENV:Fault>
+</SOAP-ENV:Body>
+</SOAP-ENV:Envelope>
+"""
+
+class StandInWebService(SocketServer.ThreadingMixIn,
+                        BaseHTTPServer.HTTPServer):
+    """Stand-in for vboxwebsrv on a free local port.
+
+    Counts logons, logoffs and calls, and the most requests it was
+    handling at once. Each call takes delay seconds."""
+    daemon_threads = True
+    version = "4.1.12"
+
+    def __init__(self, delay=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           StandInRequestHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.sessions = 0
+        self.active = 0
+        self.maxActive = 0
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def getURL(self):
+        return "http://%s:%d/" % self.server_address
+
+    def count(self, operation):
+        """Return number of calls made of the given operation."""
+        with self.lock:
+            return self.calls.get(operation, 0)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class StandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        request = self.rfile.read(int(self.headers["Content-Length"]))
+        match = re.search(r"<(?:\w+:)?(I\w+_\w+)[\s>/]", request)
+        operation = match.group(1) if match else None
+        with server.lock:
+            server.calls[operation] = server.calls.get(operation, 0) + 1
+            server.active += 1
+            server.maxActive = max(server.maxActive, server.active)
+        try:
+            time.sleep(server.delay)
+            self._respond(operation)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _respond(self, operation):
+        server = self.server
+        if operation == "IWebsessionManager_logon":
+            with server.lock:
+                server.sessions += 1
+                result = "<returnval>%d-vbox</returnval>" % server.sessions
+        elif operation == "IWebsessionManager_logoff":
+            result = ""
+        elif operation == "IVirtualBox_getVersion":
+            result = "<returnval>%s</returnval>" % server.version
+        elif operation == "IVirtualBox_findMachine":
+            # No machines are registered
+            resultCode = 0x80BB0001
+            return self._send(500, SOAP_RUNTIME_FAULT % {
+                    "text" : "Could not find a registered machine",
+                    "resultCode" : resultCode,
+                    "signedResultCode" : resultCode - 0x100000000 })
+        else:
+            return self._send(500, SOAP_FAULT % ("Unsupported call %s" %
+                                                 operation))
+        self._send(200, SOAP_RESPONSE % { "operation" : operation,
+                                          "result" : result })
+
+    def _send(self, code, body):
+        self.send_response(code)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class VirtualBoxManagerPoolTests(unittest.TestCase):
+    """Test case for VirtualBoxManagerPool"""
+
+    def setUp(self):
+        self.server = StandInWebService()
+        # Separate host limits for each test
+        VirtualBoxManagerPool._hostLimits.clear()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _pool(self, **kwargs):
+        pool = VirtualBoxManagerPool(self.server.getURL(),
+                                     "user", "password", **kwargs)
+        try:
+            with pool.manager():
+                pass
+        except ImportError:
+            pool.close()
+            raise unittest.SkipTest("vboxapi webservice bindings not found")
+        if not self.server.count("IWebsessionManager_logon"):
+            pool.close()
+            raise unittest.SkipTest("vboxapi is not using the webservice")
+        return pool
+
+    def testReuse(self):
+        """Test connections are reused"""
+        pool = self._pool(keepAlive=None)
+        for i in range(10):
+            with pool.manager():
+                self.assertEqual(StandInWebService.version,
+                                 VirtualBox.getDefault().version)
+        self.assertEqual(1, self.server.count("IWebsessionManager_logon"))
+        self.assertEqual(10, self.server.count("IVirtualBox_getVersion"))
+        self.assertEqual(1, pool.getConnectionCount())
+        pool.close()
+        self.assertEqual(1, self.server.count("IWebsessionManager_logoff"))
+        self.assertEqual(0, pool.getConnectionCount())
+
+    def testThreads(self):
+        """Test each thread uses a connection of its own"""
+        pool = self._pool(size=3, keepAlive=None)
+        self.server.delay = 0.05
+        managers = []
+        def worker():
+            with pool.manager() as manager:
+                managers.append(manager)
+                VirtualBox.getDefault().version
+        threads = [threading.Thread(target=worker) for i in range(9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(9, len(managers))
+        self.assertEqual(3, len(set(managers)))
+        self.assertTrue(self.server.count("IWebsessionManager_logon") <= 3)
+        pool.close()
+
+    def testHostLimit(self):
+        """Test calls to one host are limited across pools"""
+        pools = [self._pool(size=4, maxConcurrentCalls=2, keepAlive=None)
+                 for i in range(2)]
+        self.server.delay = 0.05
+        self.server.maxActive = 0
+        def worker(pool):
+            with pool.manager():
+                VirtualBox.getDefault().version
+        threads = [threading.Thread(target=worker, args=(pool,))
+                   for pool in pools for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(12, self.server.count("IVirtualBox_getVersion"))
+        self.assertTrue(self.server.maxActive <= 2)
+        for pool in pools:
+            pool.close()
+
+    def testFault(self):
+        """Test a failed lookup raises VirtualBoxObjectNotFoundException"""
+        pool = self._pool(keepAlive=None)
+        with pool.manager():
+            self.assertRaises(VirtualBoxObjectNotFoundException,
+                              VirtualMachine.find, "bogus")
+        self.assertEqual(1, self.server.count("IVirtualBox_findMachine"))
+        pool.close()
+
+    def testKeepAlive(self):
+        """Test idle connections are kept alive"""
+        pool = self._pool(keepAlive=0.1)
+        calls = self.server.count("IVirtualBox_getVersion")
+        time.sleep(0.5)
+        self.assertTrue(self.server.count("IVirtualBox_getVersion") > calls)
+        self.assertEqual(1, pool.getConnectionCount())
+        pool.close()
+        self.assertEqual(1, self.server.count("IWebsessionManager_logoff"))
+
+class StubVirtualBoxManagerPool(VirtualBoxManagerPool):
+    """VirtualBoxManagerPool connecting to stand-ins."""
+    def _connect(self):
+        manager = StubVirtualBoxManager()
+        self.managers.append(manager)
+        return manager
+
+class VirtualBoxManagerPoolEventTests(unittest.TestCase):
+    """Test case for VirtualBoxManagerPool and event listeners"""
+
+    def setUp(self):
+        loadConstants()
+        self.waitTimeout = EventPump.WAIT_TIMEOUT
+        EventPump.WAIT_TIMEOUT = 50
+        VirtualBoxManagerPool._hostLimits.clear()
+        self.pool = StubVirtualBoxManagerPool("http://stub:18083/",
+                                              keepAlive=None)
+        self.pool.managers = []
+
+    def tearDown(self):
+        EventPump.WAIT_TIMEOUT = self.waitTimeout
+
+    def testClose(self):
+        """Test the EventPump and listener are stopped before logging off"""
+        with self.pool.manager():
+            pump = VirtualBox.getDefault().getEventPump()
+            self.assertTrue(pump.isRunning())
+        self.pool.close()
+        self.assertFalse(pump.isRunning())
+        manager, = self.pool.managers
+        self.assertEqual(manager.deinitListeners, [0])
+
+    def testCloseUnused(self):
+        """Test closing connections that never listened for events"""
+        with self.pool.manager():
+            VirtualBox.getDefault().version
+        self.pool.close()
+        manager, = self.pool.managers
+        self.assertEqual(manager.deinitListeners, [0])
+
+class VirtualBoxManagerPoolLimitTests(unittest.TestCase):
+    """Test case for the limits of VirtualBoxManagerPool checkouts"""
+
+    url = "http://stub:18083/"
+
+    def setUp(self):
+        loadConstants()
+        VirtualBoxManagerPool._hostLimits.clear()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.maxActive = 0
+
+    def _pool(self, **kwargs):
+        pool = StubVirtualBoxManagerPool(self.url, keepAlive=None, **kwargs)
+        pool.managers = []
+        return pool
+
+    def _checkouts(self, pools, count):
+        """Check out count connections from each pool at once.
+
+        Returns the most connections checked out at the same time."""
+        def worker(pool):
+            with pool.manager():
+                with self.lock:
+                    self.active += 1
+                    self.maxActive = max(self.maxActive, self.active)
+                time.sleep(0.05)
+                with self.lock:
+                    self.active -= 1
+        threads = [threading.Thread(target=worker, args=(pool,))
+                   for pool in pools for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for pool in pools:
+            pool.close()
+        return self.maxActive
+
+    def testHostLimit(self):
+        """Test pools for one host given a limit share it"""
+        pools = [self._pool(size=4, maxConcurrentCalls=2) for i in range(2)]
+        self.assertEqual(2, self._checkouts(pools, 4))
+
+    def testSize(self):
+        """Test a pool without a limit is only limited by its size"""
+        self._pool(size=2, maxConcurrentCalls=2)
+        pool = self._pool(size=3)
+        self.assertEqual(3, self._checkouts([pool], 6))
+
+    def testConflict(self):
+        """Test a pool can't be given another limit for the same host"""
+        self._pool(maxConcurrentCalls=2)
+        self.assertRaises(ValueError, self._pool, maxConcurrentCalls=3)
+        self._pool(maxConcurrentCalls=2)
+        # Other hosts are not affected
+        self.url = "http://stub2:18083/"
+        self._pool(maxConcurrentCalls=3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Unittests and benchmark for VirtualBoxMonitor and waiting on events"""
+
+from pyVBoxBenchmark import report
+from pyVBoxStubs import StubEvent, StubIMachine, StubTestCase
+from pyVBox import Constants
+from pyVBox import VirtualBox
+from pyVBox import VirtualBoxManager
+from pyVBox import VirtualBoxTimeoutException
+from pyVBox import VirtualMachine
+
+import os
+import threading
+import time
+import unittest
+
+def cpuTime():
+    """Return user plus system CPU time used by this process."""
+    times = os.times()
+    return times[0] + times[1]
+
+class VirtualBoxMonitorTests(StubTestCase):
+    """Test case for VirtualBoxMonitor"""
+
+    def createMachines(self):
+        self.machines = [StubIMachine("vm%d" % i,
+                                      state=Constants.MachineState_PoweredOff)
+                         for i in range(2)]
+        return self.machines
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        self.vms = [VirtualMachine.intern(m) for m in self.machines]
+        self.vbox = VirtualBox.getDefault()
+
+    def _changeState(self, machine, state, delay, event=True):
+        """Change state of machine after delay seconds in another thread.
+
+        Returns a list that will hold the time of the change."""
+        changed = []
+        def change():
+            time.sleep(delay)
+            machine.state = state
+            changed.append(time.time())
+            if event:
+                self.ivbox.eventSource.fireEvent(StubEvent(
+                        Constants.VBoxEventType_OnMachineStateChanged,
+                        machineId=machine.id, state=state))
+        thread = threading.Thread(target=change)
+        thread.daemon = True
+        thread.start()
+        return changed
+
+    def _legacyWaitUntilRunning(self, vm):
+        """Wait the way waitUntilRunning() used to, for the benchmark."""
+        while not vm.isRunning():
+            self.vbox.waitForEvent()
+
+    def _measure(self, wait, vm):
+        """Return (CPU seconds, wall seconds, latency) of wait(vm)."""
+        self.vbox.getMonitor()
+        changed = self._changeState(vm.getIMachine(),
+                                    Constants.MachineState_Running, 0.5)
+        startCPU = cpuTime()
+        start = time.time()
+        wait(vm)
+        end = time.time()
+        return (cpuTime() - startCPU, end - start, end - changed[0])
+
+    def testWaitUntilRunning(self):
+        """Test waitUntilRunning() wakes on a state change event"""
+        vm = self.vms[0]
+        self.vbox.getMonitor()
+        changed = self._changeState(vm.getIMachine(),
+                                    Constants.MachineState_Running, 0.2)
+        vm.waitUntilRunning(timeout=5)
+        self.assertTrue(time.time() - changed[0] < 0.2)
+        self.assertTrue(vm.isRunning())
+
+    def testWithoutEvent(self):
+        """Test waitUntilRunning() notices a change without an event"""
+        vm = self.vms[0]
+        # Cached for longer than it takes to notice the change
+        self.assertFalse(vm.isRunning())
+        start = time.time()
+        self._changeState(vm.getIMachine(), Constants.MachineState_Running,
+                          0.2, event=False)
+        vm.waitUntilRunning(timeout=5)
+        self.assertTrue(vm.isRunning())
+        self.assertTrue(time.time() - start < 0.9, time.time() - start)
+
+    def testTimeout(self):
+        """Test waitUntilRunning() timeout"""
+        vm = self.vms[0]
+        start = time.time()
+        self.assertRaises(VirtualBoxTimeoutException,
+                          vm.waitUntilRunning, timeout=0.3)
+        self.assertTrue(0.3 <= time.time() - start < 1)
+        self.assertFalse(self.vbox.waitUntil(lambda: False, timeout=0))
+
+    def testThreads(self):
+        """Test several threads waiting at once"""
+        self.vbox.getMonitor()
+        woken = []
+        def wait(vm):
+            with VirtualBoxManager.using(self.manager):
+                vm.waitUntilDown(timeout=5)
+            woken.append(vm.name)
+        for vm in self.vms:
+            vm.getIMachine().state = Constants.MachineState_Running
+            vm.invalidate()
+        threads = [threading.Thread(target=wait, args=(vm,))
+                   for vm in self.vms]
+        for thread in threads:
+            thread.start()
+        for vm in self.vms:
+            self._changeState(vm.getIMachine(),
+                              Constants.MachineState_PoweredOff, 0.1)
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(["vm0", "vm1"], sorted(woken))
+
+    def testBenchmark(self):
+        """Benchmark CPU use and wake-up latency of waiting"""
+        legacy = self._measure(self._legacyWaitUntilRunning, self.vms[0])
+        eventDriven = self._measure(VirtualMachine.waitUntilRunning,
+                                    self.vms[1])
+        rows = []
+        for label, (cpu, wall, latency) in (("busy polling:", legacy),
+                                            ("event driven:", eventDriven)):
+            rows.append((label,
+                         "%3.0f%% CPU over %.2fs wait, woke %.1f ms after change" %
+                         (100 * cpu / wall, wall, 1000 * latency)))
+        report("Waiting 0.5s for a state change event", rows)
+        cpu, wall, latency = eventDriven
+        self.assertTrue(cpu / wall < 0.2)
+        self.assertTrue(latency < 0.2)
+
+if __name__ == '__main__':
+    unittest.main()
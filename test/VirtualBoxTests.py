@@ -2,8 +2,14 @@
 """Unittests for Virtualbox"""
 
 from pyVBoxTest import pyVBoxTest, main
+from pyVBoxStubs import RoundTripCounter, StubIMachine, StubIVirtualBox
+from pyVBoxStubs import StubVirtualBoxManager
+from pyVBox import Constants
 from pyVBox import VirtualBox
 from pyVBox import VirtualBoxException
+from pyVBox import VirtualBoxManager
+
+import unittest
 
 class VirtualBoxTests(pyVBoxTest):
     """Test case for VirtualBox"""
@@ -17,6 +23,52 @@ class VirtualBoxTests(pyVBoxTest):
         vbox = VirtualBox()
         self.assertNotEqual(None, vbox.guestOSTypes)
 
+    def testMonitor(self):
+        """Test VirtualBox.getMonitor()"""
+        vbox = VirtualBox()
+        monitor = vbox.getMonitor()
+        self.assertNotEqual(None, monitor)
+        monitor.processEvents()
+        vbox.waitForEvent()
+        monitor.unregister()
+
+class VirtualBoxEnumerationTests(unittest.TestCase):
+    """Test case for VirtualBox.iterMachines() using stand-ins"""
+
+    def setUp(self):
+        self.machines = [
+            RoundTripCounter(StubIMachine("web1", OSTypeId="Ubuntu",
+                                          state=Constants.MachineState_Running)),
+            RoundTripCounter(StubIMachine("web2", OSTypeId="Ubuntu")),
+            RoundTripCounter(StubIMachine("db1", OSTypeId="Debian",
+                                          state=Constants.MachineState_Running)),
+            ]
+        self.vbox = VirtualBox(StubVirtualBoxManager(
+                StubIVirtualBox(self.machines)))
+
+    def _names(self, **filters):
+        with VirtualBoxManager.using(self.vbox._manager):
+            return [vm.name for vm in self.vbox.iterMachines(**filters)]
+
+    def testFilters(self):
+        """Test VirtualBox.iterMachines() filters"""
+        self.assertEqual(["web1", "web2", "db1"], self._names())
+        self.assertEqual(["web1", "db1"],
+                         self._names(state=Constants.MachineState_Running))
+        self.assertEqual(["web1", "web2"], self._names(name="web*"))
+        self.assertEqual(["web1"],
+                         self._names(name="web*",
+                                     state=Constants.MachineState_Running))
+        self.assertEqual(["db1"], self._names(osTypeId=["Debian", "Other"]))
+        self.assertEqual([], self._names(name="WEB*"))
+
+    def testLazy(self):
+        """Test VirtualBox.iterMachines() wraps machines as it goes"""
+        with VirtualBoxManager.using(self.vbox._manager):
+            machines = self.vbox.iterMachines()
+            self.assertEqual("web1", machines.next().name)
+        self.assertEqual([0, 0], [m.roundTrips for m in self.machines[1:]])
+
 if __name__ == '__main__':
     main()
 
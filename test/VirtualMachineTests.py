@@ -1,14 +1,24 @@
 #!/usr/bin/env python
 """Unittests for VirtualMachine"""
 
+from pyVBoxBenchmark import report
+from pyVBoxStubs import StubIMachine, StubIMedium, StubIMediumAttachment
+from pyVBoxStubs import StubIStorageController
+from pyVBoxStubs import RoundTripCounter, StubFaultException
+from pyVBoxStubs import StubTestCase, setCacheDir
 from pyVBoxTest import pyVBoxTest, main
 from pyVBox import Constants
 from pyVBox import HardDisk
+from pyVBox import Medium
+from pyVBox import VirtualBox
 from pyVBox import VirtualBoxException
 from pyVBox import VirtualBoxFileNotFoundException
 from pyVBox import VirtualBoxObjectNotFoundException
 from pyVBox import VirtualMachine
 
+import shutil
+import tempfile
+import time
 from time import sleep
 
 class VirtualMachineTests(pyVBoxTest):
@@ -47,6 +57,8 @@ class VirtualMachineTests(pyVBoxTest):
         self.assertEqual(True, machine.isRegistered())
         m2 = VirtualMachine.find(machine.name)
         self.assertEqual(machine.id, m2.id)
+        # Wrappers for the same machine are shared
+        self.assertTrue(machine is m2)
         machine.unregister()
         self.assertEqual(False, machine.isRegistered())
 
@@ -247,6 +259,452 @@ class VirtualMachineTests(pyVBoxTest):
         newMachine.unregister()
         newMachine.delete()
 
+class VirtualMachineEditTests(StubTestCase):
+    """Test case for VirtualMachine.edit() using stand-ins"""
+
+    def createMachines(self):
+        self.machine = StubIMachine("vm")
+        return [self.machine]
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        self.vm = VirtualMachine.intern(self.machine)
+        self.vm.addStorageController(Constants.StorageBus_SATA)
+        self.machine.lockCalls = 0
+        self.machine.saveSettingsCalls = 0
+
+    def _controllerNames(self):
+        return [c.name for c in self.machine.storageControllers]
+
+    def testEdit(self):
+        """Test mutations in edit() share one lock and one save"""
+        disk = Medium(StubIMedium("/vms/disk.vdi"))
+        with self.vm.edit() as machine:
+            self.assertTrue(self.vm.isEditing())
+            self.vm.addStorageController(Constants.StorageBus_IDE)
+            machine.addStorageController(Constants.StorageBus_IDE)
+            self.vm.attachDevice(HardDisk, disk)
+            machine.memorySize = 2048
+            # Nothing is saved until the end of the batch
+            self.assertEqual(self.machine.saveSettingsCalls, 0)
+            self.assertEqual(self.machine.memorySize, 512)
+        self.assertFalse(self.vm.isEditing())
+        self.assertEqual(self.machine.lockCalls, 1)
+        self.assertEqual(self.machine.saveSettingsCalls, 1)
+        self.assertEqual(self._controllerNames(),
+                         ["SATA Controller", "IDE Controller",
+                          "IDE Controller 2"])
+        self.assertEqual(len(self.machine.mediumAttachments), 1)
+        self.assertEqual(self.machine.memorySize, 2048)
+        self.assertTrue(self.vm.isUnlocked())
+
+    def testRollback(self):
+        """Test edit() discards all changes if the batch fails"""
+        disk = Medium(StubIMedium("/vms/disk.vdi"))
+        try:
+            with self.vm.edit() as machine:
+                self.vm.attachDevice(HardDisk, disk)
+                machine.memorySize = 2048
+                # Fails, the name is taken
+                self.vm.addStorageController(Constants.StorageBus_SATA,
+                                             name="SATA Controller")
+        except VirtualBoxException:
+            pass
+        else:
+            self.fail("Expected VirtualBoxException")
+        self.assertEqual(self.machine.saveSettingsCalls, 0)
+        self.assertEqual(self.machine.mediumAttachments, [])
+        self.assertEqual(self.machine.memorySize, 512)
+        self.assertEqual(self._controllerNames(), ["SATA Controller"])
+        self.assertTrue(self.vm.isUnlocked())
+        self.assertFalse(self.vm.isEditing())
+
+    def testWithoutEdit(self):
+        """Test mutations outside edit() each lock and save"""
+        self.vm.addStorageController(Constants.StorageBus_IDE)
+        self.vm.removeStorageController("IDE Controller")
+        self.assertEqual(self.machine.lockCalls, 2)
+        self.assertEqual(self.machine.saveSettingsCalls, 2)
+        self.assertEqual(self._controllerNames(), ["SATA Controller"])
+
+    def testDetachAllMediums(self):
+        """Test detachAllMediums() saves settings once"""
+        with self.vm.edit() as machine:
+            for i in range(3):
+                machine.addStorageController(Constants.StorageBus_IDE)
+        for name in self._controllerNames():
+            self.machine.mediumAttachments.append(StubIMediumAttachment(
+                    name, 0, 0, Constants.DeviceType_HardDisk,
+                    StubIMedium("/vms/%s.vdi" % name)))
+        self.machine.saveSettingsCalls = 0
+        self.vm.detachAllMediums()
+        self.assertEqual(self.machine.mediumAttachments, [])
+        self.assertEqual(self.machine.saveSettingsCalls, 1)
+
+    def testAttachMediums(self):
+        """Test attaching many disks allocates distinct slots at once"""
+        disks = [Medium(StubIMedium("/vms/disk%d.vdi" % i))
+                 for i in range(10)]
+        self.manager.getArrayCalls = 0
+        self.vm.attachMediums(disks)
+        self.assertEqual(self.machine.lockCalls, 1)
+        self.assertEqual(self.machine.saveSettingsCalls, 1)
+        # One fetch each of controllers and attachments
+        self.assertEqual(self.manager.getArrayCalls, 2)
+        slots = [(a.controller, a.port, a.device)
+                 for a in self.machine.mediumAttachments]
+        self.assertEqual(slots, [("SATA Controller", port, 0)
+                                 for port in range(10)])
+        # Lookups by medium use the topology of the batch
+        self.manager.getArrayCalls = 0
+        with self.vm.edit():
+            for disk in disks[:5]:
+                self.vm.detachMedium(disk)
+            self.vm.attachMedium(disks[0])
+        self.assertEqual(self.manager.getArrayCalls, 2)
+        self.assertEqual(len(self.machine.mediumAttachments), 6)
+        # The first slot freed is reused
+        self.assertEqual(self.vm.getStorageTopology().findByMedium(
+                disks[0].id).port, 0)
+
+    def testAttachFailure(self):
+        """Test slots allocated for mediums that failed to attach are freed"""
+        disks = [Medium(StubIMedium("/vms/disk%d.vdi" % i)) for i in range(4)]
+        bad = Medium(StubIMedium("/vms/bad.vdi", attachError=True))
+        with self.vm.edit():
+            self.assertRaises(VirtualBoxException, self.vm.attachMediums,
+                              [disks[0], bad, disks[1]])
+            self.assertRaises(VirtualBoxException, self.vm.attachMedium, bad)
+            self.vm.attachMediums(disks[1:])
+        slots = [(a.controller, a.port, a.device)
+                 for a in self.machine.mediumAttachments]
+        self.assertEqual(slots, [("SATA Controller", port, 0)
+                                 for port in range(4)])
+
+    def testAttachDeviceSlot(self):
+        """Test attaching to a given slot, which is checked"""
+        disk = Medium(StubIMedium("/vms/disk.vdi"))
+        self.vm.attachDevice(HardDisk, disk, "SATA Controller", 3, 0)
+        self.assertEqual([(a.controller, a.port, a.device)
+                          for a in self.machine.mediumAttachments],
+                         [("SATA Controller", 3, 0)])
+        other = Medium(StubIMedium("/vms/other.vdi"))
+        for slot in [(None, 1, 0),
+                     ("SATA Controller", 1, None),
+                     ("SATA Controller", None, 0),
+                     ("SATA Controller", 3, 0),
+                     ("SATA Controller", 1, 1),
+                     ("Bogus Controller", 1, 0)]:
+            self.assertRaises(VirtualBoxException, self.vm.attachDevice,
+                              HardDisk, other, *slot)
+        self.assertEqual(len(self.machine.mediumAttachments), 1)
+
+    def testAttachDeviceTypes(self):
+        """Test attaching mediums to controllers that take them"""
+        self.vm.addStorageController(Constants.StorageBus_Floppy)
+        floppy = Medium(StubIMedium("/vms/boot.img",
+                                    deviceType=Constants.DeviceType_Floppy))
+        disk = Medium(StubIMedium("/vms/disk.vdi"))
+        self.vm.attachMediums([floppy, disk])
+        self.assertEqual([(a.controller, a.port, a.device)
+                          for a in self.machine.mediumAttachments],
+                         [("Floppy Controller", 0, 0),
+                          ("SATA Controller", 0, 0)])
+        self.vm.attachMediums([])
+
+    def testBenchmark(self):
+        """Benchmark lock cycles of ten mutations with and without edit()"""
+        count = 10
+        # Stand in for the round trips of locking a machine
+        self.machine.lockDelay = 0.01
+        start = time.time()
+        for i in range(count):
+            self.vm.addStorageController(Constants.StorageBus_SCSI)
+        separate = (self.machine.lockCalls, self.machine.saveSettingsCalls,
+                    time.time() - start)
+        self.machine.lockCalls = 0
+        self.machine.saveSettingsCalls = 0
+        start = time.time()
+        with self.vm.edit():
+            for i in range(count):
+                self.vm.addStorageController(Constants.StorageBus_IDE)
+        batched = (self.machine.lockCalls, self.machine.saveSettingsCalls,
+                   time.time() - start)
+        report("Adding %d storage controllers" % count, [
+                ("separately:", "%d lock cycles, %d saves, %.1f ms" %
+                 (separate[0], separate[1], separate[2] * 1000)),
+                ("with edit():", "%d lock cycles, %d saves, %.1f ms" %
+                 (batched[0], batched[1], batched[2] * 1000)),
+                ])
+        self.assertEqual(separate[:2], (count, count))
+        self.assertEqual(batched[:2], (1, 1))
+        self.assertEqual(len(self.machine.storageControllers), 2 * count + 1)
+
+class VirtualMachineCloneTests(StubTestCase):
+    """Test case for VirtualMachine.clone() using stand-ins"""
+
+    def createMachines(self):
+        self.machine = StubIMachine("base", CPUCount=2, memorySize=1024,
+                                    description="Base machine")
+        self.machine.storageControllers = [
+            StubIStorageController("SATA Controller",
+                                   Constants.StorageBus_SATA),
+            StubIStorageController("IDE Controller",
+                                   Constants.StorageBus_IDE),
+            ]
+        self.source = RoundTripCounter(self.machine)
+        return [self.source]
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        self.vm = VirtualMachine.find("base")
+
+    def testClone(self):
+        """Test VirtualMachine.clone() copies settings and controllers"""
+        clone = self.vm.clone("clone")
+        self.assertEqual(clone.name, "clone")
+        for attr in ("description", "CPUCount", "memorySize", "VRAMSize",
+                     "accelerate3DEnabled", "accelerate2DVideoEnabled",
+                     "monitorCount", "OSTypeId"):
+            self.assertEqual(getattr(clone, attr), getattr(self.vm, attr))
+        self.assertEqual([(c.name, c.bus)
+                          for c in clone.getStorageControllers()],
+                         [(c.name, c.bus)
+                          for c in self.vm.getStorageControllers()])
+        self.assertTrue(clone.getIMachine() in self.ivbox.machines)
+        self.assertEqual(self.vm.clone("clone2",
+                                       description="Other").description,
+                         "Other")
+
+    def testUnregistered(self):
+        """Test VirtualMachine.clone() with register=False"""
+        clone = self.vm.clone("clone", register=False)
+        self.assertFalse(clone.getIMachine() in self.ivbox.machines)
+        self.assertEqual(len(clone.getStorageControllers()), 2)
+
+    def testRoundTrips(self):
+        """Test cloning costs a fixed number of calls and no sessions"""
+        before = self.source.roundTrips
+        clone = self.vm.clone("clone")
+        iclone = clone.getIMachine()
+        sourceTrips = self.source.roundTrips - before
+        report("Cloning a machine with %d storage controllers" %
+               len(self.machine.storageControllers), [
+                ("source round trips:", sourceTrips),
+                ("clone round trips:", iclone.roundTrips),
+                ("sessions:", self.manager.sessions),
+                ("saves:", iclone._obj.saveSettingsCalls),
+                ])
+        # One read per copied setting and one for the controllers (the
+        # stub manager adds one more)
+        self.assertTrue(sourceTrips <= 10, sourceTrips)
+        # One write per setting, one call per controller, one save,
+        # and reads of the id and name to create and register it
+        self.assertTrue(iclone.roundTrips <= 7 + 2 + 1 + 5,
+                        iclone.roundTrips)
+        self.assertEqual(self.manager.sessions, 0)
+        self.assertEqual(self.machine.lockCalls, 0)
+        self.assertEqual(iclone._obj.lockCalls, 0)
+        self.assertEqual(iclone._obj.saveSettingsCalls, 1)
+
+class VirtualMachineLinkedCloneTests(StubTestCase):
+    """Test case for VirtualMachine.clone(linked=True) using stand-ins"""
+
+    def createMachines(self):
+        self.machine = StubIMachine("base")
+        self.machine.storageControllers = [
+            StubIStorageController("SATA Controller",
+                                   Constants.StorageBus_SATA)]
+        self.disks = [StubIMedium("/vms/base/system.vdi"),
+                      StubIMedium("/vms/base/data.vdi")]
+        self.machine.mediumAttachments = [
+            StubIMediumAttachment("SATA Controller", 0, 0,
+                                  Constants.DeviceType_HardDisk,
+                                  self.disks[0]),
+            StubIMediumAttachment("SATA Controller", 1, 0,
+                                  Constants.DeviceType_DVD, None),
+            StubIMediumAttachment("SATA Controller", 2, 0,
+                                  Constants.DeviceType_HardDisk,
+                                  self.disks[1]),
+            ]
+        return [self.machine]
+
+    def setUp(self):
+        # Keep records of the operations out of the user's history
+        self.cacheDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cacheDir)
+        setCacheDir(self, self.cacheDir)
+        StubTestCase.setUp(self)
+        self.vm = VirtualMachine.find("base")
+
+    def testLinkedClone(self):
+        """Test a linked clone gets differencing disks in the same slots"""
+        clone = self.vm.clone("clone", linked=True)
+        iclone = clone.getIMachine()
+        self.assertEqual(len(self.machine.snapshots), 1)
+        self.assertEqual(self.machine.snapshots[0].name,
+                         VirtualMachine.LINK_SNAPSHOT)
+        attachments = iclone.mediumAttachments
+        self.assertEqual([(a.controller, a.port, a.device)
+                          for a in attachments],
+                         [("SATA Controller", 0, 0),
+                          ("SATA Controller", 2, 0)])
+        for attachment, disk in zip(attachments, self.disks):
+            self.assertTrue(attachment.medium.parent is disk)
+        self.assertEqual([a.medium.location for a in attachments],
+                         ["/tmp/clone/clone-system.vdi",
+                          "/tmp/clone/clone-data.vdi"])
+        self.assertEqual(iclone._obj.saveSettingsCalls, 1)
+        # A second clone is based on the same snapshot
+        self.vm.clone("clone2", linked=True)
+        self.assertEqual(len(self.machine.snapshots), 1)
+
+    def testNamedSnapshot(self):
+        """Test a linked clone of a given snapshot"""
+        self.vm.takeSnapshot("Golden")
+        # Disks attached after the snapshot are not linked
+        self.machine.mediumAttachments = self.machine.mediumAttachments[:1]
+        self.vm.takeSnapshot("Later")
+        clone = self.vm.clone("clone", linked=True, snapshot="Golden")
+        self.assertEqual(len(clone.getIMachine().mediumAttachments), 2)
+        self.assertEqual(len(self.machine.snapshots), 2)
+
+    def testBytesWritten(self):
+        """Test linking costs the same whatever the size of the source"""
+        written = []
+        for size in (1024 ** 3, 100 * 1024 ** 3):
+            for disk in self.disks:
+                disk.size = disk.logicalSize = size
+            start = time.time()
+            clone = self.vm.clone("clone%d" % len(written), linked=True)
+            elapsed = time.time() - start
+            written.append(sum([disk.size
+                                for disk in clone.getHardDrives()]))
+            report("Linked clone of %d GB disks" % (size / 1024 ** 3), [
+                    ("seconds:", elapsed),
+                    ("bytes written:", written[-1]),
+                    ])
+        self.assertEqual(written[0], written[1])
+        self.assertEqual(written[0], 2 * StubIMedium.DIFF_SIZE)
+
+    def testFailure(self):
+        """Test differencing disks are deleted if the clone fails"""
+        self.machine.storageControllers = []
+        self.assertRaises(VirtualBoxException, self.vm.clone, "clone",
+                          linked=True)
+        diffs = [disk for disk in self.manager.vbox.hardDisks
+                 if disk.parent is not None]
+        self.assertEqual(len(diffs), 2)
+        for diff in diffs:
+            self.assertTrue(diff.deleted)
+
+    def testDiffFailure(self):
+        """Test differencing disks are deleted if one can't be created"""
+        self.disks[1].diffError = StubFaultException(0x80BB0004,
+                                                     "Disk is locked")
+        self.assertRaises(VirtualBoxException, self.vm.clone, "clone",
+                          linked=True)
+        # The first diff and the target of the failed one
+        created = self.manager.vbox.hardDisks[-2:]
+        self.assertTrue(created[0].parent is self.disks[0])
+        for disk in created:
+            self.assertTrue(disk.deleted or disk.closed)
+
+    def testRegisterFailure(self):
+        """Test differencing disks are deleted if registering fails"""
+        machines = []
+        def registerMachine(machine):
+            machines.append(machine)
+            raise StubFaultException(0x80BB000C, "Machine already exists")
+        self.manager.vbox.registerMachine = registerMachine
+        self.assertRaises(VirtualBoxException, self.vm.clone, "clone",
+                          linked=True)
+        self.assertEqual(machines[0].mediumAttachments, [])
+        diffs = [disk for disk in self.manager.vbox.hardDisks
+                 if disk.parent is not None]
+        self.assertEqual(len(diffs), 2)
+        for diff in diffs:
+            self.assertTrue(diff.deleted)
+
+class VirtualMachineReadTests(StubTestCase):
+    """Test case for reading VirtualMachines without sessions"""
+
+    def createMachines(self):
+        self.machine = StubIMachine("vm")
+        self.machine.storageControllers = [
+            StubIStorageController("SATA Controller",
+                                   Constants.StorageBus_SATA)]
+        self.disk = StubIMedium("/vms/disk.vdi")
+        self.dvd = StubIMedium("/vms/cd.iso",
+                               deviceType=Constants.DeviceType_DVD)
+        self.machine.mediumAttachments = [
+            StubIMediumAttachment("SATA Controller", 0, 0,
+                                  Constants.DeviceType_HardDisk, self.disk),
+            StubIMediumAttachment("SATA Controller", 1, 0,
+                                  Constants.DeviceType_DVD, self.dvd),
+            # An empty DVD drive
+            StubIMediumAttachment("SATA Controller", 2, 0,
+                                  Constants.DeviceType_DVD, None),
+            ]
+        return [self.machine]
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        self.vm = VirtualMachine.intern(self.machine)
+
+    def _read(self):
+        """Use the read-only accessors of the machine."""
+        self.assertEqual([m.location for m in self.vm.getAttachedMediums()],
+                         ["/vms/disk.vdi", "/vms/cd.iso"])
+        self.assertEqual([m.location for m in self.vm.getHardDrives()],
+                         ["/vms/disk.vdi"])
+        self.assertEqual(len(self.vm.getMediumAttachments()), 3)
+        self.assertEqual([c.name for c in self.vm.getStorageControllers()],
+                         ["SATA Controller"])
+        self.assertEqual(
+            self.vm.getStorageControllerByName("SATA Controller").bus,
+            Constants.StorageBus_SATA)
+        self.assertTrue(self.vm.doesStorageControllerExist("SATA Controller"))
+        self.assertEqual(self.vm.snapshot_record().name, "vm")
+        self.vm.isDown()
+        self.vm.isLocked()
+
+    def testNoSession(self):
+        """Test read-only accessors don't create a session"""
+        self._read()
+        self.assertEqual(self.manager.sessions, 0)
+        self.assertEqual(self.machine.lockCalls, 0)
+
+    def testLocked(self):
+        """Test reading a machine locked by someone else"""
+        self.machine.sessionState = Constants.SessionState_Locked
+        self._read()
+        self.assertEqual(self.manager.sessions, 0)
+
+    def testEnumNames(self):
+        """Test enumerations given as names, as by the webservice"""
+        self.machine.state = "Running"
+        self.machine.sessionState = "Locked"
+        self.machine.storageControllers[0].bus = "SATA"
+        for attachment in self.machine.mediumAttachments:
+            attachment.type = Constants.DeviceType.name_of(attachment.type)
+        self.disk.deviceType = "HardDisk"
+        self.assertEqual(self.vm.state, Constants.MachineState_Running)
+        self.assertTrue(self.vm.isRunning())
+        self.assertFalse(self.vm.isDown())
+        self.assertTrue(self.vm.isLocked())
+        self._read()
+        self.assertEqual(self.vm.getStorageTopology().getController(
+                "SATA Controller").bus, Constants.StorageBus_SATA)
+        vbox = VirtualBox.getDefault()
+        self.assertEqual(
+            list(vbox.iterMachines(state=Constants.MachineState_Running)),
+            [self.vm])
+        self.assertEqual(list(vbox.iterMachines(state="Running")), [self.vm])
+        self.assertEqual(
+            list(vbox.iterMachines(state=Constants.MachineState_PoweredOff)),
+            [])
+
 if __name__ == '__main__':
     main()
 
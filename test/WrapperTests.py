@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""Unittests for Wrapper"""
+
+from pyVBoxBenchmark import bytesPerObject, report, timePerCall
+from pyVBoxStubs import RoundTripCounter, StubIMachine, StubIMedium
+from pyVBoxStubs import StubTestCase, StubVirtualBoxManager
+from pyVBox import ExceptionHandler
+from pyVBox import Medium
+from pyVBox import VirtualBox
+from pyVBox import MediumAttachment
+from pyVBox import VirtualBoxManager
+from pyVBox import VirtualMachine
+from pyVBox.Wrapper import _epochs
+
+import gc
+import sys
+import time
+import unittest
+
+class LegacyVirtualMachine(object):
+    """Wrapper using the list-scanning __getattr__() pyVBox used to have.
+
+    Kept as a reference point for testBenchmark()."""
+    _passthruProperties = VirtualMachine._passthruProperties
+    _wrappedProperties = []
+
+    def __init__(self, machine):
+        self._wrappedInstance = machine
+
+    def __getattr__(self, attr):
+        if self._wrappedInstance:
+            if attr in self._passthruProperties:
+                with ExceptionHandler():
+                    return getattr(self._wrappedInstance, attr)
+            for prop, func in self._wrappedProperties:
+                if prop == attr:
+                    with ExceptionHandler():
+                        value = getattr(self._wrappedInstance, attr)
+                    return func(value) if value else None
+        raise AttributeError("Unrecognized attribute '%s'" % attr)
+
+class UnslottedMedium(Medium):
+    """Medium with a per-instance __dict__, as pyVBox used to have.
+
+    Kept as a reference point for testMemoryBenchmark()."""
+    pass
+
+class UnslottedMediumAttachment(MediumAttachment):
+    """MediumAttachment with a per-instance __dict__.
+
+    Kept as a reference point for testMemoryBenchmark()."""
+    pass
+
+class WrapperTests(StubTestCase):
+    """Test case for Wrapper
+
+    A VirtualBoxMonitor listens to the stand-in VirtualBox, so values
+    with a time to live are cached."""
+
+    def setUp(self):
+        StubTestCase.setUp(self)
+        self.monitor = VirtualBox.getDefault().getMonitor()
+
+    def testPassthruProperty(self):
+        """Test getting and setting passthru properties"""
+        imachine = StubIMachine()
+        vm = VirtualMachine(imachine)
+        self.assertEqual(imachine.name, vm.name)
+        self.assertEqual(imachine.VRAMSize, vm.VRAMSize)
+        vm.memorySize = 1024
+        self.assertEqual(1024, imachine.memorySize)
+        imachine.memorySize = 2048
+        self.assertEqual(2048, vm.memorySize)
+
+    def testDeleteProperty(self):
+        """Test that passthru properties cannot be deleted"""
+        vm = VirtualMachine(StubIMachine())
+        self.assertRaises(AttributeError, delattr, vm, "name")
+
+    def testUnknownAttribute(self):
+        """Test access of an attribute that is not passed through"""
+        vm = VirtualMachine(StubIMachine())
+        self.assertRaises(AttributeError, getattr, vm, "bogusAttribute")
+
+    def testDescriptors(self):
+        """Test properties are descriptors on the class"""
+        for attr in VirtualMachine._passthruProperties:
+            self.assertTrue(hasattr(VirtualMachine, attr))
+        # Methods defined by the class are not replaced
+        self.assertTrue(callable(VirtualMachine.unregister))
+
+    def testCachedForever(self):
+        """Test properties cached forever"""
+        imachine = RoundTripCounter(StubIMachine())
+        vm = VirtualMachine(imachine)
+        id = vm.id
+        self.assertEqual(id, vm.id)
+        self.assertEqual(1, imachine.roundTrips)
+        # Not affected by events
+        VirtualMachine.invalidateId(id)
+        vm.id
+        self.assertEqual(1, imachine.roundTrips)
+
+    def testCachedVolatile(self):
+        """Test invalidation of properties with a time to live"""
+        imachine = RoundTripCounter(StubIMachine())
+        vm = VirtualMachine(imachine)
+        state = vm.state
+        self.assertEqual(state, vm.state)
+        # id and state
+        self.assertEqual(2, imachine.roundTrips)
+        imachine._obj.state = state + 1
+        VirtualMachine.invalidateId(vm.id)
+        self.assertEqual(state + 1, vm.state)
+        self.assertEqual(3, imachine.roundTrips)
+        vm.invalidate("state")
+        vm.state
+        self.assertEqual(4, imachine.roundTrips)
+
+    def testUnmonitored(self):
+        """Test values with a time to live are read live without events"""
+        self.monitor.unregister()
+        imachine = RoundTripCounter(StubIMachine())
+        vm = VirtualMachine(imachine)
+        vm.id
+        vm.state
+        vm.state
+        # id is still cached
+        vm.id
+        self.assertEqual(3, imachine.roundTrips)
+        self.monitor.register()
+        vm.state
+        vm.state
+        self.assertEqual(4, imachine.roundTrips)
+        # Values cached before events stopped aren't used afterwards
+        self.monitor.unregister()
+        vm.state
+        self.monitor.register()
+        imachine._obj.state += 1
+        self.assertEqual(imachine._obj.state, vm.state)
+
+    def testCacheExpiry(self):
+        """Test expiry of cached properties"""
+        class ShortLivedVirtualMachine(VirtualMachine):
+            _cachedProperties = { "id" : None, "state" : 0.01 }
+        imachine = RoundTripCounter(StubIMachine())
+        vm = ShortLivedVirtualMachine(imachine)
+        vm.state
+        vm.state
+        self.assertEqual(2, imachine.roundTrips)
+        time.sleep(0.02)
+        vm.state
+        self.assertEqual(3, imachine.roundTrips)
+
+    def testSetCachedProperty(self):
+        """Test setting a cached property discards cached value"""
+        imachine = StubIMachine()
+        vm = VirtualMachine(imachine)
+        self.assertEqual(imachine.name, vm.name)
+        vm.name = "NewName"
+        self.assertEqual("NewName", vm.name)
+
+    def testFetch(self):
+        """Test Wrapper.fetch()"""
+        imachine = RoundTripCounter(StubIMachine())
+        vm = VirtualMachine(imachine)
+        record = vm.fetch("name", "id", "CPUCount", "teleporterPort")
+        self.assertEqual(("name", "id", "CPUCount", "teleporterPort"),
+                         record.fields())
+        self.assertEqual(imachine.name, record.name)
+        self.assertEqual(imachine.CPUCount, record.CPUCount)
+        # Cached values are used by later reads
+        trips = imachine.roundTrips
+        self.assertEqual(record.name, vm.name)
+        self.assertEqual(trips, imachine.roundTrips)
+        self.assertRaises(AttributeError, vm.fetch, "bogusAttribute")
+
+    def testSnapshotRecord(self):
+        """Test VirtualMachine.snapshot_record()"""
+        imachine = StubIMachine()
+        record = VirtualMachine(imachine).snapshot_record()
+        self.assertEqual(imachine.name, record.name)
+        self.assertEqual(imachine.id, record.id)
+        self.assertEqual(imachine.memorySize, record.memorySize)
+
+    def testIntern(self):
+        """Test Wrapper.intern()"""
+        imachine = RoundTripCounter(StubIMachine())
+        vm = VirtualMachine.intern(imachine)
+        self.assertTrue(vm is VirtualMachine.intern(imachine))
+        # Another instance for the same machine
+        other = StubIMachine(id=imachine.id)
+        self.assertTrue(vm is VirtualMachine.intern(other))
+        self.assertTrue(vm.getIMachine() is other)
+        vm2 = VirtualMachine.intern(StubIMachine())
+        self.assertFalse(vm is vm2)
+        id = vm2.id
+        # Wrappers are not kept alive by the identity map
+        del vm, vm2
+        gc.collect()
+        self.assertEqual([], [key for key in VirtualMachine._identityMap.keys()
+                              if key[1] == id])
+
+    def testInternManager(self):
+        """Test wrappers are kept apart by the manager of their instance"""
+        first = StubVirtualBoxManager()
+        second = StubVirtualBoxManager()
+        imedium = StubIMedium("/vms/diff.vdi", parent=StubIMedium("/base.vdi"))
+        medium = Medium.intern(imedium, first)
+        self.assertTrue(medium._manager is first)
+        self.assertFalse(medium is Medium.intern(imedium, second))
+        with VirtualBoxManager.using(first):
+            self.assertTrue(medium is Medium.intern(imedium))
+        # Objects reached from a wrapper come from its manager, whatever
+        # the current one
+        with VirtualBoxManager.using(second):
+            parent = medium.getParent()
+        self.assertTrue(parent._manager is first)
+        self.assertTrue(parent is Medium.intern(imedium.parent, first))
+
+    def testEpochs(self):
+        """Test invalidation epochs go away with the wrappers using them"""
+        vm = VirtualMachine(StubIMachine())
+        id = vm.id
+        vm.state
+        VirtualMachine.invalidateId(id)
+        self.assertEqual(1, vm._getEpoch().value)
+        del vm
+        gc.collect()
+        self.assertFalse(id in _epochs)
+        # Ids without wrappers aren't remembered
+        VirtualMachine.invalidateId(id)
+        self.assertFalse(id in _epochs)
+
+    def testInternBenchmark(self):
+        """Benchmark wrapper allocation over a fleet of stub machines"""
+        machines = [StubIMachine(name="VM%d" % i) for i in range(1000)]
+        scans = 3
+        rows = []
+        allocated = {}
+        for label, wrap in (("VirtualMachine()", VirtualMachine),
+                            ("VirtualMachine.intern()",
+                             VirtualMachine.intern)):
+            wrappers = []
+            for scan in range(scans):
+                for imachine in machines:
+                    vm = wrap(imachine)
+                    # Read a property as a listing would
+                    vm.name
+                    wrappers.append(vm)
+            distinct = dict([(id(vm), vm) for vm in wrappers]).values()
+            size = sum([sys.getsizeof(vm) + sys.getsizeof(vm._propertyCache)
+                        for vm in distinct])
+            allocated[label] = len(distinct)
+            rows.append((label + ":", "%d wrappers, %d bytes" %
+                         (len(distinct), size)))
+            del vm, wrappers, distinct
+        report("%d scans of %d machines" % (scans, len(machines)), rows)
+        self.assertEqual(scans * len(machines), allocated["VirtualMachine()"])
+        self.assertEqual(len(machines), allocated["VirtualMachine.intern()"])
+
+    def testSlots(self):
+        """Test wrappers do not have a __dict__"""
+        vm = VirtualMachine(StubIMachine())
+        self.assertFalse(hasattr(vm, "__dict__"))
+        self.assertRaises(AttributeError, setattr, vm, "bogusAttribute", 1)
+        unwrapped = VirtualMachine.__new__(VirtualMachine)
+        self.assertEqual(None, unwrapped._wrappedInstance)
+        self.assertRaises(AttributeError, getattr, unwrapped, "name")
+
+    def testMemoryBenchmark(self):
+        """Benchmark memory used per wrapper"""
+        imedium = StubIMachine()
+        rows = []
+        for cls in (UnslottedMedium, Medium,
+                    UnslottedMediumAttachment, MediumAttachment):
+            size = bytesPerObject(lambda: cls(imedium))
+            rows.append(("%s:" % cls.__name__, "%d bytes" % size))
+        report("Memory per wrapper", rows)
+        self.assertTrue(bytesPerObject(lambda: Medium(imedium)) <
+                        bytesPerObject(lambda: UnslottedMedium(imedium)))
+
+    def testBenchmark(self):
+        """Benchmark attribute reads against a stub IMachine"""
+        imachine = StubIMachine()
+        legacy = LegacyVirtualMachine(imachine)
+        vm = VirtualMachine(imachine)
+        # teleporterPort and VRAMSize are near the end of
+        # _passthruProperties, so the worst case for the legacy list
+        # scan. VRAMSize is also cached.
+        rows = []
+        for attr in ("teleporterPort", "VRAMSize"):
+            raw = timePerCall(lambda: getattr(imachine, attr))
+            before = timePerCall(lambda: getattr(legacy, attr))
+            after = timePerCall(lambda: getattr(vm, attr))
+            rows.extend([
+                    ("%s stub IMachine:" % attr, "%.3f usec" % (raw * 1e6)),
+                    ("%s before (__getattr__):" % attr,
+                     "%.3f usec" % (before * 1e6)),
+                    ("%s after (descriptor):" % attr,
+                     "%.3f usec" % (after * 1e6))])
+            self.assertTrue(after < before)
+        report("Wrapper attribute read", rows)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""Helpers for benchmarks embedded in the pyVBox unittests."""
+
+import sys
+import timeit
+
+def timePerCall(func, number=100000, repeat=3):
+    """Return best time in seconds for one call of func."""
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def report(title, rows):
+    """Write benchmark results to stderr.
+
+    rows should be a list of (label, value) tuples."""
+    sys.stderr.write("\n%s\n" % title)
+    width = max([len(label) for label, value in rows])
+    for label, value in rows:
+        sys.stderr.write("  %-*s %s\n" % (width, label, value))
+
+def bytesPerObject(factory, count=1000):
+    """Return average number of bytes allocated by a call to factory.
+
+    Uses tracemalloc where available. Otherwise falls back to summing
+    sys.getsizeof() of each object, its __dict__ if it has one, and the
+    values of its slots, which ignores shared objects and allocator
+    overhead."""
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            objects = [factory() for i in range(count)]
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        # Don't count the list holding the objects
+        return float(after - before - sys.getsizeof(objects)) / count
+    objects = [factory() for i in range(count)]
+    total = 0
+    for obj in objects:
+        total += sys.getsizeof(obj)
+        if hasattr(obj, "__dict__"):
+            total += sys.getsizeof(obj.__dict__)
+        for klass in type(obj).__mro__:
+            for slot in getattr(klass, "__slots__", ()):
+                if slot in ("__dict__", "__weakref__"):
+                    continue
+                value = getattr(obj, slot, None)
+                if isinstance(value, dict):
+                    total += sys.getsizeof(value)
+    return float(total) / count
@@ -0,0 +1,608 @@
+"""Stand-ins for VirtualBox XPCOM objects.
+
+These allow pyVBox wrappers to be exercised, and benchmarked, without
+talking to VirtualBox."""
+
+import collections
+import os
+import threading
+import time
+import unittest
+import uuid
+
+class StubIMachine(object):
+    """Stand-in for IMachine with plain attributes."""
+    def __init__(self, name="StubVM", id=None, **kwargs):
+        self.accelerate2DVideoEnabled = False
+        self.accelerate3DEnabled = False
+        self.accessible = True
+        self.CPUCount = 1
+        self.description = "Stub machine"
+        self.id = id if id is not None else str(uuid.uuid4())
+        self.memorySize = 512
+        self.monitorCount = 1
+        self.name = name
+        self.OSTypeId = "Ubuntu"
+        self.sessionState = 1
+        self.settingsFilePath = "/tmp/%s/%s.vbox" % (name, name)
+        self.state = 1
+        self.teleporterPort = 0
+        self.VRAMSize = 12
+        self.storageControllers = []
+        self.mediumAttachments = []
+        self.snapshots = []
+        self.lockCalls = 0
+        self.lockDelay = 0
+        self.saveSettingsCalls = 0
+        for attr, value in kwargs.items():
+            setattr(self, attr, value)
+
+    def lockMachine(self, isession, type):
+        from pyVBox import Constants, VirtualBoxException
+        if self.sessionState == Constants.SessionState_Locked:
+            raise VirtualBoxException("Machine is already locked")
+        self.lockCalls += 1
+        time.sleep(self.lockDelay)
+        self.sessionState = Constants.SessionState_Locked
+        isession.machine = StubMutableIMachine(self)
+        isession.state = Constants.SessionState_Locked
+
+    def getStorageControllerByName(self, name):
+        return findStorageController(self.storageControllers, name)
+
+    def findSnapshot(self, nameOrId):
+        from pyVBox import VirtualBoxObjectNotFoundException
+        for snapshot in self.snapshots:
+            if nameOrId in (snapshot.name, snapshot.id):
+                return snapshot
+        raise VirtualBoxObjectNotFoundException(
+            "Could not find a snapshot named '%s'" % nameOrId)
+
+    # A machine is mutable without a session until it is registered.
+
+    def addStorageController(self, name, bus):
+        controller = StubIStorageController(name, bus)
+        self.storageControllers.append(controller)
+        return controller
+
+    def attachDevice(self, name, port, device, type, medium):
+        attachDevice(self, name, port, device, type, medium)
+
+    def detachDevice(self, name, port, device):
+        detachDevice(self, name, port, device)
+
+    def saveSettings(self):
+        self.saveSettingsCalls += 1
+
+def attachDevice(machine, name, port, device, type, medium):
+    """Attach medium to a slot of the given stub machine.
+
+    Fails for a medium with a true attachError attribute."""
+    from pyVBox import VirtualBoxException
+    machine.getStorageControllerByName(name)
+    if getattr(medium, "attachError", False):
+        raise VirtualBoxException("Could not attach %s" % medium.location)
+    for attachment in machine.mediumAttachments:
+        if ((attachment.controller, attachment.port, attachment.device)
+            == (name, port, device)):
+            raise VirtualBoxException(
+                "Port %d of controller '%s' is already in use" %
+                (port, name))
+    machine.mediumAttachments.append(
+        StubIMediumAttachment(name, port, device, type, medium))
+
+def detachDevice(machine, name, port, device):
+    """Detach the medium in a slot of the given stub machine."""
+    from pyVBox import VirtualBoxException
+    for attachment in machine.mediumAttachments:
+        if ((attachment.controller, attachment.port, attachment.device)
+            == (name, port, device)):
+            machine.mediumAttachments.remove(attachment)
+            return
+    raise VirtualBoxException("No device attached to port %d of '%s'"
+                              % (port, name))
+
+def findStorageController(controllers, name):
+    """Return the stub controller with the given name."""
+    from pyVBox import VirtualBoxObjectNotFoundException
+    for controller in controllers:
+        if controller.name == name:
+            return controller
+    raise VirtualBoxObjectNotFoundException(
+        "Could not find a storage controller named '%s'" % name)
+
+class StubMutableIMachine(object):
+    """Stand-in for the IMachine of a session locking a StubIMachine.
+
+    Changes are applied to the StubIMachine by saveSettings()."""
+    def __init__(self, machine):
+        self.machine = machine
+        self.changes = {}
+        self.discardSettings()
+
+    def __getattr__(self, attr):
+        if self.changes.has_key(attr):
+            return self.changes[attr]
+        return getattr(self.machine, attr)
+
+    def __setattr__(self, attr, value):
+        if attr in ("machine", "changes", "storageControllers",
+                    "mediumAttachments"):
+            object.__setattr__(self, attr, value)
+        else:
+            self.changes[attr] = value
+
+    def saveSettings(self):
+        self.machine.saveSettingsCalls += 1
+        for attr, value in self.changes.items():
+            setattr(self.machine, attr, value)
+        self.machine.storageControllers = list(self.storageControllers)
+        self.machine.mediumAttachments = list(self.mediumAttachments)
+
+    def discardSettings(self):
+        self.changes.clear()
+        self.storageControllers = list(self.machine.storageControllers)
+        self.mediumAttachments = list(self.machine.mediumAttachments)
+
+    def addStorageController(self, name, bus):
+        from pyVBox import VirtualBoxException
+        if [c for c in self.storageControllers if c.name == name]:
+            raise VirtualBoxException(
+                "Storage controller named '%s' already exists" % name)
+        controller = StubIStorageController(name, bus)
+        self.storageControllers.append(controller)
+        return controller
+
+    def removeStorageController(self, name):
+        controller = self.getStorageControllerByName(name)
+        self.storageControllers.remove(controller)
+
+    def getStorageControllerByName(self, name):
+        return findStorageController(self.storageControllers, name)
+
+    def attachDevice(self, name, port, device, type, medium):
+        attachDevice(self, name, port, device, type, medium)
+
+    def detachDevice(self, name, port, device):
+        detachDevice(self, name, port, device)
+
+class StubISession(object):
+    """Stand-in for ISession."""
+    def __init__(self):
+        from pyVBox import Constants
+        self.machine = None
+        self.state = Constants.SessionState_Unlocked
+        self.type = Constants.SessionType_WriteLock
+        self.console = StubIConsole(self)
+
+    def unlockMachine(self):
+        from pyVBox import Constants
+        self.machine.machine.sessionState = Constants.SessionState_Unlocked
+        self.state = Constants.SessionState_Unlocked
+
+class StubIConsole(object):
+    """Stand-in for the IConsole of a StubISession."""
+    def __init__(self, session):
+        self.session = session
+
+    def takeSnapshot(self, name, description):
+        """Record a snapshot holding the current attachments."""
+        machine = self.session.machine.machine
+        state = StubIMachine(machine.name, id=machine.id)
+        state.storageControllers = list(machine.storageControllers)
+        state.mediumAttachments = list(machine.mediumAttachments)
+        machine.snapshots.append(StubISnapshot(name, state, description))
+        return StubIProgress(0)
+
+class StubISnapshot(object):
+    """Stand-in for ISnapshot of the given StubIMachine state."""
+    def __init__(self, name, machine, description=None):
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self.description = description
+        self.machine = machine
+        self.online = False
+        self.parent = None
+        self.children = []
+        self.timeStamp = int(time.time() * 1000)
+
+class StubIStorageController(object):
+    """Stand-in for IStorageController."""
+    def __init__(self, name, bus):
+        self.name = name
+        self.bus = bus
+        self.controllerType = 1
+        self.instance = 0
+        self.portCount = 30
+        self.maxPortCount = 30
+        self.minPortCount = 1
+        self.maxDevicesPerPortCount = 1
+
+class StubIMediumAttachment(object):
+    """Stand-in for IMediumAttachment."""
+    def __init__(self, controller, port, device, type, medium):
+        self.controller = controller
+        self.port = port
+        self.device = device
+        self.type = type
+        self.medium = medium
+        self.passthrough = False
+        self.bandwidthGroup = None
+
+class StubIMedium(object):
+    """Stand-in for IMedium with plain attributes."""
+    # Size of a new differencing medium, whatever the size of its parent
+    DIFF_SIZE = 2 * 1024 * 1024
+
+    def __init__(self, location, size=1024 * 1024, id=None, **kwargs):
+        from pyVBox import Constants
+        self.id = id if id is not None else str(uuid.uuid4())
+        self.location = location
+        self.name = location.split("/")[-1]
+        self.size = size
+        self.logicalSize = size
+        self.deviceType = Constants.DeviceType_HardDisk
+        self.format = "VDI"
+        self.state = 1
+        self.parent = None
+        self.deleted = False
+        self.closed = False
+        # Raised by createDiffStorage() if set
+        self.diffError = None
+        for attr, value in kwargs.items():
+            setattr(self, attr, value)
+
+    def cloneTo(self, target, variant, parent):
+        """Write the flattened contents of this medium to target.
+
+        The contents are those of the file at the location of the base
+        medium, with the writes (list of (offset, data)) of each
+        medium from there down to this one applied."""
+        chain = [self]
+        while chain[0].parent is not None:
+            chain.insert(0, chain[0].parent)
+        with open(chain[0].location, "rb") as f:
+            data = f.read()
+        for medium in chain:
+            for offset, change in getattr(medium, "writes", ()):
+                data = data[:offset] + change + data[offset + len(change):]
+        with open(target.location, "wb") as f:
+            f.write(data)
+        target.size = target.logicalSize = len(data)
+        return StubIProgress(0)
+
+    def createDiffStorage(self, target, variant):
+        """Make target a differencing medium holding no changes yet."""
+        if self.diffError is not None:
+            raise self.diffError
+        target.parent = self
+        target.size = self.DIFF_SIZE
+        target.logicalSize = self.logicalSize
+        return StubIProgress(0)
+
+    def deleteStorage(self):
+        import os
+        self.deleted = True
+        if os.path.exists(self.location):
+            os.remove(self.location)
+        return StubIProgress(0)
+
+    def close(self):
+        self.closed = True
+
+class RoundTripCounter(object):
+    """Proxy counting attribute reads and writes on the given object.
+
+    Each access stands in for a round trip to VirtualBox."""
+    def __init__(self, obj):
+        object.__setattr__(self, "_obj", obj)
+        object.__setattr__(self, "roundTrips", 0)
+
+    def __getattr__(self, attr):
+        object.__setattr__(self, "roundTrips", self.roundTrips + 1)
+        return getattr(self._obj, attr)
+
+    def __setattr__(self, attr, value):
+        object.__setattr__(self, "roundTrips", self.roundTrips + 1)
+        setattr(self._obj, attr, value)
+
+class StubIProgress(object):
+    """Stand-in for IProgress completing duration seconds after creation.
+
+    If resultCode is not 0, the task fails with it. The duration is
+    split equally between the sub-operations named by operations."""
+    def __init__(self, duration=0.1, cancelable=True, resultCode=0,
+                 description="Stub task", operations=("Stub operation",)):
+        self.start = time.time()
+        self.duration = duration
+        self.cancelable = cancelable
+        self.canceled = False
+        self.description = description
+        self.operations = operations
+        self.operationCount = len(operations)
+        self._resultCode = resultCode
+        self.errorInfo = StubVirtualBoxErrorInfo("Stub task failed")
+        self.polls = 0
+
+    @property
+    def completed(self):
+        self.polls += 1
+        return self.canceled or (time.time() - self.start >= self.duration)
+
+    @property
+    def percent(self):
+        if self.completed:
+            return 100
+        return int(100 * (time.time() - self.start) / self.duration)
+
+    @property
+    def operation(self):
+        return min(self.percent * self.operationCount / 100,
+                   self.operationCount - 1)
+
+    @property
+    def operationDescription(self):
+        return self.operations[self.operation]
+
+    @property
+    def resultCode(self):
+        if self.canceled:
+            return 0x80004004
+        return self._resultCode
+
+    def cancel(self):
+        self.canceled = True
+
+    def waitForCompletion(self, timeout):
+        if timeout < 0:
+            remaining = self.duration - (time.time() - self.start)
+        else:
+            remaining = min(timeout / 1000.0,
+                            self.duration - (time.time() - self.start))
+        if remaining > 0:
+            time.sleep(remaining)
+
+class StubVirtualBoxErrorInfo(object):
+    """Stand-in for IVirtualBoxErrorInfo."""
+    def __init__(self, text):
+        self.text = text
+
+class StubIGuestOSType(object):
+    """Stand-in for IGuestOSType with plain attributes."""
+    def __init__(self, id, description=None, **kwargs):
+        self.adapterType = 1
+        self.description = description if description is not None else id
+        self.familyDescription = "Linux"
+        self.familyId = "Linux"
+        self.id = id
+        self.is64Bit = False
+        self.recommendedHDD = 8192
+        self.recommendedIOAPIC = False
+        self.recommendedRAM = 512
+        self.recommendedVirtEx = True
+        self.recommendedVRAM = 12
+        for attr, value in kwargs.items():
+            setattr(self, attr, value)
+
+class StubFault(object):
+    """Stand-in for the SOAP fault returned by vboxwebsrv."""
+    def __init__(self, resultCode, text):
+        self.code = "SOAP-ENV:Client"
+        self.string = "VirtualBox error: %s (0x%x)" % (text, resultCode)
+        # The result code is signed, as in the RuntimeFault
+        if resultCode >= 0x80000000:
+            resultCode -= 0x100000000
+        self.detail = [StubRuntimeFault(resultCode)]
+
+class StubRuntimeFault(object):
+    """Stand-in for the RuntimeFault detail of a StubFault."""
+    def __init__(self, resultCode):
+        self.resultCode = resultCode
+
+class StubFaultException(Exception):
+    """Stand-in for the ZSI.FaultException raised by vboxapi for a fault."""
+    def __init__(self, resultCode, text):
+        self.fault = StubFault(resultCode, text)
+        Exception.__init__(self, self.fault.string)
+
+def raiseNotFound(vbox, text):
+    """Raise the error of a failed lookup in the given StubIVirtualBox."""
+    from pyVBox import VirtualBoxObjectNotFoundException
+    if vbox.faults:
+        raise StubFaultException(0x80BB0001, text)
+    raise VirtualBoxObjectNotFoundException(text)
+
+class StubIVirtualBox(object):
+    """Stand-in for IVirtualBox holding the given StubIMachines.
+
+    Each call takes delay seconds. If faults is True, failed lookups
+    raise StubFaultException, as vboxapi does for the webservice,
+    rather than pyVBox exceptions."""
+    version = "4.1.12"
+    revision = 77245
+
+    def __init__(self, machines=(), delay=0, faults=False):
+        self.machines = list(machines)
+        self.hardDisks = []
+        self.DVDImages = []
+        self.floppyImages = []
+        self.guestOSTypes = [StubIGuestOSType("Ubuntu", "Ubuntu"),
+                             StubIGuestOSType("Ubuntu_64", "Ubuntu (64 bit)",
+                                              is64Bit=True)]
+        self.delay = delay
+        self.faults = faults
+        self.eventSource = StubEventSource()
+        self.findMachineCalls = 0
+
+    def createMachine(self, settingsFile, name, osTypeId, id,
+                      forceOverwrite):
+        """Return a new StubIMachine, wrapped in a RoundTripCounter."""
+        machine = StubIMachine(name, id=id, OSTypeId=osTypeId)
+        if settingsFile is not None:
+            machine.settingsFilePath = settingsFile
+        return RoundTripCounter(machine)
+
+    def registerMachine(self, machine):
+        self.machines.append(machine)
+
+    def createHardDisk(self, format, location):
+        """Return a new StubIMedium with no storage yet."""
+        medium = StubIMedium(location, size=0)
+        self.hardDisks.append(medium)
+        return medium
+
+    def findMachine(self, nameOrId):
+        self.findMachineCalls += 1
+        time.sleep(self.delay)
+        for machine in self.machines:
+            if nameOrId in (machine.name, machine.id):
+                return machine
+        raiseNotFound(self,
+                      "Could not find a registered machine named '%s'" %
+                      nameOrId)
+
+    def getGuestOSType(self, osTypeId):
+        for osType in self.guestOSTypes:
+            if osType.id == osTypeId:
+                return osType
+        raiseNotFound(self, "Guest OS type '%s' is invalid" % osTypeId)
+
+class StubVirtualBoxManager(object):
+    """Stand-in for VirtualBoxManager around a StubIVirtualBox."""
+    def __init__(self, vbox=None):
+        self.vbox = vbox if vbox is not None else StubIVirtualBox()
+        self.mgr = self
+        self.sessions = 0
+        # Number of event listeners left at each call of deinit()
+        self.deinitListeners = []
+
+    def getSessionObject(self, vbox):
+        self.sessions += 1
+        return StubISession()
+
+    def getIVirtualBox(self):
+        return self.vbox
+
+    def getArray(self, obj, name):
+        self.getArrayCalls = getattr(self, "getArrayCalls", 0) + 1
+        time.sleep(getattr(obj, "delay", 0))
+        return list(getattr(obj, name))
+
+    def isMSCOM(self):
+        return False
+
+    def queryInterface(self, obj, name):
+        return obj
+
+    def waitForEvents(self, timeout=None):
+        pass
+
+    def deinit(self):
+        self.deinitListeners.append(self.vbox.eventSource.getListenerCount())
+
+class StubEvent(object):
+    """Stand-in for IEvent and its subinterfaces with plain attributes."""
+    def __init__(self, type, **kwargs):
+        self.type = type
+        for attr, value in kwargs.items():
+            setattr(self, attr, value)
+
+class StubEventSource(object):
+    """Stand-in for a passive IEventSource.
+
+    fireEvent() queues an event for each registered listener."""
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Listener -> (event types, deque of events)
+        self._listeners = {}
+
+    def createListener(self):
+        return object()
+
+    def registerListener(self, listener, types, active):
+        with self._condition:
+            self._listeners[listener] = (list(types), collections.deque())
+
+    def unregisterListener(self, listener):
+        with self._condition:
+            self._listeners.pop(listener, None)
+
+    def getListenerCount(self):
+        return len(self._listeners)
+
+    def fireEvent(self, event):
+        with self._condition:
+            for types, events in self._listeners.values():
+                if event.type in types:
+                    events.append(event)
+            self._condition.notifyAll()
+
+    def getEvent(self, listener, timeout):
+        """Return next event for listener, waiting up to timeout ms.
+
+        A negative timeout waits forever."""
+        deadline = time.time() + timeout / 1000.0
+        with self._condition:
+            while True:
+                types, events = self._listeners[listener]
+                if events:
+                    return events.popleft()
+                if timeout < 0:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+
+    def eventProcessed(self, listener, event):
+        pass
+
+class StubTestCase(unittest.TestCase):
+    """TestCase with stand-ins as the default VirtualBox.
+
+    setUp() makes a StubVirtualBoxManager around a StubIVirtualBox,
+    with the machines returned by createMachines(), the default (see
+    VirtualBoxManager.using()) as self.manager and self.ivbox.
+    tearDown() stops listening for events and restores the default.
+    EventPump.WAIT_TIMEOUT is shortened meanwhile, so stopping the
+    pump doesn't wait long."""
+
+    def createMachines(self):
+        """Return list of the machines registered with VirtualBox."""
+        return []
+
+    def setUp(self):
+        from pyVBox import EventPump, VirtualBoxManager
+        loadConstants()
+        self.waitTimeout = EventPump.WAIT_TIMEOUT
+        EventPump.WAIT_TIMEOUT = 50
+        self.ivbox = StubIVirtualBox(self.createMachines())
+        self.manager = StubVirtualBoxManager(self.ivbox)
+        self.using = VirtualBoxManager.using(self.manager)
+        self.using.__enter__()
+
+    def tearDown(self):
+        from pyVBox import EventPump, VirtualBox
+        VirtualBox.getDefault().getMonitor().unregister()
+        self.using.__exit__(None, None, None)
+        EventPump.WAIT_TIMEOUT = self.waitTimeout
+
+def loadConstants():
+    """Load Constants from VirtualBox, if not loaded yet.
+
+    Call before making a StubVirtualBoxManager the default, as it has
+    no constants to load them from."""
+    from pyVBox import Constants
+    Constants.getVersion()
+
+def setCacheDir(testCase, path):
+    """Set PYVBOX_CACHE_DIR to path until testCase has finished."""
+    saved = os.environ.get("PYVBOX_CACHE_DIR")
+    def restore():
+        if saved is None:
+            del os.environ["PYVBOX_CACHE_DIR"]
+        else:
+            os.environ["PYVBOX_CACHE_DIR"] = saved
+    os.environ["PYVBOX_CACHE_DIR"] = path
+    testCase.addCleanup(restore)
@@ -2,15 +2,24 @@
 """pyVBox utility to control VirtualBox VMs.
 """
 
+from pyVBox import ChunkStore
+from pyVBox import Constants
 from pyVBox import HardDisk
+from pyVBox import OperationHistory
+from pyVBox import PauseMonitor
+from pyVBox import ProgressGroup
 from pyVBox import VirtualBox
+from pyVBox import VirtualBoxCluster
 from pyVBox import VirtualBoxException
+from pyVBox import VirtualBoxObjectNotFoundException
 from pyVBox import VirtualMachine
 
 import atexit
+import functools
 import optparse
 import os.path
 import sys
+import time
 import traceback
 
 #----------------------------------------------------------------------
@@ -21,6 +30,27 @@ import traceback
 # Default = 1, 0 = quiet, 2 = verbose
 verbosityLevel = 1
 
+# Hosts given with --host, see get_cluster()
+hosts = []
+hostUser = ""
+hostTimeout = 30
+
+# Filters given with --state and --ostype, see machine_filters()
+machineStates = []
+machineOSTypes = []
+
+# Set by --linked, see CloneCommand
+linkedClone = False
+
+# Set by --live, see BackupCommand
+liveBackup = False
+
+# Set by --dedup, see BackupCommand
+dedupBackup = False
+
+# Most disks cloned at once, set by --jobs, see clone_disks()
+cloneJobs = 4
+
 def errorMsg(msg):
     sys.stderr.write(msg + "\n")
 
@@ -48,47 +78,170 @@ def show_progress(progress, prefix="Progess: "):
     
     The string prefix will precent the percentage.
     If running in quiet mode, displays nothing."""
+    show_progress_group(ProgressGroup([progress]), prefix)
+
+def show_progress_group(group, prefix="Progress: "):
+    """Given a ProgressGroup, display its aggregate progress to user.
+
+    Shows percent, throughput and estimated time remaining, followed
+    by a line for each task if there are several. If running in quiet
+    mode, displays nothing."""
     if verbosityLevel > 0:
+        # Number of lines shown last time, to be overwritten
+        shown = [0]
+        def show(group, final=False):
+            lines = [format_progress(group, prefix)]
+            if len(group) > 1:
+                lines.extend([format_task(status, group.isSized())
+                              for status in group.getStatus()])
+            if not sys.stdout.isatty():
+                # Can't overwrite, so only show the final state
+                if final:
+                    print "\n".join(lines)
+                return
+            if shown[0]:
+                # Move cursor back up to the first line shown
+                sys.stdout.write("\033[%dA" % shown[0])
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+            shown[0] = len(lines)
         try:
-            while not progress.completed:
-                print "%s%2d%%\r" % (prefix, progress.percent),
-                sys.stdout.flush()
-                # Wait one second
-                progress.waitForCompletion(timeout=1000)
+            group.wait(callback=show)
         except KeyboardInterrupt:
             print "Interrupted."
         else:
-            # Print one last time with carriage return
-            print "%s%2d%%" % (prefix, progress.percent)
+            show(group, final=True)
+    else:
+        group.wait()
+
+def clone_disks(disks, targets):
+    """Clone each disk to the path in targets at the same index.
+
+    Up to cloneJobs disks are cloned at once, but only one at a time
+    reading from or writing to each filesystem. Returns list of the
+    new HardDisks."""
+    group = ProgressGroup(maxConcurrent=cloneJobs)
+    for disk, target in zip(disks, targets):
+        devices = [disk.getFilesystemDevice(),
+                   get_filesystem_device(os.path.dirname(target))]
+        group.schedule(functools.partial(disk.clone, target, wait=False),
+                       label=disk.basename(), size=disk.size,
+                       resource=devices)
+    show_progress_group(group)
+    return [HardDisk.find(target) for target in targets]
+
+def get_filesystem_device(path):
+    """Return the ID of the filesystem device holding path.
+
+    Returns None if path can't be examined, e.g. if it doesn't exist
+    yet."""
+    try:
+        return os.stat(path or os.curdir).st_dev
+    except OSError:
+        return None
+
+def format_progress(group, prefix):
+    """Return a line describing progress of the given ProgressGroup."""
+    line = "%s%2d%%" % (prefix, group.getPercent())
+    if len(group) > 1:
+        line += " of %d tasks" % len(group)
+    throughput = group.getThroughput()
+    if throughput and group.isSized():
+        line += " %s/s" % format_bytes(throughput)
+    eta = group.getETA()
+    if (eta is not None) and not group.isCompleted():
+        line += " ETA %d:%02d" % divmod(int(eta), 60)
+    # Pad to overwrite a longer previous line
+    return "%-40s" % line
+
+def format_task(status, sized=True):
+    """Return a line describing a task, given its status Record.
+
+    See ProgressGroup.getStatus(). Throughput is shown if sized is
+    True, i.e. it is in bytes per second."""
+    if status.completed:
+        state = "done" if status.resultCode == 0 else "failed"
+    elif not status.started:
+        state = "waiting"
     else:
-        progress.waitForCompletion()
+        state = "%2d%%" % status.percent
+        if sized and status.throughput:
+            state += " %s/s" % format_bytes(status.throughput)
+        if status.eta is not None:
+            state += " ETA %d:%02d" % divmod(int(status.eta), 60)
+    return "%-60s" % ("  %s: %s" % (status.label, state))
+
+def format_bytes(count):
+    """Return count of bytes as a human readable string."""
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if count < 1024:
+            return "%.1f %s" % (count, unit)
+        count /= 1024.0
+    return "%.1f TB" % count
 
 def print_vm(vm):
     """Given a VM instance, display all the information about it."""
-    print "VM: %s" % vm.name
-    print "  Id: %s" % vm.id
+    for line in describe_vm(vm):
+        print line
+
+def describe_vm(vm):
+    """Given a VM instance, return list of lines describing it."""
+    lines = []
+    record = vm.snapshot_record()
+    lines.append("VM: %s" % record.name)
+    lines.append("  Id: %s" % record.id)
     osType = vm.getOSType()
-    print "  OS: %s" % osType.description
-    print "  CPU count: %d" % vm.CPUCount
-    print "  RAM: %d MB" % vm.memorySize
-    print "  VRAM: %d MB" % vm.VRAMSize
-    print "  Monitors: %d" % vm.monitorCount
+    lines.append("  OS: %s" % osType.description)
+    lines.append("  CPU count: %d" % record.CPUCount)
+    lines.append("  RAM: %d MB" % record.memorySize)
+    lines.append("  VRAM: %d MB" % record.VRAMSize)
+    lines.append("  Monitors: %d" % record.monitorCount)
     attachments = vm.getMediumAttachments()
     for attachment in attachments:
-        medium = attachment.medium
-        type = attachment.type
-        print "  Device: %s" % type
-        if medium:
-            print "    Medium: %s" % medium.name
-            print "    Id: %s" % medium.id
-            print "    Location: %s" % medium.location
-            print "    Format: %s" % medium.format
-            print "    Size: %s" % medium.size
-        print "    Controller: %s Port: %d" % (attachment.controller,
-                                                 attachment.port)
+        attachment = attachment.fetch("medium", "type", "controller", "port")
+        lines.append("  Device: %s" % attachment.type)
+        if attachment.medium:
+            medium = attachment.medium.fetch("name", "id", "location",
+                                             "format", "size")
+            lines.append("    Medium: %s" % medium.name)
+            lines.append("    Id: %s" % medium.id)
+            lines.append("    Location: %s" % medium.location)
+            lines.append("    Format: %s" % medium.format)
+            lines.append("    Size: %s" % medium.size)
+        lines.append("    Controller: %s Port: %d" % (attachment.controller,
+                                                        attachment.port))
     snapshot = vm.getCurrentSnapshot()
     if snapshot:
-        print "  Current Snapshot: %s" % snapshot.name
+        lines.append("  Current Snapshot: %s" % snapshot.name)
+    return lines
+
+def get_cluster():
+    """Return a VirtualBoxCluster of the hosts given with --host.
+
+    The webservice password is taken from PYVBOX_PASSWORD."""
+    return VirtualBoxCluster(hosts,
+                             user=hostUser,
+                             password=os.environ.get("PYVBOX_PASSWORD", ""),
+                             timeout=hostTimeout)
+
+def machine_filters(args):
+    """Return filters for VirtualMachine.iterAll() from the command line.
+
+    args may hold a name pattern."""
+    filters = {}
+    if machineStates:
+        filters["state"] = [Constants.MachineState.value_of(state)
+                            for state in machineStates]
+    if machineOSTypes:
+        filters["osTypeId"] = machineOSTypes
+    if len(args) > 0:
+        filters["name"] = args.pop(0)
+    return filters
+
+def report_host_errors(errors):
+    """Given a dictionary of hosts to exceptions, report them to user."""
+    for host in sorted(errors.keys()):
+        errorMsg("Error from host %s: %s" % (host, errors[host]))
 
 #----------------------------------------------------------------------
 #
@@ -167,18 +320,29 @@ class AttachCommand(Command):
         vm = VirtualMachine.find(args.pop(0))
         if len(args) < 1:
             raise Exception("Missing hard disk filenames")
-        for hd in args:
-            hd = cls.harddisk(hd)
+        hds = [cls.harddisk(hd) for hd in args]
+        for hd in hds:
             verboseMsg("Attaching %s" % hd)
-            vm.attachMedium(hd)
+        # Attach all the disks under one lock, to free slots allocated
+        # together, and save settings once
+        vm.attachMediums(hds)
         return 0
 
 Command.register_command("attach", AttachCommand)
 
 class BackupCommand(Command):
-    """Back up a virtual machine to the given directory."""
+    """Back up a virtual machine to the given directory.
+
+    A running VM is paused while its disks are copied, unless --live
+    is given. Then it is only paused while a snapshot is taken, its
+    disks are copied from the snapshot as it keeps running, and the
+    snapshot is deleted afterwards. Either way the time the guest was
+    paused is reported."""
     usage = "backup <VM name> <target directory>"
 
+    # Description of the snapshots taken for live backups
+    snapshotDescription = "Taken by pyVBox for a live backup"
+
     @classmethod
     def invoke(cls, args):
         """Invoke the command. Return exit code for program."""
@@ -189,26 +353,86 @@ class BackupCommand(Command):
             raise Exception("Missing target directory argument")
         targetDir = args.pop(0)
         verboseMsg("Backing up %s to %s" % (vm, targetDir))
-        if vm.isRunning():
+        # Todo: Backup settings file in some way.
+        # Todo: Want to back up devices than hard drives?
+        if not vm.isRunning():
+            cls.backupDisks(vm.getHardDrives(), targetDir)
+        elif liveBackup:
+            cls.liveBackup(vm, targetDir)
+        else:
+            monitor = PauseMonitor(vm).start()
             verboseMsg("Pausing VM...")
             # Must wait until paused or will have race condition for lock
             # on disks.
             vm.pause(wait=True)
-            atexit.register(vm.resume)
-        # Todo: Backup settings file in some way.
-        # Todo: Want to back up devices than hard drives?
-        disks = vm.getHardDrives()
+            try:
+                cls.backupDisks(vm.getHardDrives(), targetDir)
+            finally:
+                vm.resume()
+                vm.waitUntilRunning()
+                monitor.stop()
+            message("Guest was paused for %.3f seconds" %
+                    monitor.getPauseTime())
+        return 0
+
+    @classmethod
+    def liveBackup(cls, vm, targetDir):
+        """Back up the disks of running vm from a snapshot."""
+        name = "pyVBox backup %s" % time.strftime("%Y-%m-%d %H:%M:%S")
+        monitor = PauseMonitor(vm).start()
+        try:
+            verboseMsg("Taking snapshot %s..." % name)
+            vm.takeSnapshot(name, cls.snapshotDescription)
+            snapshot = vm.findSnapshot(name)
+            try:
+                cls.backupDisks(snapshot.getHardDrives(), targetDir)
+            finally:
+                verboseMsg("Deleting snapshot %s..." % name)
+                show_progress(vm.deleteSnapshot(snapshot, wait=False),
+                              "Merging: ")
+        finally:
+            monitor.stop()
+        pauses = monitor.getPauses()
+        message("Guest was paused %d times for %.3f seconds (longest %.3f)"
+                % (len(pauses), monitor.getPauseTime(),
+                   monitor.getLongestPause()))
+
+    @classmethod
+    def backupDisks(cls, disks, targetDir):
+        """Copy disks to targetDir."""
+        if dedupBackup:
+            cls.storeDisks(disks, targetDir)
+            return
+        targets = []
         for disk in disks:
             targetFilename = os.path.join(targetDir, disk.basename())
             # Todo: Need to resolve file already existing here.
             verboseMsg("Backing up disk %s to %s (%d bytes)" % (disk,
                                                                 targetFilename,
                                                                 disk.size))
-            progress = disk.clone(targetFilename, wait=False)
-            show_progress(progress)
+            targets.append(targetFilename)
+        for clone in clone_disks(disks, targets):
             # Remove newly created clone from registry
-            clone = HardDisk.find(targetFilename)
             clone.close()
+
+    @classmethod
+    def storeDisks(cls, disks, targetDir):
+        """Store disks in the ChunkStore in targetDir."""
+        store = ChunkStore(targetDir)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        for disk in disks:
+            name = "%s-%s" % (os.path.splitext(disk.basename())[0], stamp)
+            verboseMsg("Storing disk %s as %s (%d bytes)" % (disk, name,
+                                                              disk.size))
+            def show(done, size):
+                if verbosityLevel > 0:
+                    print "%s: %2d%%\r" % (name, 100 * done / max(size, 1)),
+                    sys.stdout.flush()
+            # Differencing disks are flattened first
+            stats = store.backupMedium(disk, name, callback=show)
+            message("%s: %d of %d chunks new, %s written" %
+                    (name, stats.newChunks, stats.chunks,
+                     format_bytes(stats.bytesWritten)))
                    
 Command.register_command("backup", BackupCommand)
 
@@ -243,7 +467,10 @@ class BootVMCommand(Command):
 Command.register_command("boot", BootVMCommand)
 
 class CloneCommand(Command):
-    """Clone a VM. Cloned VM will be registered."""
+    """Clone a VM. Cloned VM will be registered.
+
+    With --linked, the clone gets differencing disks on top of those
+    of the source instead of full copies."""
     usage = "clone <source VM name> <target VM name>"
     
     @classmethod
@@ -255,10 +482,30 @@ class CloneCommand(Command):
         if len(args) < 1:
             raise Exception("Missing target VM name argument")
         targetName = args.pop(0)
-        message("Cloning %s to %s" % (srcVM, targetName))
+        start = time.time()
+        if linkedClone:
+            message("Linking %s to %s" % (targetName, srcVM))
+            cloneVM = srcVM.clone(targetName, linked=True)
+        else:
+            message("Cloning %s to %s" % (srcVM, targetName))
+            cloneVM = cls.fullClone(srcVM, targetName)
+        written = 0
+        for disk in cloneVM.getHardDrives():
+            # Read the space allocated now, not a value cached before
+            # the disk was written
+            disk.invalidate("size")
+            written += disk.size
+        message("Cloned %s in %.1f seconds, %s written" %
+                (cloneVM, time.time() - start, format_bytes(written)))
+        return 0
+
+    @classmethod
+    def fullClone(cls, srcVM, targetName):
+        """Clone srcVM with copies of its disks. Returns the clone."""
         cloneVM = srcVM.clone(targetName)
         # Now clone and attach disks
         disks = srcVM.getHardDrives()
+        targets = []
         for disk in disks:
             # Generate new HD filename by prefixing new VM name.
             # Not the greatest, but not sure what the best way is.
@@ -269,12 +516,12 @@ class CloneCommand(Command):
                     % (disk,
                        os.path.basename(targetFilename),
                        disk.size))
-            progress = disk.clone(targetFilename, wait=False)
-            show_progress(progress)
-            cloneHD = HardDisk.find(targetFilename)
+            targets.append(targetFilename)
+        cloneHDs = clone_disks(disks, targets)
+        for cloneHD in cloneHDs:
             message("Attaching %s to %s" % (cloneHD, cloneVM))
-            cloneVM.attachMedium(cloneHD)
-        return 0
+        cloneVM.attachMediums(cloneHDs)
+        return cloneVM
 
 Command.register_command("clone", CloneCommand)
 
@@ -298,6 +545,24 @@ class CloneHDCommand(Command):
 
 Command.register_command("clonehd", CloneHDCommand)
 
+class ConstantsCommand(Command):
+    """Save the VirtualBox constants for use without VirtualBox"""
+    usage = "constants <path>"
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        if len(args) < 1:
+            raise Exception("Missing path argument")
+        path = args.pop(0)
+        Constants.save(path)
+        verboseMsg("Saved constants for VirtualBox %s r%s to %s" %
+                   (Constants.getVersion() + (path,)))
+        message("Set PYVBOX_CONSTANTS=%s to use them" % path)
+        return 0
+
+Command.register_command("constants", ConstantsCommand)
+
 class CreateHDCommand(Command):
     """Create a hard disk"""
     usage = "createhd <size in MB or given suffix> <path>"
@@ -377,22 +642,73 @@ class HelpCommand(Command):
 
 Command.register_command("help", HelpCommand)
 
+class HistoryCommand(Command):
+    """Display throughput of past operations by kind and directory"""
+    usage = "history [<operation>]"
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        operation = args.pop(0) if args else None
+        history = OperationHistory.getDefault()
+        records = history.getRecords(operation)
+        keys = []
+        for record in records:
+            key = (record.operation, record.directory)
+            if key not in keys:
+                keys.append(key)
+        for operation, directory in keys:
+            runs = history.getRecords(operation, directory)
+            last = runs[-1]
+            line = "%s %s: %d runs" % (operation, directory, len(runs))
+            throughput = history.getThroughput(operation, directory)
+            if throughput:
+                line += ", %s/s recently" % format_bytes(throughput)
+                if last.bytesPerSecond:
+                    line += " (last %s/s)" % format_bytes(last.bytesPerSecond)
+            else:
+                line += ", %d:%02d last" % divmod(int(last.seconds), 60)
+            print line
+            if verbosityLevel > 1:
+                for description, seconds in last.steps:
+                    print "    %s: %.1fs" % (description, seconds)
+        return 0
+
+Command.register_command("history", HistoryCommand)
+
 class ListCommand(Command):
     """Display a list of all available virtual machines"""
-    usage = "list"
+    usage = "list [<name pattern>]"
 
     @classmethod
     def invoke(cls, args):
         """Invoke the command. Return exit code for program."""
-        vms = VirtualMachine.getAll()
-        for vm in vms:
+        if hosts:
+            return cls.invoke_cluster(args)
+        # Print each machine as we get to it rather than waiting for
+        # all of them.
+        for vm in VirtualMachine.iterAll(**machine_filters(args)):
             try:
                 print vm.name
+                sys.stdout.flush()
             except VirtualBoxException as e:
                 if verbosityLevel > 1:
                     errorMsg("Unknown machine: %s"%e)
         return 0
 
+    @classmethod
+    def invoke_cluster(cls, args):
+        """Invoke the command for the hosts given with --host."""
+        cluster = get_cluster()
+        try:
+            machines = cluster.getMachines("name", **machine_filters(args))
+        finally:
+            cluster.close()
+        for machine in machines:
+            print "%s: %s" % (machine.host, machine.name)
+        report_host_errors(machines.errors)
+        return 1 if machines.errors else 0
+
 Command.register_command("list", ListCommand)
 
 class OSTypesCommand(Command):
@@ -402,7 +718,7 @@ class OSTypesCommand(Command):
     @classmethod
     def invoke(cls, args):
         """Invoke the command. Return exit code for program."""
-        osTypes = VirtualBox().getGuestOSTypes()
+        osTypes = VirtualBox.getDefault().guestOSTypes
         for ostype in osTypes:
             print "%s (%s)" % (ostype.description, ostype.id)
         return 0
@@ -444,6 +760,33 @@ class RegisterCommand(Command):
 
 Command.register_command("register", RegisterCommand)
 
+class RestoreCommand(Command):
+    """Restore a disk image from a backup made with backup --dedup.
+
+    Without a backup name, lists the backups in the directory."""
+    usage = "restore <backup directory> [<backup name> <target path>]"
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        if len(args) < 1:
+            raise Exception("Missing backup directory argument")
+        store = ChunkStore(args.pop(0))
+        if len(args) < 1:
+            for name in store.getNames():
+                print name
+            return 0
+        name = args.pop(0)
+        if len(args) < 1:
+            raise Exception("Missing target path argument")
+        target = args.pop(0)
+        verboseMsg("Restoring %s to %s" % (name, target))
+        # Chunks are checked as they are read
+        store.restore(name, target)
+        return 0
+
+Command.register_command("restore", RestoreCommand)
+
 class ResumeCommand(Command):
     """Resume a paused VM"""
     usage = "resume <VM name>"
@@ -520,8 +863,10 @@ class VMCommand(Command):
 
     @classmethod
     def invoke(cls, args):
+        if hosts:
+            return cls.invoke_cluster(args)
         if len(args) == 0:
-            vms = VirtualMachine.getAll()
+            vms = VirtualMachine.iterAll(**machine_filters(args))
             verboseMsg("Registered VMs:")
             for vm in vms:
                 try:
@@ -536,12 +881,57 @@ class VMCommand(Command):
                 except Exception as e:
                     errorMsg("Could not display information about VM \"%s\": %s" % (vmName, str(e)))
 
+    @classmethod
+    def invoke_cluster(cls, args):
+        """Invoke the command for the hosts given with --host."""
+        cluster = get_cluster()
+        status = 0
+        try:
+            if len(args) == 0:
+                machines = cluster.getMachines("name",
+                                               **machine_filters(args))
+                verboseMsg("Registered VMs:")
+                for machine in machines:
+                    print "\t%s: %s" % (machine.host, machine.name)
+                report_host_errors(machines.errors)
+                if machines.errors:
+                    status = 1
+            for vmName in args:
+                results = cluster.run(cls.describe, vmName)
+                found = False
+                for result in results:
+                    if result.value is None:
+                        continue
+                    found = True
+                    print "Host: %s" % result.host
+                    print "\n".join(result.value)
+                report_host_errors(results.errors)
+                if results.errors:
+                    status = 1
+                elif not found:
+                    errorMsg("Could not find VM \"%s\" on any host" % vmName)
+                    status = 1
+        finally:
+            cluster.close()
+        return status
+
+    @staticmethod
+    def describe(vmName):
+        """Return lines describing the named VM, None if it isn't found."""
+        try:
+            vm = VirtualMachine.find(vmName)
+        except VirtualBoxObjectNotFoundException:
+            return None
+        return describe_vm(vm)
+
 Command.register_command("vm", VMCommand)
 
 #----------------------------------------------------------------------
 
 def main(argv=None):
-    global verbosityLevel
+    global verbosityLevel, hosts, hostUser, hostTimeout
+    global machineStates, machineOSTypes, linkedClone, cloneJobs
+    global liveBackup, dedupBackup
 
     if argv is None:
         argv = sys.argv
@@ -555,6 +945,31 @@ def main(argv=None):
     parser.add_option("-v", "--verbose", dest="verbosityLevel",
                       action="store_const", const=2,
                       help="be verbose")
+    parser.add_option("-H", "--host", dest="hosts", action="append",
+                      default=[], metavar="HOST",
+                      help="query the VirtualBox webservice on HOST, may be given more than once or as a comma-separated list (list and vm commands only)")
+    parser.add_option("-u", "--user", dest="user", default="",
+                      help="user for the VirtualBox webservice, password is read from PYVBOX_PASSWORD")
+    parser.add_option("-t", "--timeout", dest="timeout", type="float",
+                      default=30,
+                      help="seconds to wait for each host (default: %default)")
+    parser.add_option("-s", "--state", dest="states", action="append",
+                      default=[], metavar="STATE",
+                      help="only machines in STATE, e.g. Running, may be given more than once (list and vm commands only)")
+    parser.add_option("-o", "--ostype", dest="osTypes", action="append",
+                      default=[], metavar="OSTYPE",
+                      help="only machines with guest OS type OSTYPE, e.g. Ubuntu, may be given more than once (list and vm commands only)")
+    parser.add_option("-l", "--linked", dest="linked", action="store_true",
+                      default=False,
+                      help="create a linked clone using differencing disks on a snapshot of the source (clone command only)")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4,
+                      help="clone at most JOBS disks at once, disks on the same filesystem are cloned one at a time (backup and clone commands only, default: %default)")
+    parser.add_option("-L", "--live", dest="live", action="store_true",
+                      default=False,
+                      help="back up a running VM from a snapshot instead of pausing it while its disks are copied (backup command only)")
+    parser.add_option("-D", "--dedup", dest="dedup", action="store_true",
+                      default=False,
+                      help="back up to a deduplicating chunk store, only writing chunks not already in it (backup command only)")
     (options, args) = parser.parse_args()
     if len(args) < 1:
         parser.error("missing command")
@@ -564,6 +979,17 @@ def main(argv=None):
         verbosityLevel = options.verbosityLevel
         verboseMsg("Setting verbosity level to %d" % verbosityLevel)
 
+    for option in options.hosts:
+        hosts.extend(filter(None, option.split(",")))
+    hostUser = options.user
+    hostTimeout = options.timeout
+    machineStates = options.states
+    machineOSTypes = options.osTypes
+    linkedClone = options.linked
+    cloneJobs = max(1, options.jobs)
+    liveBackup = options.live
+    dedupBackup = options.dedup
+
     try:
         command = Command.lookup_command_by_name(commandStr)
     except Exception, e: